@@ -0,0 +1,421 @@
+'''Benchmark suite for pyRavenMatrices.
+
+Measures throughput (operations per second) and allocation (peak traced
+memory per operation) of figure sampling, element tree operations,
+transformations and rendering of every sandia shape and modifier. Results are
+written as JSON so that runs on different versions can be compared::
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+
+Timings are the best of ``--repeat`` passes over the same inputs. Allocation
+is measured in a separate pass under ``tracemalloc``, so that tracing does not
+distort timings.
+
+Versions
+--------
+
+The suite only relies on APIs present in every version of the package, so
+that earlier versions can be measured as well; put the version to measure
+first on the path, e.g.::
+
+    PYTHONPATH=old/checkout python benchmarks/run.py --output before.json
+
+Benchmarks of features missing from the version under test are left out.
+Benchmarks that fail, e.g. because the feature they measure is broken in that
+version, are reported with their error instead of results.
+'''
+
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Sequence, Union
+import cairo
+import numpy as np
+
+# The package is looked up on the regular path first, so that installed or
+# PYTHONPATH versions can be benchmarked; this tree is the fallback and also
+# provides the element builders shared with the tests.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyRavenMatrices.lib.sandia.definitions as defs
+import pyRavenMatrices.lib.sandia.generators as gen
+from pyRavenMatrices.element import BasicElement, get_subtrees
+from pyRavenMatrices.matrix import CellStructure
+from pyRavenMatrices.transformation import Transformation, get_targets
+from tests.helpers import basic, modified
+
+try:
+    import pyRavenMatrices.render as render
+except ImportError: # Versions predating the render module
+    render = None
+
+try:
+    import pyRavenMatrices.lib.sandia.raster as raster
+except ImportError: # Versions predating the NumPy rasterizer
+    raster = None
+
+
+SHAPES = [
+    defs.ellipse, defs.triangle, defs.rectangle, defs.trapezoid,
+    defs.diamond, defs.tee
+]
+MODIFIERS = [defs.scale, defs.rotation, defs.shading, defs.numerosity]
+SIZES = [64, 128, 256]
+# Modifiers wrapped by numerosity in instancing benchmarks, innermost first.
+INNER_MODIFIERS = [
+    (defs.rotation, {}), (defs.scale, {'factor': .75}), (defs.shading, {})
+]
+# Render profiles compared on sandia figures; A8 against the ARGB32 default.
+PROFILES = ['DEFAULT_PROFILE', 'GRAYSCALE_PROFILE', 'PREVIEW_PROFILE']
+
+
+class Benchmark(object):
+    '''A named operation applied to each of a list of inputs.
+
+    Inputs may be given as a callable returning them, in which case they are 
+    built when the benchmark is run.
+    '''
+
+    def __init__(
+        self, 
+        name : str, 
+        op : Callable[[Any], Any], 
+        inputs : Union[Sequence[Any], Callable[[], Sequence[Any]]]
+    ) -> None:
+
+        self.name = name
+        self.op = op
+        self.inputs = inputs
+
+    def run(self, repeat : int, alloc_samples : int) -> Dict[str, Any]:
+        '''Time and trace ``self`` and return the results.
+
+        If building the inputs or running the operation fails, results are 
+        ``None`` and the error is reported under ``'error'``.
+        '''
+
+        try:
+            return self._run(repeat, alloc_samples)
+        except Exception as e:
+            return {
+                'name': self.name,
+                'n': None,
+                'seconds': None,
+                'ops_per_sec': None,
+                'peak_bytes_per_op': None,
+                'error': repr(e)
+            }
+
+    def _run(self, repeat, alloc_samples):
+
+        op, inputs = self.op, self.inputs
+        if callable(inputs):
+            inputs = inputs()
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for item in inputs:
+                op(item)
+            best = min(best, time.perf_counter() - start)
+
+        samples = inputs[:alloc_samples]
+        peaks = []
+        tracemalloc.start()
+        try:
+            for item in samples:
+                if sys.version_info >= (3, 9):
+                    tracemalloc.reset_peak()
+                else: # Clearing traces also resets the peak
+                    tracemalloc.clear_traces()
+                base, _ = tracemalloc.get_traced_memory()
+                op(item)
+                _, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - base)
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'name': self.name,
+            'n': len(inputs),
+            'seconds': best,
+            'ops_per_sec': len(inputs) / best if best > 0 else None,
+            'peak_bytes_per_op': float(np.mean(peaks)) if peaks else None
+        }
+
+
+def figures(n : int, seed : int) -> List[Any]:
+    '''Return ``n`` sandia figures drawn after seeding numpy with ``seed``.
+    '''
+
+    sg = gen.StructureGenerator()
+    rg = gen.RoutineGenerator()
+    dg = gen.DecoratorGenerator()
+    np.random.seed(seed)
+    return [gen.generate_sandia_figure(sg, rg, dg) for _ in range(n)]
+
+
+def draw_cell(
+    ctx : cairo.Context, element : Any, cell_structure : CellStructure
+) -> None:
+    '''Draw ``element`` in a blank cell, as ``render.draw_cell`` does.'''
+
+    ctx.save()
+    ctx.set_source_rgb(1., 1., 1.)
+    ctx.paint()
+    ctx.set_source_rgb(0., 0., 0.)
+    ctx.set_line_width(2.)
+    element.draw_in_context(ctx, cell_structure)
+    ctx.stroke()
+    ctx.restore()
+
+
+def transformation_for(figure : Any) -> Transformation:
+    '''Return a transformation rewriting every leaf of ``figure``.'''
+
+    triples = []
+    for target in get_targets(figure):
+        node = target(figure)
+        if isinstance(node, BasicElement):
+            value = {'routine': defs.ellipse, 'params': {'r': 2}}
+        else:
+            value = {'decorator': node.decorator, 'params': dict(node.params)}
+        triples.append((target, copy.deepcopy(node), value))
+    return Transformation(*triples)
+
+
+def benchmarks(n : int, seed : int, sizes : Sequence[int]) -> List[Benchmark]:
+    '''Return the benchmark suite.'''
+
+    sg = gen.StructureGenerator()
+    rg = gen.RoutineGenerator()
+    dg = gen.DecoratorGenerator()
+    calls = range(n)
+    sample = figures(n, seed)
+    copies = copy.deepcopy(sample)
+
+    def transformations():
+        return list(zip(map(transformation_for, sample), sample))
+
+    suite = [
+        Benchmark('StructureGenerator.sample', lambda _: sg.sample(), calls),
+        Benchmark(
+            'generate_sandia_figure',
+            lambda _: gen.generate_sandia_figure(sg, rg, dg),
+            calls
+        ),
+        Benchmark('get_subtrees', get_subtrees, sample),
+        Benchmark(
+            'ElementNode.__eq__',
+            lambda pair: pair[0] == pair[1],
+            list(zip(sample, copies))
+        ),
+        Benchmark(
+            'Transformation.__call__',
+            lambda pair: pair[0](pair[1]),
+            transformations
+        ),
+        Benchmark('get_targets', get_targets, sample)
+    ]
+
+    renders = max(n // 10, 1)
+    for size in sizes:
+        margin = size // 8
+        cell_structure = CellStructure('bench', size, size, margin, margin)
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+        ctx = cairo.Context(surface)
+
+        def draw(element, cell_structure=cell_structure, ctx=ctx):
+            draw_cell(ctx, element, cell_structure)
+            surface.flush()
+
+        for shape in SHAPES:
+            element = basic(shape)
+            suite.append(
+                Benchmark(
+                    'render/{}/{}'.format(shape.__name__, size),
+                    draw,
+                    [element] * renders
+                )
+            )
+        base = basic(defs.trapezoid)
+        for decorator in MODIFIERS:
+            suite.append(
+                Benchmark(
+                    'render/{}/{}'.format(decorator.__name__, size),
+                    draw,
+                    [modified(base, (decorator, {}))] * renders
+                )
+            )
+        # Each figure is rendered into the same slot of a one-cell batch.
+        for name in PROFILES:
+            profile = getattr(render, name, None)
+            if profile is None:
+                continue
+
+            def draw_batch(
+                element, 
+                cell_structure=cell_structure, 
+                profile=profile, 
+                out=np.empty((1, size, size), profile.dtype)
+            ):
+                render.render_batch(
+                    [element], cell_structure, out=out, profile=profile
+                )
+
+            suite.append(
+                Benchmark(
+                    'render_batch/{}/{}'.format(
+                        name[:-len('_PROFILE')].lower(), size
+                    ),
+                    draw_batch,
+                    sample[:renders]
+                )
+            )
+        # The same batches through the NumPy rasterizer, to compare with
+        # render_batch/default.
+        if raster is not None:
+
+            def draw_numpy(
+                element, 
+                cell_structure=cell_structure, 
+                out=np.empty((1, size, size), render.DEFAULT_PROFILE.dtype)
+            ):
+                raster.render_batch(
+                    [element], cell_structure, out=out, backend='numpy'
+                )
+
+            suite.append(
+                Benchmark(
+                    'render_batch/numpy/{}'.format(size),
+                    draw_numpy,
+                    sample[:renders]
+                )
+            )
+        # Numerosity drawing copies directly or from a display list (see
+        # render.RenderProfile.instancing), by number of modifiers it wraps.
+        if not hasattr(render, 'RenderContext'):
+            continue
+        for depth in range(len(INNER_MODIFIERS) + 1):
+            modifiers = INNER_MODIFIERS[:depth] + [
+                (defs.numerosity, {'number': 8})
+            ]
+            element = modified(base, *modifiers)
+            for mode, enabled in (('direct', False), ('instanced', True)):
+                profile = render.RenderProfile(instancing=enabled)
+
+                def draw_profile(
+                    element, 
+                    cell_structure=cell_structure, 
+                    ctx=profile.context(profile.create_surface(cell_structure))
+                ):
+                    draw_cell(ctx, element, cell_structure)
+                    ctx.get_target().flush()
+
+                suite.append(
+                    Benchmark(
+                        'render/numerosity-{}/depth{}/{}'.format(
+                            mode, depth, size
+                        ),
+                        draw_profile,
+                        [element] * renders
+                    )
+                )
+    return suite
+
+
+def metadata(args : argparse.Namespace) -> Dict[str, Any]:
+
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'cairo': cairo.cairo_version_string(),
+        'pycairo': cairo.version,
+        'n': args.n,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'sizes': args.sizes
+    }
+
+
+def compare(results : List[Dict], baseline : List[Dict]) -> None:
+    '''Print throughput of ``results`` relative to ``baseline``.'''
+
+    previous = {result['name']: result for result in baseline}
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None or not (result['ops_per_sec'] and old['ops_per_sec']):
+            continue
+        ratio = result['ops_per_sec'] / old['ops_per_sec']
+        print(
+            '{:<40} {:>8.2f}x'.format(result['name'], ratio), file=sys.stderr
+        )
+
+
+def main(argv : Sequence[str] = None) -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '-n', type=int, default=1000,
+        help='inputs per benchmark (a tenth of that for rendering)'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='timed passes per benchmark'
+    )
+    parser.add_argument(
+        '--alloc-samples', type=int, default=100,
+        help='operations traced for allocation per benchmark'
+    )
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=SIZES,
+        help='cell sizes for rendering benchmarks, in px'
+    )
+    parser.add_argument(
+        '--filter', default='', help='only run benchmarks containing this'
+    )
+    parser.add_argument(
+        '--output', default='-', help='JSON output path, - for stdout'
+    )
+    parser.add_argument(
+        '--compare', help='JSON results of an earlier run to compare against'
+    )
+    args = parser.parse_args(argv)
+
+    results = []
+    for benchmark in benchmarks(args.n, args.seed, args.sizes):
+        if args.filter in benchmark.name:
+            result = benchmark.run(args.repeat, args.alloc_samples)
+            results.append(result)
+            if result['ops_per_sec'] is None:
+                line = '{:<40} {:>12}'.format(
+                    result['name'], result.get('error', 'n/a')
+                )
+            else:
+                line = '{name:<40} {ops_per_sec:>12.1f} ops/s'.format(**result)
+            print(line, file=sys.stderr)
+
+    report = {'meta': metadata(args), 'results': results}
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+'''This module provides a cache for rendered cells.
+
+Generated problems draw the same figures over and over (e.g., answer
+alternatives repeating context cells). A ``RasterCache`` maps the structural
+key of an element (see ``ElementNode.key``), cell geometry, render profile
+and line width to the pixels of the rendered cell, so that repeated figures
+are rendered only once. Pass a cache to ``render.render_batch`` or
+``render.MatrixRenderer`` to have cached cells copied in instead of drawn.
+'''
+
+
+import collections
+from typing import Hashable, Optional
+import numpy as np
+from pyRavenMatrices.matrix import CellStructure
+from pyRavenMatrices.element import Element
+from pyRavenMatrices.render import (
+    render_array, LINE_WIDTH, DEFAULT_PROFILE, RenderProfile
+)
+
+
+class CacheStats(object):
+    '''Hit, miss and eviction counts for a cache.'''
+
+    def __init__(self) -> None:
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+
+        return 'CacheStats(hits={}, misses={}, evictions={})'.format(
+            self.hits, self.misses, self.evictions
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        '''Fraction of lookups that were hits.'''
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+
+class RasterCache(object):
+    '''An LRU cache of rendered cells with a byte budget.
+
+    Usage::
+
+        cache = RasterCache(max_bytes=64 * 2 ** 20)
+        pixels = cache.render(element, cell_structure)
+
+    Cached pixels are read-only ``(height, width)`` arrays without row 
+    padding, of the dtype of the profile they were rendered with (see 
+    ``render.surface_array``).
+    '''
+
+    def __init__(
+        self, max_bytes : int = 256 * 2 ** 20, line_width : float = LINE_WIDTH
+    ) -> None:
+        '''
+        Initialize a raster cache.
+
+        :param max_bytes: Maximum total size of cached pixel data. Least
+            recently used cells are evicted first once it is exceeded.
+        :param line_width: Default width of figure outlines, in px.
+        '''
+
+        self.max_bytes = max_bytes
+        self.line_width = line_width
+        self.stats = CacheStats()
+        self.nbytes = 0
+        self._entries : collections.OrderedDict = collections.OrderedDict()
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def __contains__(self, key : Hashable) -> bool:
+
+        return key in self._entries
+
+    def key(
+        self,
+        element : Element,
+        cell_structure : CellStructure,
+        profile : RenderProfile = None,
+        line_width : float = None
+    ) -> Hashable:
+        '''Return cache key for ``element`` drawn in ``cell_structure``.
+
+        ``profile`` defaults to ``render.DEFAULT_PROFILE`` and ``line_width``
+        to ``self.line_width``.
+        '''
+
+        if profile is None:
+            profile = DEFAULT_PROFILE
+        if line_width is None:
+            line_width = self.line_width
+        return (
+            element.key(),
+            cell_structure.width,
+            cell_structure.height,
+            cell_structure.horizontal_margin,
+            cell_structure.vertical_margin,
+            profile.format,
+            profile.antialias,
+            profile.tolerance,
+            line_width
+        )
+
+    def get(self, key : Hashable) -> Optional[np.ndarray]:
+        '''Return cached pixel data for ``key``, or ``None`` if absent.'''
+
+        data = self._entries.get(key)
+        if data is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key : Hashable, data : np.ndarray) -> None:
+        '''Store pixel data under ``key``, evicting old entries as needed.
+
+        Data larger than ``max_bytes`` is not stored.
+        '''
+
+        if data.nbytes > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self._entries[key] = data
+        self.nbytes += data.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.stats.evictions += 1
+
+    def render(
+        self,
+        element : Element,
+        cell_structure : CellStructure,
+        profile : RenderProfile = None,
+        line_width : float = None
+    ) -> np.ndarray:
+        '''Return pixels of ``element``, rendering it on a cache miss.
+
+        :param element: The element to render.
+        :param cell_structure: Structure of the cell being rendered.
+        :param profile: Render profile, defaults to
+            ``render.DEFAULT_PROFILE``. Cells rendered with different
+            profiles are cached separately.
+        :param line_width: Width of figure outlines, in px, defaults to 
+            ``self.line_width``.
+        '''
+
+        if profile is None:
+            profile = DEFAULT_PROFILE
+        if line_width is None:
+            line_width = self.line_width
+        key = self.key(element, cell_structure, profile, line_width)
+        data = self.get(key)
+        if data is None:
+            # Copying drops row padding and the surface holding the pixels.
+            data = render_array(
+                element, cell_structure, line_width, profile
+            ).copy()
+            data.flags.writeable = False
+            self.put(key, data)
+        return data
+
+    def clear(self) -> None:
+        '''Discard all cached cells; statistics are kept.'''
+
+        self._entries.clear()
+        self.nbytes = 0
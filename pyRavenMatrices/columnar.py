@@ -0,0 +1,374 @@
+'''This module provides a columnar container for collections of elements.
+
+A ``FigureTable`` stores a collection of element trees as a handful of flat
+NumPy arrays (struct-of-arrays) instead of as Python object graphs. Tables
+are compact and support vectorized bulk queries, such as finding all figures
+using a given decorator or counting figures by routine.
+
+Layout
+------
+
+Nodes of all figures are stored in one set of per-node arrays, figure by
+figure, each figure in pre-order. The nodes of figure ``i`` occupy
+``figure_offsets[i]:figure_offsets[i + 1]``.
+
+- ``kind``: node kind (``BASIC``, ``MODIFIED``, ``COMPOSITE``, ``EMPTY`` or
+  ``MODIFIER``).
+- ``parent``: index of the parent node, ``-1`` for roots.
+- ``child_count``: number of children. Children of a modified element are its
+  base element followed by its modifiers.
+- ``code``: registry code of the routine or decorator, ``-1`` for nodes
+  without one.
+- ``param_offsets``: params of node ``j`` occupy
+  ``param_offsets[j]:param_offsets[j + 1]`` in ``param_names``,
+  ``param_values`` and ``param_types``.
+
+Param names are stored as indices into ``names``. Param values are stored as
+floats, together with their original type, so that conversion back to
+elements is lossless.
+'''
+
+
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Union
+import numpy as np
+from pyRavenMatrices.element import (
+    Element, BasicElement, ElementModifier, ModifiedElement, CompositeElement,
+    EmptyElement
+)
+from pyRavenMatrices.registry import Registry
+
+
+BASIC, MODIFIED, COMPOSITE, EMPTY, MODIFIER = range(5)
+FLOAT, INT, BOOL = range(3)
+
+
+class FigureTable(object):
+    '''A columnar collection of element trees.'''
+
+    def __init__(
+        self,
+        figure_offsets : np.ndarray,
+        kind : np.ndarray,
+        parent : np.ndarray,
+        child_count : np.ndarray,
+        code : np.ndarray,
+        param_offsets : np.ndarray,
+        param_names : np.ndarray,
+        param_values : np.ndarray,
+        param_types : np.ndarray,
+        names : Sequence[str],
+        registry : Registry
+    ) -> None:
+        '''
+        Initialize a figure table from its columns.
+
+        Tables are usually built with ``FigureTable.from_elements``. See
+        module documentation for column layout.
+        '''
+
+        self.figure_offsets = figure_offsets
+        self.kind = kind
+        self.parent = parent
+        self.child_count = child_count
+        self.code = code
+        self.param_offsets = param_offsets
+        self.param_names = param_names
+        self.param_values = param_values
+        self.param_types = param_types
+        self.names = tuple(names)
+        self.registry = registry
+
+    @classmethod
+    def from_elements(
+        cls, elements : Iterable[Element], registry : Registry = None
+    ) -> 'FigureTable':
+        '''Build a table holding ``elements``.
+
+        :param elements: Elements to store.
+        :param registry: Registry used to encode routines and decorators.
+            Unregistered functions are registered on the fly. A new registry
+            is created if ``None``.
+        '''
+
+        if registry is None:
+            registry = Registry()
+        encoder = _Encoder(registry)
+        figure_offsets = [0]
+        for element in elements:
+            encoder.encode(element, -1)
+            figure_offsets.append(len(encoder.kind))
+
+        return cls(
+            np.array(figure_offsets, dtype=np.int64),
+            np.array(encoder.kind, dtype=np.uint8),
+            np.array(encoder.parent, dtype=np.int64),
+            np.array(encoder.child_count, dtype=np.int32),
+            np.array(encoder.code, dtype=np.int32),
+            np.array(encoder.param_offsets, dtype=np.int64),
+            np.array(encoder.param_names, dtype=np.int32),
+            np.array(encoder.param_values, dtype=np.float64),
+            np.array(encoder.param_types, dtype=np.uint8),
+            list(encoder.names),
+            registry
+        )
+
+    def __len__(self):
+
+        return len(self.figure_offsets) - 1
+
+    def __getitem__(self, index : int) -> Element:
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Figure index out of range')
+        element, _ = self._decode(int(self.figure_offsets[index]))
+        return element
+
+    def __iter__(self) -> Iterator[Element]:
+
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+
+        return 'FigureTable({} figures, {} nodes)'.format(
+            len(self), len(self.kind)
+        )
+
+    @property
+    def nbytes(self) -> int:
+        '''Total size of the table columns in bytes.'''
+
+        return sum(
+            column.nbytes for column in (
+                self.figure_offsets, self.kind, self.parent, self.child_count,
+                self.code, self.param_offsets, self.param_names,
+                self.param_values, self.param_types
+            )
+        )
+
+    @property
+    def node_figure(self) -> np.ndarray:
+        '''Index of the figure each node belongs to.'''
+
+        return np.repeat(
+            np.arange(len(self)), np.diff(self.figure_offsets)
+        )
+
+    def to_elements(self) -> List[Element]:
+        '''Return all figures as element trees.'''
+
+        return list(self)
+
+    def count(self, function : Callable) -> np.ndarray:
+        '''Return number of uses of ``function`` in each figure.
+
+        :param function: A registered drawing routine or decorator.
+        '''
+
+        if function not in self.registry:
+            return np.zeros(len(self), dtype=np.int64)
+        nodes = self.code == self.registry.code(function)
+        return np.bincount(self.node_figure[nodes], minlength=len(self))
+
+    def contains(self, function : Callable) -> np.ndarray:
+        '''Return boolean mask of figures using ``function``.'''
+
+        return self.count(function) > 0
+
+    def count_by_function(
+        self, per_figure : bool = True
+    ) -> Dict[Callable, int]:
+        '''Count figures (or nodes) using each routine and decorator.
+
+        :param per_figure: If ``True``, count each figure at most once per
+            function, otherwise count every node.
+        '''
+
+        nodes = self.code >= 0
+        codes = self.code[nodes]
+        if per_figure:
+            pairs = np.unique(
+                np.stack([self.node_figure[nodes], codes]), axis=1
+            )
+            codes = pairs[1]
+        counts = np.bincount(codes)
+        return {
+            self.registry.function(code): int(counts[code])
+            for code in np.flatnonzero(counts)
+        }
+
+    def select(
+        self, indices : Union[np.ndarray, Sequence[int]]
+    ) -> 'FigureTable':
+        '''Return a new table holding the selected figures.
+
+        :param indices: Figure indices, or a boolean mask over figures. 
+            Negative indices count from the end, as in ``__getitem__``.
+        '''
+
+        indices = np.asarray(indices)
+        if indices.dtype != bool:
+            indices = indices.astype(np.intp)
+        # Turns masks and negative indices into positions and rejects
+        # indices out of range.
+        indices = np.arange(len(self))[indices]
+
+        nodes, figure_offsets = _gather(self.figure_offsets, indices)
+        # Shift parent pointers to the new positions of their figures.
+        shift = np.repeat(
+            figure_offsets[:-1] - self.figure_offsets[indices],
+            np.diff(figure_offsets)
+        )
+        parent = self.parent[nodes]
+        parent = np.where(parent >= 0, parent + shift, -1)
+        params, param_offsets = _gather(self.param_offsets, nodes)
+
+        return type(self)(
+            figure_offsets,
+            self.kind[nodes],
+            parent,
+            self.child_count[nodes],
+            self.code[nodes],
+            param_offsets,
+            self.param_names[params],
+            self.param_values[params],
+            self.param_types[params],
+            self.names,
+            self.registry
+        )
+
+    def _params(self, node):
+
+        start, stop = self.param_offsets[node], self.param_offsets[node + 1]
+        params = {}
+        for name, value, type_ in zip(
+            self.param_names[start:stop],
+            self.param_values[start:stop],
+            self.param_types[start:stop]
+        ):
+            if type_ == INT:
+                value = int(value)
+            elif type_ == BOOL:
+                value = bool(value)
+            else:
+                value = float(value)
+            params[self.names[name]] = value
+        return params
+
+    def _decode(self, node):
+        '''Decode subtree rooted at ``node``; return it and the next node.'''
+
+        kind = self.kind[node]
+        if kind == BASIC:
+            element = BasicElement()
+            element.routine = self.registry.function(int(self.code[node]))
+            element.params = self._params(node)
+            return element, node + 1
+        elif kind == MODIFIER:
+            modifier = ElementModifier()
+            modifier.decorator = self.registry.function(int(self.code[node]))
+            modifier.params = self._params(node)
+            return modifier, node + 1
+        elif kind == EMPTY:
+            return EmptyElement(), node + 1
+
+        children = []
+        child = node + 1
+        for _ in range(self.child_count[node]):
+            sub, child = self._decode(child)
+            children.append(sub)
+        if kind == MODIFIED:
+            return ModifiedElement(*children), child
+        elif kind == COMPOSITE:
+            return CompositeElement(*children), child
+        else:
+            raise ValueError('Unexpected node kind {}'.format(kind))
+
+
+class _Encoder(object):
+    '''Accumulates table columns for a sequence of elements.'''
+
+    def __init__(self, registry : Registry) -> None:
+
+        self.registry = registry
+        self.names : Dict[str, int] = {}
+        self.kind : List[int] = []
+        self.parent : List[int] = []
+        self.child_count : List[int] = []
+        self.code : List[int] = []
+        self.param_offsets : List[int] = [0]
+        self.param_names : List[int] = []
+        self.param_values : List[float] = []
+        self.param_types : List[int] = []
+
+    def encode(self, node, parent):
+
+        if isinstance(node, BasicElement):
+            self._node(BASIC, parent, 0, node.routine, node.params)
+        elif isinstance(node, ElementModifier):
+            self._node(MODIFIER, parent, 0, node.decorator, node.params)
+        elif isinstance(node, ModifiedElement):
+            index = self._node(
+                MODIFIED, parent, 1 + len(node.modifiers), None, {}
+            )
+            self.encode(node.element, index)
+            for modifier in node.modifiers:
+                self.encode(modifier, index)
+        elif isinstance(node, CompositeElement):
+            index = self._node(COMPOSITE, parent, len(node.elements), None, {})
+            for sub in node.elements:
+                self.encode(sub, index)
+        elif isinstance(node, EmptyElement):
+            self._node(EMPTY, parent, 0, None, {})
+        else:
+            raise TypeError('Unexpected type {}'.format(str(type(node))))
+
+    def _node(self, kind, parent, child_count, function, params):
+
+        index = len(self.kind)
+        self.kind.append(kind)
+        self.parent.append(parent)
+        self.child_count.append(child_count)
+        self.code.append(
+            -1 if function is None else self.registry.register(function)
+        )
+        for name, value in params.items():
+            name_code = self.names.setdefault(name, len(self.names))
+            self.param_names.append(name_code)
+            self.param_values.append(float(value))
+            self.param_types.append(param_type(value))
+        self.param_offsets.append(len(self.param_names))
+        return index
+
+
+def param_type(value) -> int:
+    '''Return type tag (``FLOAT``, ``INT`` or ``BOOL``) for a param value.'''
+
+    if isinstance(value, (bool, np.bool_)):
+        return BOOL
+    elif isinstance(value, (int, np.integer)):
+        return INT
+    elif isinstance(value, (float, np.floating)):
+        return FLOAT
+    else:
+        raise TypeError(
+            'Unsupported param type {}'.format(str(type(value)))
+        )
+
+
+def _gather(offsets, indices):
+    '''Return concatenated ranges ``offsets[i]:offsets[i + 1]`` for indices.
+
+    Also returns offsets of the gathered ranges in the result.
+    '''
+
+    starts = offsets[indices]
+    lengths = offsets[indices + 1] - starts
+    new_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    positions = (
+        np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1], lengths)
+    )
+    return np.repeat(starts, lengths) + positions, new_offsets
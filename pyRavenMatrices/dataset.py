@@ -0,0 +1,325 @@
+'''This module provides a resumable, sharded writer for figure datasets.
+
+A dataset directory holds a top-level ``manifest.json`` and one directory per
+committed shard. Each shard holds a figure store (``figures.bin`` and
+``figures.bin.idx``, see ``store``), the rendered cells as an ``(N, H, W)``
+array of pixels (``images.npy``) and its own ``manifest.json``. Pixels are
+ARGB32 values or, for datasets written with an A8 render profile, ``uint8``
+coverage values; the top-level manifest records the format.
+
+Commits
+-------
+
+Shards are written to a temporary directory, flushed to disk and then renamed
+into place; the top-level manifest is then replaced atomically. The manifest
+is the only record of which shards are committed. On restart, anything not
+listed in it is discarded and writing resumes after the last committed shard.
+'''
+
+
+import json
+import os
+import queue
+import shutil
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from pyRavenMatrices.matrix import CellStructure
+from pyRavenMatrices.element import Element
+from pyRavenMatrices.registry import Registry
+from pyRavenMatrices.render import (
+    render_batch, LINE_WIDTH, DEFAULT_PROFILE, RenderProfile
+)
+from pyRavenMatrices.store import FigureStoreWriter
+
+
+MANIFEST = 'manifest.json'
+FIGURES = 'figures.bin'
+IMAGES = 'images.npy'
+VERSION = 1
+
+_DONE = object()
+
+
+class ShardedDatasetWriter(object):
+    '''Streams figures into fixed-size, atomically committed shards.
+
+    Figures are consumed from an iterable and handed to a background thread
+    that renders and writes them. At most ``max_pending`` full shards wait
+    for the writer at any time; beyond that, consuming the input blocks, so
+    memory use stays bounded however long the input is.
+
+    A writer resumes where a previous, interrupted one left off:
+    ``committed`` figures are already on disk, and the input passed to
+    ``write`` must start with figure number ``committed``. With seeded
+    generation this is simply::
+
+        writer = ShardedDatasetWriter(directory, registry, cell_structure)
+        writer.write(
+            figures_in_range(seed, writer.committed, total, *generators)
+        )
+    '''
+
+    def __init__(
+        self,
+        directory : str,
+        registry : Registry,
+        cell_structure : CellStructure,
+        shard_size : int = 10000,
+        max_pending : int = 2,
+        render_images : bool = True,
+        renderer : Any = None,
+        line_width : float = LINE_WIDTH,
+        profile : RenderProfile = None
+    ) -> None:
+        '''
+        Open a dataset directory for writing, creating it if necessary.
+
+        When resuming, ``shard_size``, ``cell_structure``, ``render_images``
+        and the pixel format of ``profile`` must match the settings recorded
+        in the manifest, otherwise ``ValueError`` is raised.
+
+        :param directory: Dataset directory.
+        :param registry: Registry holding codes for all routines and
+            decorators to be written.
+        :param cell_structure: Structure of the cells to render.
+        :param shard_size: Number of figures per shard.
+        :param max_pending: Maximum number of full shards waiting to be
+            written.
+        :param render_images: If ``False``, only figure structures are
+            written.
+        :param renderer: Optional ``parallel.ParallelRenderer`` used to
+            render shards; its workers draw straight into the shard's image
+            file. Shards are rendered in the writer thread if ``None``.
+        :param line_width: Width of figure outlines, in px.
+        :param profile: Render profile, defaults to
+            ``render.DEFAULT_PROFILE``. A8 profiles store a quarter of the
+            pixel data. Must match the profile of ``renderer``, if given.
+        '''
+
+        if profile is None:
+            profile = DEFAULT_PROFILE
+        if renderer is not None and renderer.profile.format != profile.format:
+            raise ValueError('Renderer and writer profile formats differ')
+
+        self.directory = directory
+        self.registry = registry
+        self.cell_structure = cell_structure
+        self.shard_size = shard_size
+        self.max_pending = max_pending
+        self.render_images = render_images
+        self.renderer = renderer
+        self.line_width = line_width
+        self.profile = profile
+
+        settings = {
+            'shard_size': shard_size,
+            'cell': {
+                'width': cell_structure.width,
+                'height': cell_structure.height,
+                'horizontal_margin': cell_structure.horizontal_margin,
+                'vertical_margin': cell_structure.vertical_margin
+            },
+            'images': render_images,
+            'format': profile.format
+        }
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = read_manifest(directory)
+        if self.manifest is None:
+            self.manifest = {'version': VERSION}
+            self.manifest.update(settings)
+            self.manifest.update({'count': 0, 'shards': []})
+            self._commit_manifest()
+        else:
+            _check_settings(self.manifest, settings)
+        self._discard_uncommitted()
+
+    @property
+    def committed(self) -> int:
+        '''Number of figures in committed shards.'''
+
+        return self.manifest['count']
+
+    def write(self, figures : Iterable[Element]) -> int:
+        '''Write figures, committing a shard every ``shard_size`` figures.
+
+        The final shard may be smaller. Returns the number of figures
+        committed in total.
+
+        :param figures: Figures to write, starting with figure number
+            ``self.committed``.
+        '''
+
+        shards : queue.Queue = queue.Queue(self.max_pending)
+        errors : List[BaseException] = []
+        thread = threading.Thread(
+            target=self._consume, args=(shards, errors), daemon=True
+        )
+        thread.start()
+
+        try:
+            shard : List[Element] = []
+            for figure in figures:
+                shard.append(figure)
+                if len(shard) == self.shard_size:
+                    self._put(shards, shard, errors)
+                    shard = []
+                if errors:
+                    break
+            if shard and not errors:
+                self._put(shards, shard, errors)
+        finally:
+            # The writer thread keeps draining the queue, even after errors.
+            shards.put(_DONE)
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return self.committed
+
+    def _put(self, shards, item, errors):
+
+        # Waits for room in the queue, unless the writer thread has failed.
+        while not errors:
+            try:
+                shards.put(item, timeout=.1)
+                return
+            except queue.Full:
+                continue
+
+    def _consume(self, shards, errors):
+
+        while True:
+            shard = shards.get()
+            if shard is _DONE:
+                return
+            if errors:
+                continue
+            try:
+                self._write_shard(shard)
+            except BaseException as e:
+                errors.append(e)
+
+    def _write_shard(self, figures):
+
+        index = len(self.manifest['shards'])
+        name = 'shard-{:06d}'.format(index)
+        path = os.path.join(self.directory, name)
+        tmp = path + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        with FigureStoreWriter(
+            os.path.join(tmp, FIGURES), self.registry
+        ) as writer:
+            writer.extend(figures)
+        if self.render_images:
+            self._write_images(os.path.join(tmp, IMAGES), figures)
+
+        info = {
+            'name': name,
+            'start': self.committed,
+            'count': len(figures)
+        }
+        _write_json(os.path.join(tmp, MANIFEST), info)
+        _fsync_dir(tmp)
+        os.replace(tmp, path)
+        _fsync_dir(self.directory)
+
+        self.manifest['shards'].append(info)
+        self.manifest['count'] += len(figures)
+        self._commit_manifest()
+
+    def _write_images(self, path, figures):
+
+        height, width = self.cell_structure.height, self.cell_structure.width
+        images = np.lib.format.open_memmap(
+            path, 
+            mode='w+', 
+            dtype=self.profile.dtype, 
+            shape=(len(figures), height, width)
+        )
+        if self.renderer is None:
+            render_batch(
+                figures,
+                self.cell_structure,
+                images,
+                self.line_width,
+                self.profile
+            )
+            images.flush()
+        del images
+        if self.renderer is not None:
+            # Workers map the file themselves and draw straight into it.
+            self.renderer.render_to_file(figures, path)
+
+    def _commit_manifest(self):
+
+        _write_json(os.path.join(self.directory, MANIFEST), self.manifest)
+
+    def _discard_uncommitted(self):
+
+        committed = {shard['name'] for shard in self.manifest['shards']}
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if (
+                entry.startswith('shard-') and
+                entry not in committed and
+                os.path.isdir(path)
+            ):
+                shutil.rmtree(path)
+
+
+def read_manifest(directory : str) -> Optional[Dict[str, Any]]:
+    '''Return the manifest of a dataset directory, or ``None`` if absent.'''
+
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _check_settings(manifest, settings):
+    '''Raise if a resumed dataset was written with other settings.
+
+    Every setting must be recorded in the manifest; a missing one is reported
+    as a mismatch.
+    '''
+
+    mismatches = [
+        '{} is {!r} in manifest, got {!r}'.format(
+            key, manifest.get(key), value
+        )
+        for key, value in settings.items() if manifest.get(key) != value
+    ]
+    if mismatches:
+        raise ValueError(
+            'Dataset settings do not match manifest: {}'.format(
+                '; '.join(mismatches)
+            )
+        )
+
+
+def _write_json(path, data):
+    '''Atomically replace ``path`` with ``data`` encoded as JSON.'''
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _fsync_dir(path):
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError: # Directories cannot be opened on some platforms
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
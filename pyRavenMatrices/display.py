@@ -0,0 +1,249 @@
+'''This module provides compiled display lists for elements.
+
+Drawing an element interprets its structure: modified elements rebuild their
+decorator closure chains and composite elements walk their children on every
+draw. Compiling an element traces a single draw and flattens it into a
+display list, a flat sequence of context operations that can be replayed
+any number of times.
+
+Compilation
+-----------
+
+While tracing, path construction and transformation calls are carried out in
+a private scratch context. Whenever the traced routine issues any other call
+(e.g., setting a source or filling), the path built so far is captured in
+untransformed coordinates and recorded as a single ``append_path`` operation,
+followed by the call itself. Calls that only query the context are answered
+by the scratch context and are not recorded.
+
+Replaying a display list thus appends a few prebuilt paths and issues the
+recorded state and fill calls, relative to whatever transformation is
+current in the target context.
+
+Transformations are not recorded as such, but strokes depend on the
+transformation in effect (e.g., through line widths); each stroke is thus
+recorded along with the transformation of the scratch context at the time,
+which is applied around it on replay. Sources other than plain colors, masks
+and text also depend on the transformation in effect and cannot be traced;
+they raise ``ValueError``.
+
+Drawing routines may depend on cell dimensions, so a display list is only
+valid for the cell geometry it was compiled for. ``CompiledElement`` keeps
+one display list per cell geometry and compiles new ones on demand.
+'''
+
+
+import collections
+from typing import Any, Callable, Dict, List, Tuple
+import cairo
+from pyRavenMatrices.matrix import CellStructure
+from pyRavenMatrices.element import Element
+
+
+# Calls applied to the scratch context only.
+_PATH_OPS = frozenset([
+    'move_to', 'line_to', 'curve_to', 'rel_move_to', 'rel_line_to',
+    'rel_curve_to', 'arc', 'arc_negative', 'rectangle', 'new_sub_path',
+    'close_path', 'append_path', 'text_path', 'glyph_path'
+])
+_TRANSFORM_OPS = frozenset([
+    'translate', 'scale', 'rotate', 'transform', 'set_matrix',
+    'identity_matrix'
+])
+# Calls applied to the scratch context and recorded.
+_STATE_OPS = frozenset(['save', 'restore'])
+# Calls recorded under the transformation in effect.
+_STROKE_OPS = frozenset(['stroke', 'stroke_preserve'])
+# Calls depending on the transformation in effect that cannot be recorded.
+_UNSUPPORTED_OPS = frozenset([
+    'set_source', 'set_source_surface', 'mask', 'mask_surface', 'show_text',
+    'show_glyphs', 'show_text_glyphs'
+])
+# Calls answered by the scratch context and not recorded.
+_QUERY_PREFIXES = (
+    'get_', 'copy_', 'has_', 'in_', 'user_to_', 'device_to_', 'path_extents',
+    'fill_extents', 'stroke_extents', 'clip_extents'
+)
+
+
+Operation = Tuple[str, tuple, Dict[str, Any]]
+
+
+class DisplayList(object):
+    '''A flat, replayable sequence of context operations.'''
+
+    def __init__(self, ops : List[Operation]) -> None:
+
+        self.ops = tuple(ops)
+
+    def __len__(self):
+
+        return len(self.ops)
+
+    def __repr__(self):
+
+        return 'DisplayList({})'.format(
+            ', '.join(name for name, _, _ in self.ops)
+        )
+
+    def replay(self, ctx : cairo.Context) -> None:
+        '''Issue recorded operations in ``ctx``.'''
+
+        for name, args, kwargs in self.ops:
+            getattr(ctx, name)(*args, **kwargs)
+
+
+class _Recorder(object):
+    '''Stands in for a cairo context while a drawing routine is traced.'''
+
+    def __init__(self, scratch : cairo.Context) -> None:
+
+        self._scratch = scratch
+        self._ops : List[Operation] = []
+        self._dirty = False
+
+    def __getattr__(self, name):
+
+        if name in _UNSUPPORTED_OPS:
+            raise ValueError(
+                '{} cannot be traced into a display list'.format(name)
+            )
+        method = getattr(self._scratch, name)
+        if name in _PATH_OPS:
+            def call(*args, **kwargs):
+                self._dirty = True
+                return method(*args, **kwargs)
+        elif name in _TRANSFORM_OPS:
+            call = method
+        elif name in _STROKE_OPS:
+            def call(*args, **kwargs):
+                self._flush()
+                self._ops.extend([
+                    ('save', (), {}),
+                    ('transform', (self._scratch.get_matrix(),), {}),
+                    (name, args, kwargs),
+                    ('restore', (), {})
+                ])
+                return method(*args, **kwargs)
+        elif name in _STATE_OPS:
+            def call(*args, **kwargs):
+                self._ops.append((name, args, kwargs))
+                return method(*args, **kwargs)
+        elif name.startswith(_QUERY_PREFIXES):
+            call = method
+        elif name == 'new_path':
+            def call(*args, **kwargs):
+                self._dirty = False
+                self._ops.append((name, args, kwargs))
+                return method(*args, **kwargs)
+        else:
+            def call(*args, **kwargs):
+                self._flush()
+                self._ops.append((name, args, kwargs))
+                return method(*args, **kwargs)
+        return call
+
+    def _flush(self) -> None:
+        '''Record the pending path and clear it from the scratch context.'''
+
+        if not self._dirty:
+            return
+        scratch = self._scratch
+        current_point = (
+            scratch.get_current_point() if scratch.has_current_point()
+            else None
+        )
+        scratch.save()
+        scratch.identity_matrix()
+        path = scratch.copy_path()
+        scratch.restore()
+        scratch.new_path()
+        # Keep the current point so that subsequent segments still connect.
+        if current_point is not None:
+            scratch.move_to(*current_point)
+        self._ops.append(('append_path', (path,), {}))
+        self._dirty = False
+
+    def finish(self) -> DisplayList:
+        '''Return a display list of all operations recorded so far.'''
+
+        self._flush()
+        return DisplayList(self._ops)
+
+
+def compile_routine(
+    routine : Callable[[cairo.Context, CellStructure], None],
+    cell_structure : CellStructure
+) -> DisplayList:
+    '''Trace a drawing routine and return its display list.
+
+    :param routine: A drawing routine, such as ``element.draw_in_context``.
+    :param cell_structure: Structure of the cell the list is compiled for.
+    '''
+
+    scratch = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 1, 1))
+    recorder = _Recorder(scratch)
+    routine(recorder, cell_structure)
+
+    return recorder.finish()
+
+
+def _cell_key(cell_structure : CellStructure) -> Tuple[int, int, int, int]:
+
+    return (
+        cell_structure.width,
+        cell_structure.height,
+        cell_structure.horizontal_margin,
+        cell_structure.vertical_margin
+    )
+
+
+class CompiledElement(object):
+    '''Draws an element from display lists cached per cell geometry.
+
+    A compiled element is a snapshot: later changes to the source element are
+    not reflected in display lists that have already been compiled.
+    '''
+
+    def __init__(self, element : Element, maxsize : int = 16) -> None:
+        '''
+        Initialize a compiled element.
+
+        :param element: The element to compile.
+        :param maxsize: Maximum number of cell geometries to keep display
+            lists for. Least recently used lists are discarded first.
+        '''
+
+        self.element = element
+        self.maxsize = maxsize
+        self._lists : collections.OrderedDict = collections.OrderedDict()
+
+    def display_list(self, cell_structure : CellStructure) -> DisplayList:
+        '''Return display list for ``cell_structure``, compiling if needed.'''
+
+        key = _cell_key(cell_structure)
+        display_list = self._lists.get(key)
+        if display_list is None:
+            display_list = compile_routine(
+                self.element.draw_in_context, cell_structure
+            )
+            self._lists[key] = display_list
+            if len(self._lists) > self.maxsize:
+                self._lists.popitem(last=False)
+        else:
+            self._lists.move_to_end(key)
+
+        return display_list
+
+    def draw_in_context(
+        self, ctx : cairo.Context, cell_structure : CellStructure
+    ) -> None:
+        '''Draw compiled element in the given context.'''
+
+        self.display_list(cell_structure).replay(ctx)
+
+
+def compile_element(element : Element) -> CompiledElement:
+    '''Return a compiled version of ``element``.'''
+
+    return CompiledElement(element)
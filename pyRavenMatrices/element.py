@@ -27,30 +27,68 @@ modifier_sequence :: element_modifier {element_modifier}
 
 
 import abc
-from typing import Callable, Dict, List, Any, Union
+import collections.abc
+import hashlib
+import numbers
+import types
+import weakref
+from typing import Callable, Dict, List, Any, Union, Hashable, Set
 import cairo
 from pyRavenMatrices.matrix import CellStructure 
 
 class ElementNode(abc.ABC):
     '''Represents a generic node in element structure syntax.'''
 
+    __slots__ = ()
+
     def __repr__(self):
 
-        return ''.join([type(self).__name__, '(', repr(vars(self)), ')'])
+        return ''.join([type(self).__name__, '(', repr(_vars(self)), ')'])
 
     def __eq__(self, other : Any) -> bool:
         '''Return ``True`` if ``other`` is equal to ``self``.
         
-        ``self == other`` iff:
+        ``self == other`` iff ``self.key() == other.key()``, i.e., iff both 
+        nodes have the same type, structure, routines or decorators and params.
+        '''
+
+        if self is other:
+            return True
+        if not isinstance(other, ElementNode):
+            return NotImplemented
+        return self.key() == other.key()
 
-        - ``type(self) == type(other)`` and
-        - ``vars(self) == vars(other)`` 
+    def __hash__(self) -> int:
+        '''Return hash of ``self.key()``.
+
+        Nodes are mutable, so the key is rebuilt and hashed on every call, 
+        at a cost linear in the size of ``self``; a node must not be changed 
+        while it is held in a set or used as a dict key.
         '''
 
-        return (
-            type(self) == type(other) and
-            vars(self) == vars(other)
-        )
+        return hash(self.key())
+
+    def key(self) -> Hashable:
+        '''Return a hashable structural key for ``self``.
+
+        The key is a nested tuple holding the node type, routine or decorator 
+        functions, params and keys of child nodes.
+        '''
+
+        return (type(self), _freeze(_vars(self)))
+
+    @property
+    def fingerprint(self) -> str:
+        '''A stable hex digest of ``self.key()``.
+
+        Unlike ``hash(self)``, the fingerprint does not vary across 
+        interpreter sessions: functions are identified by their qualified 
+        names and numbers by their values.
+        '''
+
+        return hashlib.blake2b(
+            _stable_repr(self.key()).encode(), digest_size=16
+        ).hexdigest()
 
 
 class Element(ElementNode):
@@ -59,6 +97,8 @@ class Element(ElementNode):
     ``Element`` is an abstract base class. It cannot be directly instantiated.
     '''
 
+    __slots__ = ()
+
     @abc.abstractmethod
     def draw_in_context(
         self, ctx : cairo.Context, cell_structure : CellStructure
@@ -73,6 +113,8 @@ class Element(ElementNode):
 class ElementModifier(ElementNode):
     '''Represents an alteration of the drawing procedure for a given element.
     '''
+
+    __slots__ = ('_decorator', '_params')
     
     def __call__(
         self, routine : Callable[[cairo.Context, CellStructure], None]
@@ -87,6 +129,14 @@ class ElementModifier(ElementNode):
         
         return self.decorator(routine, **self.params)
 
+    def key(self) -> Hashable:
+
+        return (
+            ElementModifier,
+            getattr(self, '_decorator', None),
+            _freeze(getattr(self, '_params', {}))
+        )
+
     @property
     def decorator(
         self
@@ -117,6 +167,8 @@ class ElementModifier(ElementNode):
 
 class BasicElement(Element):
     '''Represents an unanalyzed figural unit.'''
+
+    __slots__ = ('_routine', '_params')
     
     def draw_in_context(
         self, ctx : cairo.Context, cell_structure : CellStructure 
@@ -124,6 +176,14 @@ class BasicElement(Element):
 
         self.routine(ctx, cell_structure, **self.params)
 
+    def key(self) -> Hashable:
+
+        return (
+            BasicElement,
+            getattr(self, '_routine', None),
+            _freeze(getattr(self, '_params', {}))
+        )
+
     @property
     def routine(self) -> Callable[..., None]:
         '''Drawing routine bound to ``self``.'''
@@ -151,10 +211,16 @@ class EmptyElement(Element):
     '''Represents an empty element.
     '''
 
+    __slots__ = ()
+
     def __bool__(self):
         '''Always evaluates to ``False``.'''
         
         return False
+
+    def key(self) -> Hashable:
+
+        return (EmptyElement,)
     
     def draw_in_context(
         self, ctx : cairo.Context, cell_structure : CellStructure
@@ -165,6 +231,8 @@ class EmptyElement(Element):
 class ModifiedElement(Element):
     '''Represents an element altered by a sequence of modifiers.
     '''
+
+    __slots__ = ('element', 'modifiers')
     
     def __init__(
         self, 
@@ -188,9 +256,24 @@ class ModifiedElement(Element):
             modified = modifier(modified)
         modified(ctx, cell_structure)
 
+    def key(self) -> Hashable:
+
+        return self._key(_node_key)
+
+    def _key(self, key : Callable[[ElementNode], Hashable]) -> Hashable:
+        '''Return key of ``self``, given a function returning child keys.'''
+
+        return (
+            ModifiedElement,
+            key(self.element),
+            tuple(key(modifier) for modifier in self.modifiers)
+        )
+
     
 class CompositeElement(Element):
     '''Represents a sequence of overlayed elements.'''
+
+    __slots__ = ('elements',)
     
     def __init__(
         self, element_1 : Element, element_2 : Element, *elements : Element
@@ -206,24 +289,347 @@ class CompositeElement(Element):
         for element in self.elements:
             element.draw_in_context(ctx, cell_structure)
 
+    def key(self) -> Hashable:
+
+        return self._key(_node_key)
+
+    def _key(self, key : Callable[[ElementNode], Hashable]) -> Hashable:
+        '''Return key of ``self``, given a function returning child keys.'''
+
+        return (
+            CompositeElement, 
+            tuple(key(element) for element in self.elements)
+        )
+
     
+class InternedBasicElement(BasicElement):
+    '''An immutable basic element shared through a ``NodeFactory``.
+
+    Instances should be obtained from ``NodeFactory.basic_element``. Copies 
+    made with ``copy.copy`` or ``copy.deepcopy`` are ordinary, mutable basic 
+    elements.
+    '''
+
+    __slots__ = ('__weakref__',)
+
+    @property
+    def routine(self) -> Callable[..., None]:
+        '''Drawing routine bound to ``self``.'''
+
+        return self._routine
+
+    @routine.setter
+    def routine(self, val : Callable[..., None]) -> None:
+
+        raise AttributeError('Interned elements are immutable')
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        '''Read-only params for ``self.routine``.'''
+
+        return self._params
+
+    @params.setter
+    def params(self, val : Dict[str, Any]) -> None:
+
+        raise AttributeError('Interned elements are immutable')
+
+    def __copy__(self):
+
+        element = BasicElement()
+        element.routine = self.routine
+        element.params = dict(self.params)
+        return element
+
+    def __deepcopy__(self, memo):
+
+        return self.__copy__()
+
+    def __reduce__(self):
+
+        return (_intern_basic_element, (self.routine, dict(self.params)))
+
+
+class InternedElementModifier(ElementModifier):
+    '''An immutable element modifier shared through a ``NodeFactory``.
+
+    Instances should be obtained from ``NodeFactory.element_modifier``. 
+    Copies made with ``copy.copy`` or ``copy.deepcopy`` are ordinary, mutable 
+    element modifiers.
+    '''
+
+    __slots__ = ('__weakref__',)
+
+    @property
+    def decorator(
+        self
+    ) -> Callable[..., Callable[[cairo.Context, CellStructure], None]]:
+        '''Decorates drawing routines given as input to ``self``.'''
+
+        return self._decorator
+
+    @decorator.setter
+    def decorator(
+        self, 
+        val : Callable[..., Callable[[cairo.Context, CellStructure], None]]
+    ) -> None:
+
+        raise AttributeError('Interned elements are immutable')
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        '''Read-only params for ``self.decorator``.'''
+
+        return self._params
+
+    @params.setter
+    def params(self, val : Dict[str, Any]) -> None:
+
+        raise AttributeError('Interned elements are immutable')
+
+    def __copy__(self):
+
+        modifier = ElementModifier()
+        modifier.decorator = self.decorator
+        modifier.params = dict(self.params)
+        return modifier
+
+    def __deepcopy__(self, memo):
+
+        return self.__copy__()
+
+    def __reduce__(self):
+
+        return (_intern_element_modifier, (self.decorator, dict(self.params)))
+
+
+class NodeFactory(object):
+    '''Creates shared, immutable basic elements and element modifiers.
+
+    The factory returns the same node for every request with the same 
+    routine (or decorator) and params, so that large collections of figures 
+    store each distinct leaf only once and equal leaves can be compared by 
+    identity. Nodes are held weakly and are dropped once no longer in use.
+    '''
+
+    def __init__(self) -> None:
+
+        self._nodes : weakref.WeakValueDictionary = (
+            weakref.WeakValueDictionary()
+        )
+
+    def __len__(self):
+
+        return len(self._nodes)
+
+    def basic_element(
+        self, routine : Callable[..., None], params : Dict[str, Any] = None
+    ) -> BasicElement:
+        '''Return the shared basic element for ``routine`` and ``params``.'''
+
+        return self._get(InternedBasicElement, '_routine', routine, params)
+
+    def element_modifier(
+        self, 
+        decorator : Callable[..., Callable[..., None]],
+        params : Dict[str, Any] = None
+    ) -> ElementModifier:
+        '''Return the shared modifier for ``decorator`` and ``params``.'''
+
+        return self._get(
+            InternedElementModifier, '_decorator', decorator, params
+        )
+
+    def intern(self, element : Element) -> Element:
+        '''Return a copy of ``element`` whose leaves are shared nodes.
+
+        Basic elements and element modifiers are replaced by their shared 
+        counterparts; modified and composite elements are rebuilt around them.
+        '''
+
+        if isinstance(element, BasicElement):
+            return self.basic_element(element.routine, element.params)
+        elif isinstance(element, ModifiedElement):
+            return ModifiedElement(
+                self.intern(element.element),
+                *[
+                    self.element_modifier(mod.decorator, mod.params) 
+                    for mod in element.modifiers
+                ]
+            )
+        elif isinstance(element, CompositeElement):
+            return CompositeElement(
+                *[self.intern(sub) for sub in element.elements]
+            )
+        elif isinstance(element, EmptyElement):
+            return element
+        else:
+            raise TypeError('Unexpected type {}'.format(str(type(element))))
+
+    def _get(self, cls, attribute, function, params):
+
+        if params is None:
+            params = {}
+        key = (cls, function, _freeze(params))
+        node = self._nodes.get(key)
+        if node is None:
+            node = cls()
+            object.__setattr__(node, attribute, function)
+            object.__setattr__(
+                node, '_params', types.MappingProxyType(dict(params))
+            )
+            self._nodes[key] = node
+        return node
+
+
+_factory = NodeFactory()
+
+
+def _intern_basic_element(routine, params):
+
+    return _factory.basic_element(routine, params)
+
+
+def _intern_element_modifier(decorator, params):
+
+    return _factory.element_modifier(decorator, params)
+
+
+def intern_element(element : Element) -> Element:
+    '''Return a copy of ``element`` with leaves shared via a default factory.
+    '''
+
+    return _factory.intern(element)
+
+
 def get_subtrees(element : Element) -> List[Union[Element, ElementModifier]]:
-    '''Return a list of all unique subelements of element.'''
+    '''Return a list of all unique subelements of element.
+
+    Keys of all subelements are computed and hashed once, bottom-up, so the 
+    cost is linear in the size of ``element``, plus the size of each 
+    repeated subelement, which is compared in full with its first 
+    occurrence.
+    '''
     
+    keys : Dict[int, _HashedKey] = {}
     output : List[Union[Element, ElementModifier]] = [element]
+    seen : Set[_HashedKey] = {_cached_key(element, keys)}
+
+    def visit(sub):
+        key = _cached_key(sub, keys)
+        if key not in seen:
+            seen.add(key)
+            output.append(sub)
+
     for sub in output:
         if isinstance(sub, BasicElement) or isinstance(sub, ElementModifier):
             continue
         elif isinstance(sub, ModifiedElement):
-            if not sub.element in output:
-                output.append(sub.element)
+            visit(sub.element)
             for mod in sub.modifiers:
-                if not mod in output:
-                    output.append(mod)
+                visit(mod)
         elif isinstance(sub, CompositeElement):
             for subsub in sub.elements:
-                if not subsub in output:
-                    output.append(subsub)
+                visit(subsub)
         else:
             raise TypeError('Unexpected type {}'.format(str(type(sub))))
-    return output
\ No newline at end of file
+    return output
+
+
+def _node_key(node : ElementNode) -> Hashable:
+
+    return node.key()
+
+
+class _HashedKey(object):
+    '''A node key holding its precomputed hash.
+
+    Python does not cache hashes of tuples, so hashing a nested key visits 
+    all of it. Keys nesting hashed keys instead hash in time proportional to 
+    their number of direct children.
+    '''
+
+    __slots__ = ('key', '_hash')
+
+    def __init__(self, key : Hashable) -> None:
+
+        self.key = key
+        self._hash = hash(key)
+
+    def __hash__(self):
+
+        return self._hash
+
+    def __eq__(self, other):
+
+        if self is other:
+            return True
+        if not isinstance(other, _HashedKey):
+            return NotImplemented
+        return self._hash == other._hash and self.key == other.key
+
+
+def _cached_key(
+    node : ElementNode, keys : Dict[int, _HashedKey]
+) -> _HashedKey:
+    '''Return hashed key of ``node``, reusing and recording keys by node id.
+
+    Keys of modified and composite elements are built from the recorded 
+    keys of their children; they only compare equal to keys built the same 
+    way. Nodes must stay alive and unchanged while ``keys`` is in use.
+    '''
+
+    key = keys.get(id(node))
+    if key is None:
+        if isinstance(node, (ModifiedElement, CompositeElement)):
+            key = _HashedKey(node._key(lambda child: _cached_key(child, keys)))
+        else:
+            key = _HashedKey(node.key())
+        keys[id(node)] = key
+    return key
+
+
+def _freeze(value : Any) -> Hashable:
+    '''Return a hashable equivalent of ``value`` for use in node keys.'''
+
+    if isinstance(value, collections.abc.Mapping):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    elif isinstance(value, ElementNode):
+        return value.key()
+    else:
+        return value
+
+
+def _stable_repr(value : Any) -> str:
+    '''Return a session-independent string representation of a node key.'''
+
+    if isinstance(value, tuple):
+        return '(' + ','.join(_stable_repr(v) for v in value) + ')'
+    elif hasattr(value, '__qualname__'):
+        return '{}.{}'.format(value.__module__, value.__qualname__)
+    elif isinstance(value, numbers.Integral):
+        return str(int(value))
+    elif isinstance(value, numbers.Real):
+        # Numbers that compare equal must be written alike, e.g. 2 and 2.0.
+        value = float(value)
+        return str(int(value)) if value.is_integer() else repr(value)
+    else:
+        return repr(value)
+
+
+def _vars(node : ElementNode) -> Dict[str, Any]:
+    '''Return attributes of ``node``, whether held in slots or ``__dict__``.
+    '''
+
+    attributes = {}
+    for cls in reversed(type(node).__mro__):
+        slots = getattr(cls, '__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        for name in slots:
+            if name != '__weakref__' and hasattr(node, name):
+                attributes[name] = getattr(node, name)
+    attributes.update(getattr(node, '__dict__', {}))
+    return attributes
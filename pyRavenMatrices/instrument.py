@@ -0,0 +1,236 @@
+'''This module provides opt-in instrumentation of element rendering.
+
+While instrumentation is active, every call to ``BasicElement.draw_in_context``
+and to routines wrapped by element modifiers is timed, and the cairo context
+operations it issues are counted. Results are collected per drawing routine
+and per decorator::
+
+    with instrument() as stats:
+        render_element(element, cell_structure)
+    print(stats.summary())
+
+Instrumentation works by temporarily replacing ``BasicElement.draw_in_context``
+and ``ElementModifier.__call__``; the originals are restored on exit. When it
+is not active, rendering runs entirely uninstrumented code.
+
+Times and operation counts are inclusive: a decorator is charged for the
+routines it wraps, so e.g. ``numerosity`` shows the cost of all copies of the
+element it draws. Instrumentation is process-wide and not thread-safe, and
+does not reach worker processes of ``parallel.ParallelRenderer``.
+
+Instrumented contexts hide the render profile of the context they wrap, so
+routines that may replay display lists in place of repeated draws (e.g.
+``numerosity``) draw every copy while instrumented. Counts thus do not depend
+on ``RenderProfile.instancing``.
+'''
+
+
+import collections
+import contextlib
+import time
+from typing import Any, Callable, Counter, Dict, Iterator, Optional
+from pyRavenMatrices.element import BasicElement, ElementModifier
+
+
+class CallStats(object):
+    '''Statistics of calls to one drawing routine or decorator.'''
+
+    def __init__(self, function : Callable) -> None:
+
+        self.function = function
+        self.calls = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.ops : Counter[str] = collections.Counter()
+
+    def __repr__(self):
+
+        return 'CallStats({}, calls={}, total_time={:.6f})'.format(
+            self.name, self.calls, self.total_time
+        )
+
+    @property
+    def name(self) -> str:
+        '''Name of the instrumented function.'''
+
+        return getattr(self.function, '__name__', repr(self.function))
+
+    @property
+    def mean_time(self) -> float:
+        '''Mean time per call, in seconds.'''
+
+        return self.total_time / self.calls if self.calls else 0.
+
+    @property
+    def total_ops(self) -> int:
+        '''Total number of context operations issued.'''
+
+        return sum(self.ops.values())
+
+    def record(self, elapsed : float) -> None:
+        '''Record a call lasting ``elapsed`` seconds.'''
+
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+
+class RenderStats(object):
+    '''Rendering statistics, per drawing routine and per decorator.'''
+
+    def __init__(self) -> None:
+
+        self.routines : Dict[Callable, CallStats] = {}
+        self.decorators : Dict[Callable, CallStats] = {}
+
+    def __getitem__(self, function : Callable) -> CallStats:
+        '''Return statistics for a drawing routine or decorator.'''
+
+        if function in self.routines:
+            return self.routines[function]
+        elif function in self.decorators:
+            return self.decorators[function]
+        else:
+            raise KeyError(function)
+
+    def __iter__(self) -> Iterator[CallStats]:
+
+        yield from self.routines.values()
+        yield from self.decorators.values()
+
+    def routine(self, routine : Callable) -> CallStats:
+        '''Return statistics for ``routine``, creating them if necessary.'''
+
+        stats = self.routines.get(routine)
+        if stats is None:
+            stats = self.routines[routine] = CallStats(routine)
+        return stats
+
+    def decorator(self, decorator : Callable) -> CallStats:
+        '''Return statistics for ``decorator``, creating them if necessary.'''
+
+        stats = self.decorators.get(decorator)
+        if stats is None:
+            stats = self.decorators[decorator] = CallStats(decorator)
+        return stats
+
+    def by_name(self) -> Dict[str, CallStats]:
+        '''Return all statistics keyed by function name.'''
+
+        return {stats.name: stats for stats in self}
+
+    def reset(self) -> None:
+        '''Discard all recorded statistics.'''
+
+        self.routines.clear()
+        self.decorators.clear()
+
+    def summary(self) -> str:
+        '''Return a table of all statistics, slowest functions first.'''
+
+        lines = [
+            '{:<16} {:>10} {:>12} {:>12} {:>12} {:>10}'.format(
+                'function', 'calls', 'total (s)', 'mean (s)', 'max (s)', 'ops'
+            )
+        ]
+        for stats in sorted(self, key=lambda s: s.total_time, reverse=True):
+            lines.append(
+                '{:<16} {:>10} {:>12.6f} {:>12.6f} {:>12.6f} {:>10}'.format(
+                    stats.name, stats.calls, stats.total_time,
+                    stats.mean_time, stats.max_time, stats.total_ops
+                )
+            )
+        return '\n'.join(lines)
+
+
+class _CountingContext(object):
+    '''Forwards to a cairo context, counting method calls by name.'''
+
+    __slots__ = ('_ctx', '_ops')
+
+    # Not forwarded, so that routines draw as in a plain context.
+    profile = None
+
+    def __init__(self, ctx : Any, ops : Counter[str]) -> None:
+
+        self._ctx = ctx
+        self._ops = ops
+
+    def __getattr__(self, name):
+
+        attribute = getattr(self._ctx, name)
+        if not callable(attribute):
+            return attribute
+        ops = self._ops
+
+        def counted(*args, **kwargs):
+            ops[name] += 1
+            return attribute(*args, **kwargs)
+
+        return counted
+
+
+_active : Optional[RenderStats] = None
+
+
+@contextlib.contextmanager
+def instrument(stats : RenderStats = None) -> Iterator[RenderStats]:
+    '''Instrument element rendering within a ``with`` block.
+
+    :param stats: Statistics object to record into. A new one is created if
+        ``None``; pass an existing one to accumulate over several blocks.
+    '''
+
+    global _active
+    if _active is not None:
+        raise RuntimeError('Instrumentation is already active')
+    if stats is None:
+        stats = RenderStats()
+
+    draw_in_context = BasicElement.__dict__['draw_in_context']
+    call = ElementModifier.__dict__['__call__']
+
+    def instrumented_draw_in_context(self, ctx, cell_structure):
+        record = stats.routine(self.routine)
+        start = time.perf_counter()
+        try:
+            draw_in_context(
+                self, _CountingContext(ctx, record.ops), cell_structure
+            )
+        finally:
+            record.record(time.perf_counter() - start)
+
+    def instrumented_call(self, routine):
+        decorated = call(self, routine)
+        record = stats.decorator(self.decorator)
+
+        def wrapped(ctx, cell_structure, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                decorated(
+                    _CountingContext(ctx, record.ops),
+                    cell_structure,
+                    *args,
+                    **kwargs
+                )
+            finally:
+                record.record(time.perf_counter() - start)
+
+        return wrapped
+
+    _active = stats
+    BasicElement.draw_in_context = instrumented_draw_in_context
+    ElementModifier.__call__ = instrumented_call
+    try:
+        yield stats
+    finally:
+        BasicElement.draw_in_context = draw_in_context
+        ElementModifier.__call__ = call
+        _active = None
+
+
+def is_active() -> bool:
+    '''Return ``True`` if instrumentation is currently active.'''
+
+    return _active is not None
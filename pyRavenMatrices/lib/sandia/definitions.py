@@ -1,9 +1,12 @@
+import functools
 import math
 import cairo
 import os
 import typing as t
 import pyRavenMatrices.matrix as mat
 import pyRavenMatrices.element as elt
+import pyRavenMatrices.display as dsp
+import pyRavenMatrices.registry as reg
 
 
 #################
@@ -41,14 +44,7 @@ def ellipse(
     if not 2 <= r:        
         raise ValueError()
 
-    width, height = _get_dims(cell_structure)
-    
-    ctx.save()
-    ctx.translate(cell_structure.width / 2., cell_structure.height / 2.)
-    ctx.scale(width / (2 * r), height / 2)
-    ctx.new_sub_path()
-    ctx.arc(0., 0., 1., 0., 2 * math.pi)
-    ctx.restore()
+    ctx.append_path(_get_path(_ellipse_path, cell_structure, r))
 
 
 def triangle(ctx, cell_structure, r=1):
@@ -65,6 +61,107 @@ def triangle(ctx, cell_structure, r=1):
     if not 0 < r:        
         raise ValueError()
         
+    ctx.append_path(_get_path(_triangle_path, cell_structure, r))
+
+
+def rectangle(ctx, cell_structure, r = 2):
+    
+    if not r >= 2:
+        raise ValueError()
+    
+    ctx.append_path(_get_path(_rectangle_path, cell_structure, r))
+
+
+def trapezoid(ctx, cell_structure, r=1):
+    
+    if not r > 0:        
+        raise ValueError()
+
+    ctx.append_path(_get_path(_trapezoid_path, cell_structure, r))
+
+
+def diamond(ctx, cell_structure, r=1):
+    
+    if not 1 <= r:        
+        raise ValueError()
+ 
+    ctx.append_path(_get_path(_diamond_path, cell_structure, r))
+
+
+def tee(ctx, cell_structure, r=1):
+    
+    if not 0 < r:        
+        raise ValueError()
+
+    ctx.append_path(_get_path(_tee_path, cell_structure, r))
+
+
+###################
+### SHAPE PATHS ###
+###################
+
+
+# Shapes are built once per combination of routine, params and cell 
+# dimensions in a scratch context, and replayed with ``ctx.append_path``.
+# The cache is bounded; least recently used paths are discarded first.
+
+PATH_CACHE_SIZE = 1024
+
+
+def _get_path(
+    builder: t.Callable[..., None], 
+    cell_structure: mat.CellStructure, 
+    r: float
+) -> cairo.Path:
+
+    return _build_path(
+        builder,
+        cell_structure.width,
+        cell_structure.height,
+        cell_structure.horizontal_margin,
+        cell_structure.vertical_margin,
+        r
+    )
+
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def _build_path(builder, width, height, horizontal_margin, vertical_margin, r):
+
+    cell_structure = mat.CellStructure(
+        None, width, height, horizontal_margin, vertical_margin
+    )
+    ctx = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 1, 1))
+    builder(ctx, cell_structure, r)
+
+    return ctx.copy_path()
+
+
+def path_cache_info():
+    """Return hit/miss statistics for the shape path cache."""
+
+    return _build_path.cache_info()
+
+
+def clear_path_cache():
+    """Discard all cached shape paths."""
+
+    _build_path.cache_clear()
+
+
+def _ellipse_path(ctx, cell_structure, r):
+
+    width, height = _get_dims(cell_structure)
+    
+    ctx.save()
+    ctx.translate(cell_structure.width / 2., cell_structure.height / 2.)
+    ctx.scale(width / (2 * r), height / 2)
+    ctx.new_sub_path()
+    ctx.arc(0., 0., 1., 0., 2 * math.pi)
+    ctx.restore()
+
+
+def _triangle_path(ctx, cell_structure, r):
+
     width, height = _get_dims(cell_structure)
 
     div = max(1, r)
@@ -80,11 +177,8 @@ def triangle(ctx, cell_structure, r=1):
     ctx.restore()
 
 
-def rectangle(ctx, cell_structure, r = 2):
-    
-    if not r >= 2:
-        raise ValueError()
-    
+def _rectangle_path(ctx, cell_structure, r):
+
     width, height = _get_dims(cell_structure)
 
     ctx.save()
@@ -99,10 +193,7 @@ def rectangle(ctx, cell_structure, r = 2):
     ctx.restore()
 
 
-def trapezoid(ctx, cell_structure, r=1):
-    
-    if not r > 0:        
-        raise ValueError()
+def _trapezoid_path(ctx, cell_structure, r):
 
     width, height = _get_dims(cell_structure)
     
@@ -120,11 +211,8 @@ def trapezoid(ctx, cell_structure, r=1):
     ctx.restore()
 
 
-def diamond(ctx, cell_structure, r=1):
-    
-    if not 1 <= r:        
-        raise ValueError()
- 
+def _diamond_path(ctx, cell_structure, r):
+
     width, height = _get_dims(cell_structure)
     
     ctx.save()
@@ -139,10 +227,7 @@ def diamond(ctx, cell_structure, r=1):
     ctx.restore()
 
 
-def tee(ctx, cell_structure, r=1):
-    
-    if not 0 < r:        
-        raise ValueError()
+def _tee_path(ctx, cell_structure, r):
 
     width, height = _get_dims(cell_structure)
     
@@ -169,6 +254,13 @@ def tee(ctx, cell_structure, r=1):
 #################
 
 
+# Copies drawn by ``numerosity`` are stamped from a display list (see 
+# ``display``) of the routine it wraps, traced once per draw, when the context 
+# carries a render profile with instancing on (see ``render.RenderContext``). 
+# In any other context, e.g. one counting calls for instrumentation, each copy 
+# is drawn by calling the wrapped routine.
+
+
 def scale(element, factor=.5):
 
     def wrapped(ctx, cell_structure, *args, **kwargs):
@@ -214,6 +306,19 @@ def numerosity(element, number=5):
     
     def wrapped(ctx, cell_structure, *args, **kwargs):
 
+        profile = getattr(ctx, 'profile', None)
+        if (
+            number > 1 and 
+            profile is not None and 
+            profile.instancing and 
+            not args and 
+            not kwargs
+        ):
+            draw = dsp.compile_routine(element, cell_structure).replay
+        else:
+            def draw(ctx):
+                element(ctx, cell_structure, *args, **kwargs)
+
         for i in range(number):
             
             x = (i % 3) * (cell_structure.width / 3.)
@@ -222,7 +327,29 @@ def numerosity(element, number=5):
             ctx.save()
             ctx.translate(x, y)
             ctx.scale(1 / 3, 1 / 3)
-            element(ctx, cell_structure, *args, **kwargs)
+            draw(ctx)
             ctx.restore()
     
     return wrapped
+
+
+################
+### REGISTRY ###
+################
+
+
+# Codes are part of the serialized format of sandia figures and must never be 
+# changed or reused; new routines and decorators must get new codes.
+
+registry = reg.Registry({
+    ellipse: 0,
+    triangle: 1,
+    rectangle: 2,
+    trapezoid: 3,
+    diamond: 4,
+    tee: 5,
+    scale: 6,
+    rotation: 7,
+    shading: 8,
+    numerosity: 9
+})
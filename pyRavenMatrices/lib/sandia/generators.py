@@ -1,5 +1,6 @@
 import cairo
 import typing as t
+import numpy as np
 import numpy.random as rd
 import copy
 import math
@@ -11,6 +12,104 @@ from pyRavenMatrices.lib.sandia.definitions import (
     scale, rotation, shading, numerosity
 )
 
+
+class SamplingTable(object):
+    """
+    Immutable cumulative-array table for sampling from a discrete distribution.
+
+    Outcomes and probabilities are validated and compiled once, so that each 
+    draw costs a single uniform draw and a binary search.
+    """
+
+    def __init__(self, dist: dict) -> None:
+        """
+        Compile a sampling table.
+
+        :param dist: Dictionary mapping outcomes to probabilities.
+        """
+
+        p = np.array(list(dist.values()), dtype=float)
+        if p.ndim != 1 or p.size == 0:
+            raise ValueError('Distribution must have at least one outcome')
+        if np.any(p < 0):
+            raise ValueError('Probabilities are not non-negative')
+        if not math.isclose(p.sum(), 1., abs_tol=np.sqrt(np.finfo(float).eps)):
+            raise ValueError('Probabilities do not sum to 1')
+
+        cdf = np.cumsum(p)
+        cdf /= cdf[-1]
+        p.flags.writeable = False
+        cdf.flags.writeable = False
+
+        self.outcomes = tuple(dist.keys())
+        self.p = p
+        self.cdf = cdf
+
+    def sample_indices(self, size=1, replace=True, rng=None):
+        """
+        Return indices of ``size`` outcomes drawn from the table.
+
+        If ``rng`` is None, numpy's global random state is used.
+        """
+
+        rng = get_rng(rng)
+        if replace:
+            return np.searchsorted(self.cdf, rng.random(size), 'right')
+        if size > np.count_nonzero(self.p):
+            raise ValueError('Fewer non-zero entries in p than size')
+        with np.errstate(divide='ignore'):
+            keys = rng.standard_exponential(len(self.p)) / self.p
+        return np.argsort(keys)[:size]
+
+    def sample(self, size=1, replace=True, rng=None):
+        """Return a list of ``size`` outcomes drawn from the table."""
+
+        outcomes = self.outcomes
+        return [outcomes[i] for i in self.sample_indices(size, replace, rng)]
+
+
+def get_rng(rng):
+    """Return ``rng``, or the global numpy random module if it is None."""
+
+    return rd if rng is None else rng
+
+
+class TableCache(object):
+    """
+    Maps distribution dicts to compiled sampling tables.
+
+    Tables are looked up by the identity of their distribution dict and 
+    checked against a snapshot of its items, so a dict changed in place is 
+    recompiled on its next lookup. The check compares items by identity 
+    first and costs far less than compiling a table.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+
+        self.maxsize = maxsize
+        self._entries: dict = {}
+
+    def __call__(self, dist: dict) -> SamplingTable:
+
+        items = tuple(dist.items())
+        entry = self._entries.get(id(dist))
+        if entry is None or entry[1] != items:
+            if len(self._entries) >= self.maxsize:
+                self._entries.clear()
+            # Hold a reference to dist so that its id cannot be reused.
+            entry = (dist, items, SamplingTable(dist))
+            self._entries[id(dist)] = entry
+        return entry[2]
+
+    def invalidate(self, dist: dict = None) -> None:
+        """Discard the table compiled from ``dist``, or all tables if None."""
+
+        if dist is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(id(dist), None)
+
+
 class StructureGenerator(object):
     
     def __init__(
@@ -41,18 +140,49 @@ class StructureGenerator(object):
         self.branch = branch
         self.composite_num = composite_num
         self.modifier_num = modifier_num
+        self._tables = TableCache()
 
-    def sample(self):
+    def sample(self, rng=None):
 
-        branch = rd.choice(
-            list(self.branch.keys()), p=list(self.branch.values())
-        )
-        composite_num = rd.choice(
-            list(self.composite_num.keys()), p=list(self.composite_num.values())
-        )
-        modifier_num = rd.choice(
-            list(self.modifier_num.keys()), p=list(self.modifier_num.values())
-        )
+        branch, = self._tables(self.branch).sample(rng=rng)
+        composite_num, = self._tables(self.composite_num).sample(rng=rng)
+        modifier_num, = self._tables(self.modifier_num).sample(rng=rng)
+
+        return self._build(branch, composite_num, modifier_num)
+
+    def sample_many(self, size=1, rng=None):
+        """
+        Sample ``size`` element structures.
+
+        Branches, composite counts and modifier counts for all structures are 
+        each drawn in a single vectorized call.
+
+        :param size: Number of structures to sample.
+        :param rng: Random generator, defaults to numpy's global random state.
+        """
+
+        branches = self._tables(self.branch).sample(size, rng=rng)
+        composite_nums = self._tables(self.composite_num).sample(size, rng=rng)
+        modifier_nums = self._tables(self.modifier_num).sample(size, rng=rng)
+
+        return [
+            self._build(branch, composite_num, modifier_num) 
+            for branch, composite_num, modifier_num 
+            in zip(branches, composite_nums, modifier_nums)
+        ]
+
+    def invalidate_tables(self):
+        """
+        Discard compiled sampling tables.
+
+        Tables are recompiled when distributions change, so this only frees 
+        memory.
+        """
+
+        self._tables.invalidate()
+
+    @staticmethod
+    def _build(branch, composite_num, modifier_num):
 
         if branch == 'basic':
             element = BasicElement()
@@ -154,37 +284,33 @@ class RoutineGenerator(object):
             diamond: t.cast(dict, diamond_params),
             tee: t.cast(dict, tee_params)
         }
+        self._tables = TableCache()
 
-    def sample(self, size=1, dist=None, replace=True):
+    def sample(self, size=1, dist=None, replace=True, rng=None):
         
         if dist == None:
             dist = self.routines
 
-        routine = rd.choice(
-            list(dist.keys()), size=size, p=list(dist.values()), replace=replace
-        )
-        
-        return list(routine)
+        return self._tables(dist).sample(size, replace, rng)
 
-    def sample_params(self, routine=None, size=1, dists=None, replace=True):
+    def sample_params(
+        self, routine=None, size=1, dists=None, replace=True, rng=None
+    ):
 
         if dists == None:
             dists = self.params[routine]
-        
-        params = {
-            param: rd.choice(
-                list(dists[param].keys()),
-                size=size,
-                p=list(dists[param].values()),
-                replace=replace
-            ) for param in dists
-        }
 
-        params = [
-            {param: params[param][i] for param in params} for i in range(size)
-        ]
+        return _sample_params(self._tables, dists, size, replace, rng)
 
-        return params
+    def invalidate_tables(self):
+        """
+        Discard compiled sampling tables.
+
+        Tables are recompiled when distributions change, so this only frees 
+        memory.
+        """
+
+        self._tables.invalidate()
 
 
 class DecoratorGenerator(object):
@@ -257,37 +383,101 @@ class DecoratorGenerator(object):
             shading: t.cast(dict, shading_params),
             numerosity: t.cast(dict, numerosity_params)
         }
+        self._tables = TableCache()
+        self._restr_rot_source: t.Optional[tuple] = None
+        self._restr_rot_params: dict = {}
     
-    def sample(self, size=1, dist=None, replace=True):
+    def sample(self, size=1, dist=None, replace=True, rng=None):
         
         if dist == None:
             dist = self.decorators
 
-        decorators = rd.choice(
-            list(dist.keys()), size=size, p=list(dist.values()), replace=replace
-        )
-        
-        return list(decorators)
+        return self._tables(dist).sample(size, replace, rng)
+
+    def sample_sets(self, sizes, dist=None, rng=None):
+        """
+        Sample one set of distinct decorators for each entry in ``sizes``.
+
+        Equivalent to calling ``self.sample(size=k, replace=False)`` for each 
+        ``k`` in ``sizes``, but all sets are drawn together using exponential 
+        sort keys. Decorators in each set are listed in draw order.
+
+        :param sizes: Number of decorators in each set.
+        :param dist: Decorator distribution, defaults to ``self.decorators``.
+        :param rng: Random generator, defaults to numpy's global random state.
+        """
+
+        if dist == None:
+            dist = self.decorators
+
+        table = self._tables(dist)
+        sizes = np.asarray(sizes, dtype=int)
+        if sizes.size and sizes.max() > np.count_nonzero(table.p):
+            raise ValueError('Fewer non-zero entries in p than size')
+
+        with np.errstate(divide='ignore'):
+            keys = (
+                get_rng(rng).standard_exponential((len(sizes), len(table.p))) 
+                / table.p
+            )
+        order = np.argsort(keys, axis=1)
+
+        outcomes = table.outcomes
+        return [[outcomes[j] for j in row[:k]] for row, k in zip(order, sizes)]
         
-    def sample_params(self, decorator=None, size=1, dists=None, replace=True):
+    def sample_params(
+        self, decorator=None, size=1, dists=None, replace=True, rng=None
+    ):
 
         if dists == None:
             dists = self.params[decorator]
-        
-        params = {
-            param: rd.choice(
-                list(dists[param].keys()),
-                size=size,
-                p=list(dists[param].values()),
-                replace=replace
-            ) for param in dists
-        }
 
-        params = [
-            {param: params[param][i] for param in params} for i in range(size)
-        ]
+        return _sample_params(self._tables, dists, size, replace, rng)
+
+    def restricted_rotation_params(self):
+        """
+        Return rotation params restricted to angles below pi.
+
+        The restricted distribution is renormalized and cached; it is rebuilt 
+        when the rotation angle distribution is replaced or changed.
+        """
+
+        angles = self.params[rotation]['angle']
+        source = (angles, tuple(angles.items()))
+        if (
+            self._restr_rot_source is None or 
+            self._restr_rot_source[0] is not angles or 
+            self._restr_rot_source[1] != source[1]
+        ):
+            restricted = {k: v for k, v in angles.items() if k < math.pi}
+            normalizing_ct = sum(restricted.values())
+            self._restr_rot_params = {
+                'angle': {k: v / normalizing_ct for k, v in restricted.items()}
+            }
+            self._restr_rot_source = source
+
+        return self._restr_rot_params
 
-        return params
+    def invalidate_tables(self):
+        """
+        Discard compiled sampling tables.
+
+        Tables are recompiled when distributions change, so this only frees 
+        memory.
+        """
+
+        self._tables.invalidate()
+        self._restr_rot_source = None
+
+
+def _sample_params(tables, dists, size, replace, rng):
+
+    params = {
+        param: tables(dists[param]).sample(size, replace, rng) 
+        for param in dists
+    }
+
+    return [{param: params[param][i] for param in params} for i in range(size)]
 
 
 def is_non_composite(element):
@@ -314,37 +504,39 @@ def get_noncomposite_elements(element):
     return output
 
 
+def has_symmetric_base(element):
+    """Return True if rotations of element by pi are indistinguishable."""
+
+    return (
+        isinstance(element.element, BasicElement) and
+        element.element.routine in [ellipse, rectangle]
+    )
+
+
 def generate_sandia_figure(
     structure_generator: StructureGenerator, 
     routine_generator: RoutineGenerator, 
     decorator_generator: DecoratorGenerator,
+    rng: t.Optional[np.random.Generator] = None
 ) -> Element:
     
-    restr_rot_params = {
-        'angle': {
-            k: v 
-            for k, v in decorator_generator.params[rotation]['angle'].items()
-            if v < math.pi 
-        }
-    }
-    normalizing_ct = sum(restr_rot_params['angle'].values())
-    restr_rot_params['angle'] = {
-        k: v / normalizing_ct for k, v in restr_rot_params['angle'].items()
-    } 
+    restr_rot_params = decorator_generator.restricted_rotation_params()
 
-    element = structure_generator.sample()
+    element = structure_generator.sample(rng=rng)
     noncomposite_elements = get_noncomposite_elements(element)
     
     for e in noncomposite_elements:
         if isinstance(e, BasicElement):
-            e.routine = routine_generator.sample().pop()
-            e.params = routine_generator.sample_params(e.routine).pop()
+            e.routine = routine_generator.sample(rng=rng).pop()
+            e.params = routine_generator.sample_params(
+                e.routine, rng=rng
+            ).pop()
             
     for e in noncomposite_elements:
         if isinstance(e, ModifiedElement):
            
             decorators = decorator_generator.sample(
-                size=len(e.modifiers), replace=False
+                size=len(e.modifiers), replace=False, rng=rng
             )  
             # Move numerosity element to the end, if present
             if numerosity in decorators:
@@ -354,16 +546,168 @@ def generate_sandia_figure(
 
             for modifier, decorator in zip(e.modifiers, decorators):
                 modifier.decorator = decorator
-                if (
-                    e.element in [ellipse, rectangle] and
-                    decorator == rotation
-                ):
+                if has_symmetric_base(e) and decorator == rotation:
                     modifier.params = decorator_generator.sample_params(
-                        dists = restr_rot_params
+                        dists = restr_rot_params, rng=rng
                     ).pop()
                 else:
                     modifier.params = decorator_generator.sample_params(
-                        decorator
+                        decorator, rng=rng
                     ).pop()
 
-    return element
\ No newline at end of file
+    return element
+
+
+def generate_sandia_figures(
+    n: int,
+    structure_generator: StructureGenerator, 
+    routine_generator: RoutineGenerator, 
+    decorator_generator: DecoratorGenerator,
+    rng: t.Optional[np.random.Generator] = None
+) -> t.List[Element]:
+    """
+    Generate ``n`` sandia figures in one batch.
+
+    Figures follow the same distribution as those produced by 
+    ``generate_sandia_figure``. Structures, routines, decorators and params 
+    for the whole batch are drawn with a few vectorized calls (one per 
+    distribution and per routine/decorator), and element trees are then 
+    assembled from the drawn arrays.
+
+    :param n: Number of figures to generate.
+    :param structure_generator: Samples figure structures.
+    :param routine_generator: Samples drawing routines and their params.
+    :param decorator_generator: Samples modifier decorators and their params.
+    :param rng: Random generator, defaults to numpy's global random state.
+    """
+
+    restr_rot_params = decorator_generator.restricted_rotation_params()
+
+    elements = structure_generator.sample_many(n, rng=rng)
+    noncomposite_elements = [
+        e for element in elements for e in get_noncomposite_elements(element)
+    ]
+    basic_elements = [
+        e for e in noncomposite_elements if isinstance(e, BasicElement)
+    ]
+    modified_elements = [
+        e for e in noncomposite_elements if isinstance(e, ModifiedElement)
+    ]
+
+    routines = routine_generator.sample(size=len(basic_elements), rng=rng)
+    for e, routine in zip(basic_elements, routines):
+        e.routine = routine
+    for routine, group in _group_by(basic_elements, routines).items():
+        params = routine_generator.sample_params(
+            routine, size=len(group), rng=rng
+        )
+        for e, p in zip(group, params):
+            e.params = p
+
+    decorator_sets = decorator_generator.sample_sets(
+        [len(e.modifiers) for e in modified_elements], rng=rng
+    )
+    modifiers, groups = [], []
+    for e, decorator_set in zip(modified_elements, decorator_sets):
+        # Move numerosity element to the end, if present
+        if numerosity in decorator_set:
+            decorator_set.remove(numerosity)
+            decorator_set.append(numerosity)
+        symmetric = has_symmetric_base(e)
+        for modifier, decorator in zip(e.modifiers, decorator_set):
+            modifier.decorator = decorator
+            modifiers.append(modifier)
+            groups.append((decorator, symmetric and decorator == rotation))
+
+    for (decorator, restricted), group in _group_by(modifiers, groups).items():
+        if restricted:
+            params = decorator_generator.sample_params(
+                size=len(group), dists=restr_rot_params, rng=rng
+            )
+        else:
+            params = decorator_generator.sample_params(
+                decorator, size=len(group), rng=rng
+            )
+        for modifier, p in zip(group, params):
+            modifier.params = p
+
+    return elements
+
+
+def figure_rng(seed: int, index: int) -> np.random.Generator:
+    """
+    Return the random generator for figure ``index`` of dataset ``seed``.
+
+    Uses a counter-based Philox bit generator keyed by ``seed``, with 
+    ``index`` placed in the high word of the counter. Each figure thus gets 
+    its own non-overlapping stream, which can be constructed in O(1) without 
+    replaying the streams of preceding figures.
+
+    :param seed: Dataset seed, must be in [0, 2 ** 128).
+    :param index: Figure index, must be in [0, 2 ** 64).
+    """
+
+    if not 0 <= index < 2 ** 64:
+        raise ValueError('Figure index out of range: {}'.format(index))
+
+    return np.random.Generator(
+        np.random.Philox(key=seed, counter=index << 192)
+    )
+
+
+def figure_at(
+    seed: int,
+    index: int,
+    structure_generator: StructureGenerator, 
+    routine_generator: RoutineGenerator, 
+    decorator_generator: DecoratorGenerator
+) -> Element:
+    """
+    Generate figure ``index`` of the dataset identified by ``seed``.
+
+    The result depends only on ``seed``, ``index`` and the generator 
+    distributions, so any figure can be rebuilt without generating the ones 
+    before it, and workers can generate disjoint index ranges independently.
+
+    :param seed: Dataset seed.
+    :param index: Position of the figure in the dataset.
+    :param structure_generator: Samples figure structures.
+    :param routine_generator: Samples drawing routines and their params.
+    :param decorator_generator: Samples modifier decorators and their params.
+    """
+
+    return generate_sandia_figure(
+        structure_generator, 
+        routine_generator, 
+        decorator_generator, 
+        rng=figure_rng(seed, index)
+    )
+
+
+def figures_in_range(
+    seed: int,
+    start: int,
+    stop: int,
+    structure_generator: StructureGenerator, 
+    routine_generator: RoutineGenerator, 
+    decorator_generator: DecoratorGenerator
+) -> t.Iterator[Element]:
+    """Lazily yield figures ``start`` to ``stop - 1`` of dataset ``seed``."""
+
+    for index in range(start, stop):
+        yield figure_at(
+            seed, 
+            index, 
+            structure_generator, 
+            routine_generator, 
+            decorator_generator
+        )
+
+
+def _group_by(items, keys):
+    """Group items by corresponding keys, preserving order within groups."""
+
+    groups: dict = {}
+    for item, key in zip(items, keys):
+        groups.setdefault(key, []).append(item)
+    return groups
@@ -0,0 +1,419 @@
+"""
+Generation of complete matrix problems from sandia figures.
+
+A problem is built from a base figure and two rules. Each rule is a
+``Transformation`` that cycles a few leaves of the base figure (routines or
+modifiers, with their params) through ``size`` distinct values:
+
+- the column rule is applied row-wise, taking each cell to the next cell in
+  its row; and
+- the row rule takes the first cell of each row to the first cell of the next
+  row.
+
+Cell ``(r, c)`` thus holds ``column_rule^c(row_rule^r(base))``. The correct
+answer is the bottom-right cell; distractors are variants of the answer that
+differ from it in one leaf and are drawn differently from it and from each
+other (see ``visual_key``).
+
+For throughput, base figures are sampled in batches with
+``generate_sandia_figures``, rules are applied to whole columns at a time with
+``Transformation.apply_many`` and figures are shared between cells wherever
+possible (see ``transformation``). Problems should therefore be treated as
+immutable.
+"""
+
+
+import math
+import typing as t
+import numpy as np
+from pyRavenMatrices.element import (
+    Element, ElementNode, BasicElement, ElementModifier, ModifiedElement,
+    CompositeElement
+)
+from pyRavenMatrices.matrix import MatrixStructure
+from pyRavenMatrices.transformation import Target, Transformation, get_targets
+from pyRavenMatrices.lib.sandia.definitions import rotation, shading
+from pyRavenMatrices.lib.sandia.generators import (
+    StructureGenerator, RoutineGenerator, DecoratorGenerator,
+    generate_sandia_figures, TableCache, get_rng, has_symmetric_base
+)
+
+
+_ROTATION_ANGLE = rotation.__defaults__[0]
+
+
+class MatrixProblem(object):
+    """A complete matrix problem."""
+
+    def __init__(
+        self,
+        matrix_structure: MatrixStructure,
+        figures: t.List[t.List[Element]],
+        alternatives: t.List[Element],
+        answer: int,
+        column_rule: Transformation,
+        row_rule: Transformation
+    ) -> None:
+        """
+        Initialize a matrix problem.
+
+        :param matrix_structure: Structure of the matrix.
+        :param figures: Figures of all cells, including the missing one, as a
+            list of rows.
+        :param alternatives: Answer alternatives.
+        :param answer: Index of the correct answer in ``alternatives``.
+        :param column_rule: Transformation taking each cell to the next cell
+            in its row.
+        :param row_rule: Transformation taking the first cell of each row to
+            the first cell of the next row.
+        """
+
+        self.matrix_structure = matrix_structure
+        self.figures = figures
+        self.alternatives = alternatives
+        self.answer = answer
+        self.column_rule = column_rule
+        self.row_rule = row_rule
+
+    def __repr__(self):
+
+        return 'MatrixProblem({}, answer={})'.format(
+            self.matrix_structure.name, self.answer
+        )
+
+    @property
+    def cells(self) -> t.List[t.List[t.Optional[Element]]]:
+        """Context cells, with ``None`` in place of the missing cell."""
+
+        cells: t.List[t.List[t.Optional[Element]]] = [
+            list(row) for row in self.figures
+        ]
+        cells[-1][-1] = None
+        return cells
+
+
+class ProblemGenerator(object):
+
+    def __init__(
+        self,
+        matrix_structure: MatrixStructure,
+        structure_generator: StructureGenerator = None,
+        routine_generator: RoutineGenerator = None,
+        decorator_generator: DecoratorGenerator = None,
+        column_rules: dict = None,
+        row_rules: dict = None,
+        batch_size: int = 256,
+        max_attempts: int = 32,
+        max_failures: int = 1024
+    ) -> None:
+        """
+        Initialize a problem generator.
+
+        :param matrix_structure: Structure of generated matrices.
+        :param structure_generator: Samples base figure structures.
+        :param routine_generator: Samples drawing routines and their params.
+        :param decorator_generator: Samples modifier decorators and their
+            params.
+        :param column_rules: Distribution of the number of leaves cycled by
+            the column rule.
+        :param row_rules: Distribution of the number of leaves cycled by the
+            row rule.
+        :param batch_size: Number of base figures sampled at a time.
+        :param max_attempts: Number of draws made when looking for distinct
+            leaf values or distractors before giving up on a base figure.
+        :param max_failures: Number of consecutive base figures yielding no
+            problem after which ``problems`` gives up.
+        """
+
+        if structure_generator == None:
+            structure_generator = StructureGenerator()
+        if routine_generator == None:
+            routine_generator = RoutineGenerator()
+        if decorator_generator == None:
+            decorator_generator = DecoratorGenerator()
+        if column_rules == None:
+            column_rules = {
+                1: .5,
+                2: .5
+            }
+        if row_rules == None:
+            row_rules = {
+                0: .5,
+                1: .5
+            }
+
+        self.matrix_structure = matrix_structure
+        self.structure_generator = structure_generator
+        self.routine_generator = routine_generator
+        self.decorator_generator = decorator_generator
+        self.column_rules = column_rules
+        self.row_rules = row_rules
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.max_failures = max_failures
+        self._tables = TableCache()
+
+    def __iter__(self) -> t.Iterator[MatrixProblem]:
+
+        return self.problems()
+
+    def problems(
+        self,
+        n: t.Optional[int] = None,
+        rng: t.Optional[np.random.Generator] = None
+    ) -> t.Iterator[MatrixProblem]:
+        """
+        Lazily yield ``n`` problems, or an endless stream if ``n`` is None.
+
+        :param n: Number of problems to generate.
+        :param rng: Random generator, defaults to numpy's global random state.
+        :raises ValueError: If ``max_failures`` base figures in a row yield
+            no problem, e.g. because more alternatives are requested than
+            leaves can provide.
+        """
+
+        count = failures = 0
+        while n == None or count < n:
+            bases = generate_sandia_figures(
+                self.batch_size,
+                self.structure_generator,
+                self.routine_generator,
+                self.decorator_generator,
+                rng=rng
+            )
+            for base in bases:
+                problem = self.problem(base, rng=rng)
+                if problem == None:
+                    failures += 1
+                    if failures == self.max_failures:
+                        raise ValueError(
+                            'No problem could be built from {} consecutive '
+                            'base figures for matrix structure {}'.format(
+                                failures, self.matrix_structure.name
+                            )
+                        )
+                    continue
+                failures = 0
+                yield problem
+                count += 1
+                if n != None and count == n:
+                    return
+
+    def problem(
+        self, base: Element, rng: t.Optional[np.random.Generator] = None
+    ) -> t.Optional[MatrixProblem]:
+        """
+        Build a problem from ``base``.
+
+        Returns None if no valid problem could be built from ``base``, e.g.
+        because too few distinct values were found for its leaves.
+
+        :param base: Base figure, placed in the top-left cell.
+        :param rng: Random generator, defaults to numpy's global random state.
+        """
+
+        rng = get_rng(rng)
+        size = self.matrix_structure.size
+        num_column, = self._tables(self.column_rules).sample(rng=rng)
+        num_row, = self._tables(self.row_rules).sample(rng=rng)
+
+        targets = get_targets(base)
+        order = rng.permutation(len(targets))
+        cycles: t.List[t.Tuple[Target, t.List[ElementNode]]] = []
+        for i in order:
+            if len(cycles) == num_column + num_row:
+                break
+            target = targets[i]
+            variants = self._variants(base, target, size - 1, rng)
+            if variants != None:
+                cycles.append((target, [target(base)] + variants))
+        # Figures with few leaves get fewer row rule leaves.
+        if len(cycles) < num_column or not cycles:
+            return None
+
+        column_rule = _cycle_transformation(cycles[:num_column])
+        row_rule = _cycle_transformation(cycles[num_column:])
+
+        firsts = [base]
+        for _ in range(size - 1):
+            firsts.append(row_rule(firsts[-1]))
+        columns = [firsts]
+        for _ in range(size - 1):
+            columns.append(column_rule.apply_many(columns[-1]))
+        figures = [list(row) for row in zip(*columns)]
+
+        answer = figures[-1][-1]
+        distractors = self._distractors(answer, cycles, rng)
+        if distractors == None:
+            return None
+        position = int(rng.choice(len(distractors) + 1))
+        alternatives = list(distractors)
+        alternatives.insert(position, answer)
+
+        return MatrixProblem(
+            self.matrix_structure,
+            figures,
+            alternatives,
+            position,
+            column_rule,
+            row_rule
+        )
+
+    def invalidate_tables(self) -> None:
+        """
+        Discard compiled sampling tables of ``self`` and its generators.
+
+        Tables are recompiled when distributions change, so this only frees 
+        memory.
+        """
+
+        self._tables.invalidate()
+        self.structure_generator.invalidate_tables()
+        self.routine_generator.invalidate_tables()
+        self.decorator_generator.invalidate_tables()
+
+    def _variants(self, figure, target, count, rng):
+        """Return ``count`` distinct leaves differing from ``target(figure)``.
+
+        Basic elements vary in routine and params, modifiers only in params,
+        so that constraints on modifier order are preserved.
+        """
+
+        leaf = target(figure)
+        seen = {leaf.key()}
+        variants = []
+        for _ in range(self.max_attempts):
+            if len(variants) == count:
+                return variants
+            for candidate in self._sample_leaves(figure, target, count, rng):
+                if candidate.key() not in seen and len(variants) < count:
+                    seen.add(candidate.key())
+                    variants.append(candidate)
+        return variants if len(variants) == count else None
+
+    def _sample_leaves(self, figure, target, count, rng):
+
+        leaf = target(figure)
+        leaves: t.List[ElementNode] = []
+        if isinstance(leaf, BasicElement):
+            rg = self.routine_generator
+            for routine in rg.sample(size=count, rng=rng):
+                element = BasicElement()
+                element.routine = routine
+                element.params = rg.sample_params(routine, rng=rng).pop()
+                leaves.append(element)
+        else:
+            dg = self.decorator_generator
+            parent = figure if target.parent == None else target.parent(figure)
+            if leaf.decorator == rotation and has_symmetric_base(parent):
+                params = dg.sample_params(
+                    size=count, dists=dg.restricted_rotation_params(), rng=rng
+                )
+            else:
+                params = dg.sample_params(leaf.decorator, size=count, rng=rng)
+            for p in params:
+                modifier = ElementModifier()
+                modifier.decorator = leaf.decorator
+                modifier.params = p
+                leaves.append(modifier)
+        return leaves
+
+    def _distractors(self, answer, cycles, rng):
+        """Return distinct distractors for ``answer``, or None.
+
+        Distractors first take other values of the rule leaves, which makes
+        them plausible completions of the rows, and are topped up with
+        variants of randomly chosen leaves.
+        """
+
+        count = self.matrix_structure.num_alternatives - 1
+        seen = {visual_key(answer)}
+        distractors: t.List[Element] = []
+
+        def add(target, leaf):
+            candidate = target.replace(answer, leaf)
+            key = visual_key(candidate)
+            if key not in seen:
+                seen.add(key)
+                distractors.append(candidate)
+
+        candidates = [
+            (target, leaf) for target, cycle in cycles for leaf in cycle
+        ]
+        for i in rng.permutation(len(candidates)):
+            if len(distractors) == count:
+                return distractors
+            add(*candidates[i])
+
+        targets = get_targets(answer)
+        for _ in range(self.max_attempts):
+            if len(distractors) == count:
+                return distractors
+            target = targets[int(rng.choice(len(targets)))]
+            for leaf in self._sample_leaves(answer, target, 1, rng):
+                add(target, leaf)
+        return distractors if len(distractors) == count else None
+
+
+def visual_key(element: ElementNode) -> t.Hashable:
+    """
+    Return a key equal for figures that are drawn alike.
+
+    The key is ``element.key()``, except that rotations of ellipses and
+    rectangles are taken modulo pi (see ``has_symmetric_base``), and that
+    the order and repetition of parts of unshaded composites is ignored, as
+    their outlines are merely overlaid. Rotation restrictions are decided
+    when leaves are sampled, but rules may later swap the base routine for a
+    symmetric one, so figures with distinct keys may still look the same.
+    """
+
+    if isinstance(element, ModifiedElement):
+        symmetric = has_symmetric_base(element)
+        modifiers = []
+        for modifier in element.modifiers:
+            if symmetric and modifier.decorator == rotation:
+                angle = modifier.params.get('angle', _ROTATION_ANGLE)
+                # Round before reducing so that angles off by float error
+                # from a multiple of pi map to 0.
+                turns = round(angle / math.pi, 9) % 1.
+                modifiers.append((ElementModifier, rotation, turns))
+            else:
+                modifiers.append(modifier.key())
+        return (
+            ModifiedElement, visual_key(element.element), tuple(modifiers)
+        )
+    elif isinstance(element, CompositeElement):
+        keys = [visual_key(sub) for sub in element.elements]
+        if _shaded(element):
+            return (CompositeElement, tuple(keys))
+        return (CompositeElement, frozenset(keys))
+    else:
+        return element.key()
+
+
+def _shaded(element):
+
+    if isinstance(element, ModifiedElement):
+        return (
+            any(mod.decorator == shading for mod in element.modifiers) or
+            _shaded(element.element)
+        )
+    elif isinstance(element, CompositeElement):
+        return any(_shaded(sub) for sub in element.elements)
+    return False
+
+
+def _cycle_transformation(cycles):
+    """
+    Return a transformation advancing each target by one step in its cycle.
+    """
+
+    triples = []
+    for target, cycle in cycles:
+        for pattern, value in zip(cycle, cycle[1:] + cycle[:1]):
+            if isinstance(value, BasicElement):
+                spec = {'routine': value.routine, 'params': value.params}
+            else:
+                spec = {'decorator': value.decorator, 'params': value.params}
+            triples.append((target, pattern, spec))
+    return Transformation(*triples)
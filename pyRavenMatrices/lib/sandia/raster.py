@@ -0,0 +1,827 @@
+"""
+A pure NumPy rasterizer for sandia figures.
+
+Sandia figures are built from six polygonal or elliptical shapes and four
+modifiers, each of which is either an affine transformation (``scale``,
+``rotation``, ``numerosity``) or a fill (``shading``). Instead of issuing
+cairo calls figure by figure, this module interprets figures by routine and
+decorator identity into polygons in device coordinates plus fill events, and
+rasterizes batches with vectorized scanline winding numbers (fills) and
+point-segment distances (outlines). Figures, edges and pixels are processed
+in chunks of bounded size, so memory use does not grow with the batch.
+
+The rasterizer mirrors the semantics of ``render.draw_cell``: outlines of all
+shapes accumulate in one path, each ``shading`` fills the whole path built so
+far with its gray, and the final outline is stroked in black. Ellipses are
+approximated by regular polygons with ``ELLIPSE_SEGMENTS`` sides, and
+outlines are stroked like cairo's defaults, with butt caps and miter joins.
+Antialiasing is approximated by supersampling fills and joins and by
+distance-based coverage of outline segments, so results match cairo output
+within a small tolerance rather than exactly (see ``compare_with_cairo``).
+
+``render_batch`` selects between this backend and cairo, which remains the
+default. The curve ``tolerance`` of render profiles is ignored here.
+"""
+
+
+import functools
+import inspect
+import math
+import typing as t
+import cairo
+import numpy as np
+import pyRavenMatrices.matrix as mat
+import pyRavenMatrices.element as elt
+import pyRavenMatrices.render as render
+from pyRavenMatrices.lib.sandia.definitions import (
+    ellipse, triangle, rectangle, trapezoid, diamond, tee,
+    scale, rotation, shading, numerosity, _get_dims
+)
+
+
+ELLIPSE_SEGMENTS = 64
+SUPERSAMPLING = 2
+# Cairo's default; longer miters are drawn as bevels.
+MITER_LIMIT = 10.
+# Maximum number of edge crossings, edge-pixel pairs or samples processed at
+# once.
+CHUNK_SIZE = 2 ** 20
+BACKENDS = ('auto', 'cairo', 'numpy')
+# Pixels differing from cairo by more than this count as outliers.
+OUTLIER_DIFFERENCE = .25
+
+
+class UnsupportedElementError(ValueError):
+    """Raised for figures using routines or decorators unknown to NumPy."""
+
+
+##############
+### SHAPES ###
+##############
+
+
+# Each entry maps a routine to its vertices in shape coordinates, the scale
+# applied to them and the validity check on ``r``, as in ``definitions``.
+
+def _ellipse_shape(width, height, r):
+
+    angles = np.linspace(0., 2 * math.pi, ELLIPSE_SEGMENTS, endpoint=False)
+    points = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    return points, (width / (2 * r), height / 2)
+
+
+def _triangle_shape(width, height, r):
+
+    div = max(1, r)
+    points = [
+        (- width / 2., height / 2.),
+        (width / 2., height / 2.),
+        (0, - height / 2.)
+    ]
+    return points, (1 / div, r / div)
+
+
+def _rectangle_shape(width, height, r):
+
+    points = [
+        (- width / 2., height / 2.),
+        (width / 2., height / 2.),
+        (width / 2., - height / 2.),
+        (- width / 2., - height / 2.)
+    ]
+    return points, (1 / r, 1)
+
+
+def _trapezoid_shape(width, height, r):
+
+    div = max(1, r)
+    points = [
+        (- width / 2., height / 2.),
+        (width / 2., height / 2.),
+        (width / 4., - height / 2.),
+        (- width / 4., - height / 2.)
+    ]
+    return points, (1 / div, r / div)
+
+
+def _diamond_shape(width, height, r):
+
+    points = [
+        (0, height / 2.),
+        (width / 2., - height / 4.),
+        (0, - height / 2.),
+        (- width / 2., - height / 4.)
+    ]
+    return points, (1 / r, 1)
+
+
+def _tee_shape(width, height, r):
+
+    div = max(1, r)
+    points = [
+        (- width / 6., height / 2.),
+        (width / 6., height / 2.),
+        (width / 6., - height / 4.),
+        (width / 2., - height / 4.),
+        (width / 2., - height / 2.),
+        (- width / 2., - height / 2.),
+        (- width / 2., - height / 4.),
+        (- width / 6., - height / 4.)
+    ]
+    return points, (1 / div, r / div)
+
+
+_SHAPES: t.Dict[t.Callable, t.Tuple[t.Callable, t.Callable]] = {
+    ellipse: (_ellipse_shape, lambda r: 2 <= r),
+    triangle: (_triangle_shape, lambda r: 0 < r),
+    rectangle: (_rectangle_shape, lambda r: r >= 2),
+    trapezoid: (_trapezoid_shape, lambda r: r > 0),
+    diamond: (_diamond_shape, lambda r: 1 <= r),
+    tee: (_tee_shape, lambda r: 0 < r)
+}
+_DECORATORS = frozenset([scale, rotation, shading, numerosity])
+
+
+@functools.lru_cache(maxsize=1024)
+def _polygon(routine, width, height, horizontal_margin, vertical_margin, r):
+    """Return vertices of a shape in cell coordinates, as a (K, 3) array."""
+
+    builder, valid = _SHAPES[routine]
+    if not valid(r):
+        raise ValueError()
+    cell_structure = mat.CellStructure(
+        None, width, height, horizontal_margin, vertical_margin
+    )
+    points, (sx, sy) = builder(*_get_dims(cell_structure), r)
+    points = np.asarray(points, dtype=float)
+    polygon = np.ones((len(points), 3))
+    polygon[:, 0] = width / 2. + sx * points[:, 0]
+    polygon[:, 1] = height / 2. + sy * points[:, 1]
+    polygon.flags.writeable = False
+    return polygon
+
+
+@functools.lru_cache(maxsize=None)
+def _defaults(function):
+    """Return default keyword arguments of a routine or decorator."""
+
+    return {
+        name: param.default
+        for name, param in inspect.signature(function).parameters.items()
+        if param.default is not inspect.Parameter.empty
+    }
+
+
+def _param(node, function, name):
+
+    params = node.params
+    return params[name] if name in params else _defaults(function)[name]
+
+
+##################
+### TRANSFORMS ###
+##################
+
+
+def _translation(x, y):
+
+    return np.array([[1., 0., x], [0., 1., y], [0., 0., 1.]])
+
+
+def _scaling(sx, sy):
+
+    return np.array([[sx, 0., 0.], [0., sy, 0.], [0., 0., 1.]])
+
+
+def _rotation(angle):
+
+    c, s = math.cos(angle), math.sin(angle)
+    return np.array([[c, -s, 0.], [s, c, 0.], [0., 0., 1.]])
+
+
+def _about_center(matrix, cell_structure):
+
+    x, y = cell_structure.width / 2., cell_structure.height / 2.
+    return _translation(x, y) @ matrix @ _translation(-x, -y)
+
+
+###############
+### TRACING ###
+###############
+
+
+class _Program(object):
+    """Polygons and fill events produced by drawing one figure."""
+
+    def __init__(self) -> None:
+
+        self.polygons: t.List[np.ndarray] = []
+        # Whether each polygon approximates a smooth closed curve.
+        self.smooth: t.List[bool] = []
+        self.fills: t.List[t.Tuple[int, float]] = []
+
+    def edges(self, count: int = None) -> np.ndarray:
+        """Return edges of the first ``count`` polygons as an (E, 4) array.
+        """
+
+        polygons = self.polygons[:count]
+        if not polygons:
+            return np.empty((0, 4))
+        return np.concatenate([
+            np.concatenate([p, np.roll(p, -1, axis=0)], axis=1)
+            for p in polygons
+        ])
+
+    def outline(self) -> np.ndarray:
+        """Return edges of all polygons with cap flags as an (E, 6) array.
+
+        The last two columns flag edges starting and ending with a cap.
+        Polygonal shapes are drawn as open paths ending at their first
+        vertex, so their first edge starts and their last edge ends with a
+        cap; smooth curves have none. Edges are joined at all other vertices
+        (see ``_joins``).
+        """
+
+        edges = self.edges()
+        caps = np.zeros((len(edges), 2))
+        end = 0
+        for polygon, smooth in zip(self.polygons, self.smooth):
+            start, end = end, end + len(polygon)
+            if not smooth:
+                caps[start, 0] = caps[end - 1, 1] = 1.
+        return np.concatenate([edges, caps], axis=1)
+
+
+def supports(element: elt.Element) -> bool:
+    """Return True if ``element`` can be rasterized by this module."""
+
+    if isinstance(element, elt.BasicElement):
+        return element.routine in _SHAPES
+    elif isinstance(element, elt.ModifiedElement):
+        return (
+            supports(element.element) and
+            all(mod.decorator in _DECORATORS for mod in element.modifiers)
+        )
+    elif isinstance(element, elt.CompositeElement):
+        return all(supports(sub) for sub in element.elements)
+    else:
+        return isinstance(element, elt.EmptyElement)
+
+
+def trace(
+    element: elt.Element, cell_structure: mat.CellStructure
+) -> _Program:
+    """Interpret ``element`` into polygons and fill events."""
+
+    program = _Program()
+    _draw(element, np.eye(3), cell_structure, program)
+    return program
+
+
+def _draw(element, matrix, cell_structure, program):
+
+    if isinstance(element, elt.BasicElement):
+        if element.routine not in _SHAPES:
+            raise UnsupportedElementError(
+                'Unsupported routine {}'.format(element.routine)
+            )
+        polygon = _polygon(
+            element.routine,
+            cell_structure.width,
+            cell_structure.height,
+            cell_structure.horizontal_margin,
+            cell_structure.vertical_margin,
+            _param(element, element.routine, 'r')
+        )
+        program.polygons.append((polygon @ matrix.T)[:, :2])
+        program.smooth.append(element.routine is ellipse)
+    elif isinstance(element, elt.ModifiedElement):
+        _modify(
+            element.element,
+            element.modifiers,
+            len(element.modifiers) - 1,
+            matrix,
+            cell_structure,
+            program
+        )
+    elif isinstance(element, elt.CompositeElement):
+        for sub in element.elements:
+            _draw(sub, matrix, cell_structure, program)
+    elif not isinstance(element, elt.EmptyElement):
+        raise TypeError('Unexpected type {}'.format(str(type(element))))
+
+
+def _modify(base, modifiers, k, matrix, cell_structure, program):
+    """Draw ``base`` wrapped by ``modifiers[:k + 1]``.
+
+    The last modifier is the outermost wrapper, so it is applied first.
+    """
+
+    if k < 0:
+        _draw(base, matrix, cell_structure, program)
+        return
+
+    modifier = modifiers[k]
+    decorator = modifier.decorator
+    if decorator is scale:
+        factor = _param(modifier, scale, 'factor')
+        matrix = matrix @ _about_center(
+            _scaling(factor, factor), cell_structure
+        )
+        _modify(base, modifiers, k - 1, matrix, cell_structure, program)
+    elif decorator is rotation:
+        angle = _param(modifier, rotation, 'angle')
+        matrix = matrix @ _about_center(_rotation(angle), cell_structure)
+        _modify(base, modifiers, k - 1, matrix, cell_structure, program)
+    elif decorator is shading:
+        _modify(base, modifiers, k - 1, matrix, cell_structure, program)
+        program.fills.append(
+            (len(program.polygons), _param(modifier, shading, 'lightness'))
+        )
+    elif decorator is numerosity:
+        for i in range(_param(modifier, numerosity, 'number')):
+            x = (i % 3) * (cell_structure.width / 3.)
+            y = (i // 3) * (cell_structure.height / 3.)
+            _modify(
+                base,
+                modifiers,
+                k - 1,
+                matrix @ _translation(x, y) @ _scaling(1 / 3, 1 / 3),
+                cell_structure,
+                program
+            )
+    else:
+        raise UnsupportedElementError(
+            'Unsupported decorator {}'.format(decorator)
+        )
+
+
+#####################
+### RASTERIZATION ###
+#####################
+
+
+def _concatenate(edge_sets, columns=4):
+    """Concatenate edge sets, returning edges and their set indices."""
+
+    sizes = [len(edges) for edges in edge_sets]
+    if not sum(sizes):
+        return np.empty((0, columns)), np.empty(0, dtype=np.intp)
+    return (
+        np.concatenate(edge_sets),
+        np.repeat(np.arange(len(edge_sets)), sizes)
+    )
+
+
+def _expand(counts):
+    """Return owner and local indices of ragged ranges of ``counts`` items.
+    """
+
+    owners = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    return owners, np.arange(len(owners)) - starts[owners]
+
+
+def _batches(counts):
+    """Yield slices of items whose summed counts stay within ``CHUNK_SIZE``.
+    """
+
+    totals = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        offset = totals[start - 1] if start else 0
+        stop = np.searchsorted(totals, offset + CHUNK_SIZE, side='right')
+        stop = max(stop, start + 1)
+        yield slice(start, stop)
+        start = stop
+
+
+def _fill_coverage(edge_sets, width, height, samples):
+    """Return nonzero winding coverage of pixels for each set of edges.
+
+    Each edge is intersected with the sample rows it spans, and the
+    direction of each crossing is accumulated at the first sample to its
+    right, so that winding numbers are prefix sums along rows.
+    """
+
+    rows, columns = height * samples, width * samples
+    winding = np.zeros((len(edge_sets), rows, columns + 1), dtype=np.int32)
+    edges, sets = _concatenate(edge_sets)
+    x0, y0, x1, y1 = edges.T
+    low = np.ceil(np.minimum(y0, y1) * samples - .5).clip(0, rows)
+    high = np.ceil(np.maximum(y0, y1) * samples - .5).clip(0, rows)
+    counts = (high - low).astype(np.intp)
+    for batch in _batches(counts):
+        owners, local = _expand(counts[batch])
+        owners += batch.start
+        row = low[owners].astype(np.intp) + local
+        y = (row + .5) / samples
+        slope = (x1 - x0)[owners] / (y1 - y0)[owners]
+        x = x0[owners] + (y - y0[owners]) * slope
+        column = np.floor(x * samples + .5).clip(0, columns).astype(np.intp)
+        direction = np.where(y1[owners] > y0[owners], 1, -1)
+        np.add.at(winding, (sets[owners], row, column), direction)
+
+    inside = np.cumsum(winding[:, :, :columns], axis=2, dtype=np.int32) != 0
+    return inside.reshape(
+        len(edge_sets), height, samples, width, samples
+    ).mean(axis=(2, 4))
+
+
+def _stroke_coverage(edge_sets, width, height, line_width, antialias):
+    """Return coverage of pixels by the stroke of each set of edges.
+
+    Edges are given with cap flags (see ``_Program.outline``). Capped ends
+    are cut square at their endpoints, other ends are rounded; the outer
+    sides of joins are covered separately (see ``_join_coverage``).
+    Distances to each edge are only evaluated at pixels within reach of its
+    bounding box.
+    """
+
+    coverage = np.zeros((len(edge_sets), height * width))
+    reach = line_width / 2. + (.5 if antialias else 0.)
+    edges, sets = _concatenate(edge_sets, 6)
+    length = np.hypot(edges[:, 2] - edges[:, 0], edges[:, 3] - edges[:, 1])
+    # Degenerate edges are not stroked with butt caps, nor need they be
+    # rounded, as joins cover their neighbors' corners.
+    stroked = length > 0
+    edges, sets, length = edges[stroked], sets[stroked], length[stroked]
+    x0, y0, x1, y1, cap0, cap1 = edges.T
+    ux, uy = (x1 - x0) / length, (y1 - y0) / length
+    capped = (cap0 > 0) | (cap1 > 0)
+    left = np.ceil(np.minimum(x0, x1) - reach - .5).clip(0, width)
+    right = np.floor(np.maximum(x0, x1) + reach - .5).clip(-1, width - 1)
+    top = np.ceil(np.minimum(y0, y1) - reach - .5).clip(0, height)
+    bottom = np.floor(np.maximum(y0, y1) + reach - .5).clip(-1, height - 1)
+    spans = (right - left + 1).clip(0).astype(np.intp)
+    counts = spans * (bottom - top + 1).clip(0).astype(np.intp)
+    for batch in _batches(counts):
+        owners, local = _expand(counts[batch])
+        owners += batch.start
+        column = left[owners].astype(np.intp) + local % spans[owners]
+        row = top[owners].astype(np.intp) + local // spans[owners]
+        px, py = column + .5 - x0[owners], row + .5 - y0[owners]
+        ex, ey = ux[owners], uy[owners]
+        along = px * ex + py * ey
+        across = px * ey - py * ex
+        # Distance past either end, measured from the nearer endpoint.
+        past = np.maximum(np.maximum(-along, along - length[owners]), 0.)
+        ends = np.flatnonzero(capped[owners])
+        if len(ends):
+            # Past capped ends, only the distance across the edge counts;
+            # coverage is instead cut off at the end.
+            start = np.where(cap0[owners[ends]] > 0, along[ends], np.inf)
+            end = np.where(
+                cap1[owners[ends]] > 0,
+                length[owners[ends]] - along[ends],
+                np.inf
+            )
+            past[ends] = np.where(
+                (start < 0.) | (end < 0.), 0., past[ends]
+            )
+        distance = np.hypot(across, past)
+        if antialias:
+            value = np.clip(line_width / 2. + .5 - distance, 0., 1.)
+            if len(ends):
+                value[ends] *= (
+                    np.clip(start + .5, 0., 1.) * np.clip(end + .5, 0., 1.)
+                )
+        else:
+            value = (distance <= line_width / 2.).astype(float)
+            if len(ends):
+                value[ends] *= (start >= 0.) & (end >= 0.)
+        np.maximum.at(coverage, (sets[owners], row * width + column), value)
+
+    return coverage.reshape(len(edge_sets), height, width)
+
+
+def _join_coverage(quad_sets, width, height, samples):
+    """Return coverage of pixels by each set of joins (see ``_joins``).
+
+    Joins are small convex quadrilaterals, so pixels are only sampled within
+    their bounding boxes, at the sample positions of ``_fill_coverage``.
+    """
+
+    coverage = np.zeros((len(quad_sets), height * width))
+    sizes = [len(quads) for quads in quad_sets]
+    if not sum(sizes):
+        return coverage.reshape(len(quad_sets), height, width)
+    quads = np.concatenate(quad_sets)
+    sets = np.repeat(np.arange(len(quad_sets)), sizes)
+    low, high = quads.min(axis=1), quads.max(axis=1)
+    left = np.floor(low[:, 0]).clip(0, width)
+    right = np.floor(high[:, 0]).clip(-1, width - 1)
+    top = np.floor(low[:, 1]).clip(0, height)
+    bottom = np.floor(high[:, 1]).clip(-1, height - 1)
+    spans = (right - left + 1).clip(0).astype(np.intp)
+    counts = spans * (bottom - top + 1).clip(0).astype(np.intp)
+    offsets = (np.arange(samples) + .5) / samples
+    sx, sy = np.meshgrid(offsets, offsets)
+    sx, sy = sx.ravel(), sy.ravel()
+    directions = np.roll(quads, -1, axis=1) - quads
+    for batch in _batches(counts * samples * samples):
+        owners, local = _expand(counts[batch])
+        owners += batch.start
+        column = left[owners].astype(np.intp) + local % spans[owners]
+        row = top[owners].astype(np.intp) + local // spans[owners]
+        x = column[:, None] + sx
+        y = row[:, None] + sy
+        inside = np.ones(x.shape, dtype=bool)
+        for k in range(4):
+            vx, vy = quads[owners, k, 0, None], quads[owners, k, 1, None]
+            dx = directions[owners, k, 0, None]
+            dy = directions[owners, k, 1, None]
+            inside &= dx * (y - vy) - dy * (x - vx) >= 0.
+        np.maximum.at(
+            coverage,
+            (sets[owners], row * width + column),
+            inside.mean(axis=1)
+        )
+
+    return coverage.reshape(len(quad_sets), height, width)
+
+
+def _joins(programs, line_width):
+    """Return vertices of the line joins of each program as (J, 4, 2) arrays.
+
+    Edges are joined at every vertex but the first of polygonal shapes
+    (see ``_Program.outline``), with miters or, past ``MITER_LIMIT``,
+    bevels. Each join is a quadrilateral on the outer side of its corner,
+    oriented counterclockwise so that overlapping joins do not cancel out.
+    """
+
+    polygons = [p for program in programs for p in program.polygons]
+    if not polygons:
+        return [np.empty((0, 4, 2)) for _ in programs]
+    figures = np.repeat(
+        np.arange(len(programs)),
+        [len(program.polygons) for program in programs]
+    )
+    smooth = np.concatenate([program.smooth for program in programs])
+    sizes = np.array([len(p) for p in polygons])
+    vertices = np.concatenate(polygons)
+    owners, local = _expand(sizes)
+    starts = (np.cumsum(sizes) - sizes)[owners]
+    previous = vertices[starts + (local - 1) % sizes[owners]]
+    following = vertices[starts + (local + 1) % sizes[owners]]
+
+    a, b = vertices - previous, following - vertices
+    a_length = np.hypot(*a.T)[:, None]
+    b_length = np.hypot(*b.T)[:, None]
+    a = a / np.where(a_length > 0, a_length, 1.)
+    b = b / np.where(b_length > 0, b_length, 1.)
+    bisector = a - b
+    bisector_length = np.hypot(*bisector.T)[:, None]
+    # Sine of half the angle of the corner; miters are 1 / sine times longer
+    # than half the line width.
+    sine = np.hypot(*(a + b).T) / 2.
+    keep = (
+        ((local > 0) | smooth[owners]) &
+        (a_length[:, 0] > 0) & (b_length[:, 0] > 0) &
+        (bisector_length[:, 0] > 1e-9)
+    )
+    vertices, a, b = vertices[keep], a[keep], b[keep]
+    bisector = bisector[keep] / bisector_length[keep]
+    sine = sine[keep]
+
+    half = line_width / 2.
+    offsets = []
+    for edge in (a, b):
+        normal = np.stack([-edge[:, 1], edge[:, 0]], axis=1)
+        normal[np.sum(normal * bisector, axis=1) < 0] *= -1.
+        offsets.append(vertices + half * normal)
+    first, second = offsets
+    tip = np.where(
+        (sine >= 1. / MITER_LIMIT)[:, None],
+        vertices + bisector * (half / np.maximum(sine, 1e-12))[:, None],
+        (first + second) / 2.
+    )
+    u, v = first - vertices, second - vertices
+    swap = u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0] < 0
+    first[swap], second[swap] = second[swap], first[swap]
+
+    quads = np.stack([vertices, first, tip, second], axis=1)
+    counts = np.bincount(figures[owners[keep]], minlength=len(programs))
+    return np.split(quads, np.cumsum(counts)[:-1])
+
+
+def _chunks(count, cell_structure, antialias):
+    """Yield slices of figures whose fill samples stay within ``CHUNK_SIZE``.
+    """
+
+    samples = SUPERSAMPLING if antialias else 1
+    size = (
+        cell_structure.height * samples *
+        (cell_structure.width * samples + 1)
+    )
+    step = max(1, CHUNK_SIZE // size)
+    for start in range(0, count, step):
+        yield slice(start, min(start + step, count))
+
+
+def rasterize(
+    elements: t.Sequence[elt.Element],
+    cell_structure: mat.CellStructure,
+    line_width: float = render.LINE_WIDTH,
+    antialias: bool = True
+) -> np.ndarray:
+    """
+    Rasterize figures and return their lightness as an (N, H, W) array.
+
+    Lightness is 1 for white and 0 for black.
+
+    :param elements: Figures to rasterize.
+    :param cell_structure: Structure of the cells being rasterized.
+    :param line_width: Width of figure outlines, in px.
+    :param antialias: If False, pixels are sampled once at their centers.
+    """
+
+    elements = list(elements)
+    images = np.empty(
+        (len(elements), cell_structure.height, cell_structure.width)
+    )
+    for chunk in _chunks(len(elements), cell_structure, antialias):
+        images[chunk] = _rasterize(
+            elements[chunk], cell_structure, line_width, antialias
+        )
+
+    return images
+
+
+def _rasterize(elements, cell_structure, line_width, antialias):
+
+    width, height = cell_structure.width, cell_structure.height
+    programs = [trace(element, cell_structure) for element in elements]
+    images = np.ones((len(programs), height, width))
+
+    # Fills are applied in order, one rank of fill events at a time.
+    samples = SUPERSAMPLING if antialias else 1
+    ranks = max([len(program.fills) for program in programs] + [0])
+    for rank in range(ranks):
+        selected = [
+            i for i, program in enumerate(programs)
+            if len(program.fills) > rank
+        ]
+        edge_sets, lightness = [], []
+        for i in selected:
+            count, value = programs[i].fills[rank]
+            edge_sets.append(programs[i].edges(count))
+            lightness.append(value)
+        coverage = _fill_coverage(edge_sets, width, height, samples)
+        images[selected] += coverage * (
+            np.array(lightness)[:, None, None] - images[selected]
+        )
+
+    images *= 1. - np.maximum(
+        _stroke_coverage(
+            [program.outline() for program in programs],
+            width,
+            height,
+            line_width,
+            antialias
+        ),
+        _join_coverage(_joins(programs, line_width), width, height, samples)
+    )
+
+    return images
+
+
+def to_pixels(
+    lightness: np.ndarray, profile: render.RenderProfile = None
+) -> np.ndarray:
+    """Convert lightness values to pixels of the format of ``profile``."""
+
+    if profile is None:
+        profile = render.DEFAULT_PROFILE
+    if profile.format == cairo.FORMAT_A8:
+        return np.rint(255. * (1. - lightness)).astype(np.uint8)
+    gray = np.rint(255. * lightness).astype(np.uint32)
+    return np.uint32(0xFF000000) | (gray << 16) | (gray << 8) | gray
+
+
+def to_lightness(
+    pixels: np.ndarray, profile: render.RenderProfile = None
+) -> np.ndarray:
+    """Convert pixels of the format of ``profile`` to lightness values."""
+
+    if profile is None:
+        profile = render.DEFAULT_PROFILE
+    if profile.format == cairo.FORMAT_A8:
+        return 1. - pixels / 255.
+    return ((pixels >> 8) & 0xFF) / 255.
+
+
+################
+### BACKENDS ###
+################
+
+
+def render_batch(
+    elements: t.Iterable[elt.Element],
+    cell_structure: mat.CellStructure,
+    out: np.ndarray = None,
+    line_width: float = render.LINE_WIDTH,
+    profile: render.RenderProfile = None,
+    backend: str = 'cairo'
+) -> np.ndarray:
+    """
+    Render figures into an (N, H, W) array with the chosen backend.
+
+    Arguments and output are as for ``render.render_batch``. The NumPy
+    backend honors the format and antialiasing of ``profile`` but ignores
+    its ``tolerance``, since ellipses are always approximated with
+    ``ELLIPSE_SEGMENTS`` sides.
+
+    :param backend: 'cairo', 'numpy', or 'auto' to use NumPy whenever all
+        figures are supported by it. NumPy output only approximates cairo
+        output (see ``compare_with_cairo``), so it must be opted into.
+    """
+
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend {}'.format(backend))
+    if profile is None:
+        profile = render.DEFAULT_PROFILE
+    elements = list(elements)
+    if backend == 'auto':
+        backend = 'numpy' if all(map(supports, elements)) else 'cairo'
+    if backend == 'cairo':
+        return render.render_batch(
+            elements, cell_structure, out, line_width, profile
+        )
+    if out is None:
+        out = np.empty(
+            (len(elements), cell_structure.height, cell_structure.width),
+            dtype=profile.dtype
+        )
+    else:
+        render.check_output(out, cell_structure, profile)
+        if len(out) < len(elements):
+            raise ValueError('Output array too small for all elements')
+
+    # Each chunk is written to ``out`` as soon as it is rasterized, so that
+    # intermediate arrays stay bounded regardless of the batch size.
+    antialias = profile.antialias != cairo.ANTIALIAS_NONE
+    for chunk in _chunks(len(elements), cell_structure, antialias):
+        out[chunk] = to_pixels(
+            _rasterize(elements[chunk], cell_structure, line_width, antialias),
+            profile
+        )
+    return out
+
+
+def compare_with_cairo(
+    elements: t.Sequence[elt.Element],
+    cell_structure: mat.CellStructure,
+    line_width: float = render.LINE_WIDTH,
+    profile: render.RenderProfile = None
+) -> np.ndarray:
+    """
+    Return absolute lightness differences of each pixel of each figure
+    between the NumPy and cairo backends, as an (N, H, W) array.
+
+    Differences are in [0, 1]. They stem mostly from antialiasing at figure
+    edges and from the polygonal approximation of ellipses.
+    """
+
+    rendered = [
+        to_lightness(
+            render_batch(
+                elements, cell_structure, None, line_width, profile, backend
+            ),
+            profile
+        )
+        for backend in ('numpy', 'cairo')
+    ]
+    return np.abs(rendered[0] - rendered[1])
+
+
+def matches_cairo(
+    elements: t.Sequence[elt.Element],
+    cell_structure: mat.CellStructure,
+    tolerance: float = .02,
+    pixel_tolerance: float = .75,
+    outliers: float = .03,
+    line_width: float = render.LINE_WIDTH,
+    profile: render.RenderProfile = None
+) -> np.ndarray:
+    """
+    Return a mask of figures for which the NumPy backend agrees with cairo
+    (see ``compare_with_cairo``).
+
+    :param tolerance: Maximum mean difference over the pixels of a figure.
+    :param pixel_tolerance: Maximum difference of any single pixel.
+    :param outliers: Maximum fraction of pixels differing by more than
+        ``OUTLIER_DIFFERENCE``.
+    """
+
+    differences = compare_with_cairo(
+        elements, cell_structure, line_width, profile
+    )
+    return (
+        (differences.mean(axis=(1, 2)) <= tolerance) &
+        (differences.max(axis=(1, 2), initial=0.) <= pixel_tolerance) &
+        (
+            (differences > OUTLIER_DIFFERENCE).mean(axis=(1, 2)) <=
+            outliers
+        )
+    )
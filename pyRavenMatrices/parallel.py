@@ -0,0 +1,523 @@
+'''This module provides tools for rendering elements across a process pool.
+
+Shipping Trees to Workers
+-------------------------
+
+Element trees hold drawing routines and decorators as plain functions.
+Pickling each tree as an object graph is slow, so trees are first encoded as
+nested tuples in which every function is replaced by its code in a
+``registry.Registry``, and node kinds are tagged as in ``columnar``. The
+registry is sent to each worker once, when the worker starts. Functions
+missing from the initial registry are assigned new codes on the fly and
+shipped along with each subsequent chunk.
+'''
+
+
+import collections
+import multiprocessing as mp
+import queue
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, Mapping, Tuple, Union
+)
+import numpy as np
+from pyRavenMatrices.matrix import CellStructure
+from pyRavenMatrices.element import (
+    Element, BasicElement, EmptyElement, ModifiedElement, CompositeElement,
+    ElementModifier
+)
+from pyRavenMatrices.render import (
+    check_output, draw_cell, render_batch, surface_array, LINE_WIDTH,
+    DEFAULT_PROFILE, RenderProfile
+)
+from pyRavenMatrices.registry import Registry
+from pyRavenMatrices.columnar import BASIC, MODIFIED, COMPOSITE, EMPTY
+
+
+def encode_element(element : Element, registry : Registry) -> tuple:
+    '''Encode ``element`` as nested tuples of codes and params.
+
+    Functions missing from ``registry`` are registered on the fly.
+    '''
+
+    if isinstance(element, BasicElement):
+        return (
+            BASIC,
+            registry.register(element.routine),
+            tuple(element.params.items())
+        )
+    elif isinstance(element, ModifiedElement):
+        return (
+            MODIFIED,
+            encode_element(element.element, registry),
+            tuple(
+                (registry.register(mod.decorator), tuple(mod.params.items()))
+                for mod in element.modifiers
+            )
+        )
+    elif isinstance(element, CompositeElement):
+        return (
+            COMPOSITE,
+            tuple(encode_element(sub, registry) for sub in element.elements)
+        )
+    elif isinstance(element, EmptyElement):
+        return (EMPTY,)
+    else:
+        raise TypeError('Unexpected type {}'.format(str(type(element))))
+
+
+def decode_element(
+    encoded : tuple, functions : Mapping[int, Callable]
+) -> Element:
+    '''Rebuild an element from its encoding by ``encode_element``.
+
+    :param encoded: Encoded element.
+    :param functions: Maps codes to the functions they were assigned to.
+    '''
+
+    kind = encoded[0]
+    if kind == BASIC:
+        element = BasicElement()
+        element.routine = functions[encoded[1]]
+        element.params = dict(encoded[2])
+        return element
+    elif kind == MODIFIED:
+        modifiers = []
+        for code, params in encoded[2]:
+            modifier = ElementModifier()
+            modifier.decorator = functions[code]
+            modifier.params = dict(params)
+            modifiers.append(modifier)
+        return ModifiedElement(
+            decode_element(encoded[1], functions), *modifiers
+        )
+    elif kind == COMPOSITE:
+        return CompositeElement(
+            *[decode_element(sub, functions) for sub in encoded[1]]
+        )
+    elif kind == EMPTY:
+        return EmptyElement()
+    else:
+        raise ValueError('Unexpected element kind {}'.format(kind))
+
+
+class ParallelRenderer(object):
+    '''Renders streams of elements across a pool of worker processes.
+
+    Each worker draws into its own reusable cairo surface and returns the 
+    pixels of every cell it renders as a ``(height, width)`` array of the 
+    renderer's profile dtype (see ``render.surface_array``). To avoid 
+    copying pixels between processes altogether, render into shared memory 
+    with ``render_shared`` or into a file with ``render_to_file``.
+
+    Usage::
+
+        with ParallelRenderer(cell_structure, processes=8) as renderer:
+            for index, data in renderer.render(elements):
+                ...
+    '''
+
+    def __init__(
+        self,
+        cell_structure : CellStructure,
+        processes : int = None,
+        chunksize : int = 64,
+        ordered : bool = True,
+        max_pending : int = None,
+        functions : Union[Mapping[Callable, int], Iterable[Callable]] = (),
+        line_width : float = LINE_WIDTH,
+        mp_context : Any = None,
+        profile : RenderProfile = None
+    ) -> None:
+        '''
+        Initialize a parallel renderer.
+
+        :param cell_structure: Structure of the cells being rendered.
+        :param processes: Number of worker processes, defaults to cpu count.
+        :param chunksize: Number of elements sent to a worker per task.
+        :param ordered: If ``True``, results are yielded in input order,
+            otherwise they are yielded as soon as they are ready.
+        :param max_pending: Maximum number of chunks in flight, defaults to
+            twice the number of processes. Bounds memory use on long streams.
+        :param functions: Routines and decorators to ship to workers on
+            startup, optionally mapped to their codes (see
+            ``registry.Registry``).
+        :param line_width: Width of figure outlines, in px.
+        :param mp_context: Multiprocessing context used to create the pool.
+        :param profile: Render profile used by workers, defaults to
+            ``render.DEFAULT_PROFILE``. Use an A8 profile to render a
+            quarter of the pixel data.
+        '''
+
+        if profile is None:
+            profile = DEFAULT_PROFILE
+        if mp_context is None:
+            mp_context = mp
+        if processes is None:
+            processes = mp_context.cpu_count()
+        if max_pending is None:
+            max_pending = 2 * processes
+
+        self.cell_structure = cell_structure
+        self.processes = processes
+        self.chunksize = chunksize
+        self.ordered = ordered
+        self.max_pending = max_pending
+        self.line_width = line_width
+        self.profile = profile
+        self.registry = Registry(functions)
+        self._initial = _functions(self.registry)
+        self._extra : Dict[int, Callable] = {}
+        self._pool = mp_context.Pool(
+            processes,
+            _init_worker,
+            (cell_structure, dict(self._initial), line_width, profile)
+        )
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def close(self) -> None:
+        '''Wait for pending work to finish and shut down the workers.'''
+
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self) -> None:
+        '''Shut down the workers immediately.'''
+
+        self._pool.terminate()
+        self._pool.join()
+
+    def render(
+        self, elements : Iterable[Element]
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        '''Render elements, yielding ``(index, pixels)`` pairs.
+
+        ``index`` is the position of the element in ``elements``. Elements
+        are consumed lazily; at most ``max_pending`` chunks are in flight.
+        '''
+
+        tasks = self._tasks(elements)
+        if self.ordered:
+            results = self._submit_ordered(_render_chunk, tasks)
+        else:
+            results = self._submit_unordered(_render_chunk, tasks)
+        for result in results:
+            yield from result
+
+    def render_shared(
+        self, elements : List[Element], batch : 'SharedBatch' = None
+    ) -> 'SharedBatch':
+        '''Render elements straight into a shared-memory tensor.
+
+        Workers create their cairo surfaces directly over their slices of the
+        tensor, so pixel data is never pickled or copied between processes.
+
+        :param elements: Elements to render; ``batch.array[i]`` receives the
+            ``i``-th element.
+        :param batch: Batch to render into, holding pixels of
+            ``self.profile.dtype``. A new one, sized to fit ``elements``, is
+            created if ``None``.
+        '''
+
+        height, width = self.cell_structure.height, self.cell_structure.width
+        shape = (len(elements), height, width)
+        dtype = self.profile.dtype
+        if batch is None:
+            batch = SharedBatch(shape, self.profile)
+        elif batch.array.shape != shape or batch.array.dtype != dtype:
+            raise ValueError(
+                'Expected {} batch of shape {}, got {} {}'.format(
+                    dtype, shape, batch.array.dtype, batch.array.shape
+                )
+            )
+
+        tasks = (
+            task + (batch.name, shape) for task in self._tasks(elements)
+        )
+        for _ in self._submit_ordered(_render_chunk_shared, tasks):
+            pass
+
+        return batch
+
+    def render_to_file(self, elements : List[Element], path : str) -> None:
+        '''Render elements straight into a ``.npy`` file.
+
+        Workers memory-map the file and draw into their slices of it, so 
+        pixel data is never pickled or copied between processes. Written 
+        pixels are flushed to disk before returning.
+
+        :param elements: Elements to render; the ``i``-th array in the file 
+            receives the ``i``-th element.
+        :param path: Path of an existing ``.npy`` file holding a 
+            C-contiguous ``(N, height, width)`` array of ``self.profile.dtype``
+            with room for all elements, as created by 
+            ``np.lib.format.open_memmap``.
+        '''
+
+        images = np.load(path, mmap_mode='r')
+        try:
+            check_output(images, self.cell_structure, self.profile)
+            if len(images) < len(elements):
+                raise ValueError('Output array too small for all elements')
+        finally:
+            del images
+
+        tasks = (task + (path,) for task in self._tasks(elements))
+        for _ in self._submit_ordered(_render_chunk_file, tasks):
+            pass
+
+    def _tasks(self, elements):
+
+        chunk : list = []
+        start = 0
+        for element in elements:
+            chunk.append(encode_element(element, self.registry))
+            if len(chunk) == self.chunksize:
+                yield self._task(start, chunk)
+                start += len(chunk)
+                chunk = []
+        if chunk:
+            yield self._task(start, chunk)
+
+    def _task(self, start, chunk):
+
+        # Ship functions added after startup with every chunk; workers do
+        # not share state, so any of them may need them. The registry only
+        # grows, so functions are only collected again when it has.
+        if len(self.registry) > len(self._initial) + len(self._extra):
+            self._extra = {
+                code: function
+                for code, function in _functions(self.registry).items()
+                if code not in self._initial
+            }
+        return start, chunk, self._extra
+
+    def _submit_ordered(self, function, tasks):
+
+        pending : collections.deque = collections.deque()
+        for task in tasks:
+            pending.append(self._pool.apply_async(function, (task,)))
+            if len(pending) >= self.max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def _submit_unordered(self, function, tasks):
+
+        done : queue.Queue = queue.Queue()
+        in_flight = 0
+        for task in tasks:
+            self._pool.apply_async(
+                function,
+                (task,),
+                callback=done.put,
+                error_callback=done.put
+            )
+            in_flight += 1
+            while in_flight >= self.max_pending:
+                in_flight -= 1
+                yield _unpack(done.get())
+        while in_flight:
+            in_flight -= 1
+            yield _unpack(done.get())
+
+
+class SharedBatch(object):
+    '''An ``(N, H, W)`` tensor of rendered cells in shared memory.
+
+    Pixels are stored in the layout cairo uses for surfaces of the batch's
+    profile: native-endian ``uint32`` ARGB32 values by default, or ``uint8``
+    coverage values for A8 profiles. The shared memory block is owned by the
+    batch and released by ``close()``; copy ``array`` first if it must
+    outlive the batch.
+    '''
+
+    def __init__(
+        self, shape : Tuple[int, int, int], profile : RenderProfile = None
+    ) -> None:
+
+        if profile is None:
+            profile = DEFAULT_PROFILE
+        dtype = profile.dtype
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(1, nbytes)
+        )
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+    @property
+    def name(self) -> str:
+        '''Name of the underlying shared memory block.'''
+
+        return self._shm.name
+
+    def close(self) -> None:
+        '''Release and unlink the underlying shared memory block.'''
+
+        del self.array
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _functions(registry):
+
+    return {registry.code(function): function for function in registry}
+
+
+def _unpack(result):
+
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+_worker : Dict[str, Any] = {}
+
+
+def _init_worker(cell_structure, functions, line_width, profile):
+
+    if sys.version_info < (3, 13):
+        _untrack_shared_memory()
+    surface = profile.create_surface(cell_structure)
+    _worker['cell_structure'] = cell_structure
+    _worker['functions'] = functions
+    _worker['extra'] = 0
+    _worker['line_width'] = line_width
+    _worker['profile'] = profile
+    _worker['surface'] = surface
+    _worker['ctx'] = profile.context(surface)
+
+
+def _add_functions(extra):
+
+    functions = _worker['functions']
+    # Extra functions only grow, so they are new to the worker iff there are
+    # more of them than last seen.
+    if len(extra) > _worker['extra']:
+        functions.update(extra)
+        _worker['extra'] = len(extra)
+
+    return functions
+
+
+def _attach(name):
+
+    shm = _worker.get('shm')
+    if shm is None or shm.name != name:
+        # Batches are used one at a time; drop the mapping of the previous
+        # one, which its owner may already have unlinked.
+        _detach()
+        shm = _worker['shm'] = _open_shared_memory(name)
+
+    return shm.buf
+
+
+def _detach():
+
+    shm = _worker.pop('shm', None)
+    if shm is not None:
+        shm.close()
+
+
+def _open_shared_memory(name):
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Registration is skipped by the worker (see _untrack_shared_memory).
+    return shared_memory.SharedMemory(name=name)
+
+
+def _untrack_shared_memory():
+    '''Keep this process from registering shared memory it attaches to.
+
+    Before Python 3.13, attaching to a block registers it with the resource 
+    tracker, which workers may share with the parent. The parent owns the 
+    block and its registration; registering it again from workers, or 
+    unregistering it afterwards, would drop the parent's registration. 
+    Workers only attach to blocks, so registration is skipped for their 
+    whole lifetime; this is done once, on startup, before any other thread 
+    could attach.
+    '''
+
+    register = resource_tracker.register
+
+    def wrapped(name, rtype):
+        if rtype != 'shared_memory':
+            register(name, rtype)
+
+    resource_tracker.register = wrapped
+
+
+def _render_chunk(task):
+
+    start, chunk, extra = task
+    functions = _add_functions(extra)
+
+    cell_structure = _worker['cell_structure']
+    surface, ctx = _worker['surface'], _worker['ctx']
+    pixels = surface_array(surface)
+    output = []
+    for i, encoded in enumerate(chunk):
+        element = decode_element(encoded, functions)
+        draw_cell(ctx, element, cell_structure, _worker['line_width'])
+        surface.flush()
+        # Copies pixels out of the reused surface, dropping row padding.
+        output.append((start + i, pixels.copy()))
+
+    return output
+
+
+def _render_chunk_shared(task):
+
+    start, chunk, extra, name, shape = task
+    functions = _add_functions(extra)
+    profile = _worker['profile']
+    images = np.ndarray(shape, dtype=profile.dtype, buffer=_attach(name))
+
+    render_batch(
+        (decode_element(encoded, functions) for encoded in chunk),
+        _worker['cell_structure'],
+        images[start:start + len(chunk)],
+        _worker['line_width'],
+        profile
+    )
+
+    return len(chunk)
+
+
+def _render_chunk_file(task):
+
+    start, chunk, extra, path = task
+    functions = _add_functions(extra)
+    images = np.load(path, mmap_mode='r+')
+
+    render_batch(
+        (decode_element(encoded, functions) for encoded in chunk),
+        _worker['cell_structure'],
+        images[start:start + len(chunk)],
+        _worker['line_width'],
+        _worker['profile']
+    )
+    images.flush()
+    del images
+
+    return len(chunk)
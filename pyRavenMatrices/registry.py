@@ -0,0 +1,105 @@
+'''This module provides a registry of drawing routines and decorators.
+
+Element trees refer to drawing routines and decorators as plain functions.
+Compact encodings of elements (e.g., columnar tables or binary files) instead
+refer to them by integer codes; a ``Registry`` maps between the two.
+'''
+
+
+from typing import Callable, Dict, Iterable, Iterator, Mapping, Union
+
+
+class Registry(object):
+    '''Maps drawing routines and decorators to integer codes.
+
+    Codes are assigned explicitly or in registration order, and never change
+    once assigned.
+    '''
+
+    def __init__(
+        self,
+        functions : Union[Mapping[Callable, int], Iterable[Callable]] = ()
+    ) -> None:
+        '''
+        Initialize a registry.
+
+        :param functions: Functions to register. If a mapping is given, its
+            values are used as codes.
+        '''
+
+        self._codes : Dict[Callable, int] = {}
+        self._functions : Dict[int, Callable] = {}
+        if isinstance(functions, Mapping):
+            for function, code in functions.items():
+                self.register(function, code)
+        else:
+            for function in functions:
+                self.register(function)
+
+    def __len__(self):
+
+        return len(self._codes)
+
+    def __contains__(self, function : Callable) -> bool:
+
+        return function in self._codes
+
+    def __iter__(self) -> Iterator[Callable]:
+
+        return iter(self._codes)
+
+    def __repr__(self):
+
+        return 'Registry({})'.format(
+            ', '.join(
+                '{}: {}'.format(function.__name__, code)
+                for function, code in self._codes.items()
+            )
+        )
+
+    def register(self, function : Callable, code : int = None) -> int:
+        '''Register ``function`` and return its code.
+
+        Registering an already registered function returns its existing code.
+
+        :param function: A drawing routine or decorator.
+        :param code: Code to assign. Defaults to one more than the largest
+            code in use.
+        '''
+
+        existing = self._codes.get(function)
+        if existing is not None:
+            if code is not None and code != existing:
+                raise ValueError(
+                    '{} is already registered with code {}'.format(
+                        function.__name__, existing
+                    )
+                )
+            return existing
+        if code is None:
+            code = max(self._functions, default=-1) + 1
+        elif code in self._functions:
+            raise ValueError('Code {} is already in use'.format(code))
+        if code < 0:
+            raise ValueError('Codes must be non-negative')
+        self._codes[function] = code
+        self._functions[code] = function
+        return code
+
+    def code(self, function : Callable) -> int:
+        '''Return code of a registered function.'''
+
+        try:
+            return self._codes[function]
+        except KeyError:
+            raise KeyError(
+                '{!r} is not registered'.format(function)
+            ) from None
+
+    def function(self, code : int) -> Callable:
+        '''Return function registered under ``code``.'''
+
+        try:
+            return self._functions[code]
+        except KeyError:
+            raise KeyError('No function registered with code {}'.format(code))
@@ -0,0 +1,664 @@
+'''This module provides tools for rendering elements to raster images.
+
+Elements only build paths and apply fills in the context they are drawn in.
+Rendering a cell additionally requires a surface, a blank background and a
+final stroke of the figure outline; this module takes care of those steps.
+
+Render Profiles
+---------------
+
+A ``RenderProfile`` selects the pixel format, antialiasing and curve 
+tolerance used for rendering. Besides full color ARGB32 output, figures may 
+be rendered to single-channel A8 surfaces, which take a quarter of the memory. 
+A8 pixels hold *ink coverage*: 0 for white, 255 for black and ``255 * (1 - 
+l)`` for a gray of lightness ``l``, so that images are inverted grayscale. 
+Drawing routines need no changes for this; colors they set are translated to 
+coverage on the fly.
+
+Contexts built by a profile are ``RenderContext`` instances, which carry the 
+profile they were built with as ``profile``. Drawing routines may consult it 
+to choose between equivalent ways of drawing, e.g. to stamp repeated copies 
+of a figure from a display list (see ``RenderProfile.instancing``). Contexts 
+without a profile, such as those wrapped for instrumentation, are drawn in 
+directly.
+
+Recorded Figures
+----------------
+
+A ``RecordedFigure`` draws a cell once, at a reference size, into a cairo 
+recording surface and replays it into cells of any size with a scale 
+transform. Recordings hold vector operations, so replayed cells are as sharp 
+as cells drawn directly. Unlike in direct drawing, however, margins and line 
+widths are fixed relative to the cell: they scale with the figure.
+'''
+
+
+import math
+from typing import (
+    Dict, Iterable, List, Optional, Sequence, Tuple, TYPE_CHECKING
+)
+import cairo
+import numpy as np
+from pyRavenMatrices.matrix import CellStructure, MatrixStructure
+from pyRavenMatrices.element import Element
+
+if TYPE_CHECKING: # cache imports this module
+    from pyRavenMatrices.cache import RasterCache
+
+
+FORMAT = cairo.FORMAT_ARGB32
+LINE_WIDTH = 2.
+REFERENCE_SIZE = 256
+
+_END = object()
+
+
+class RenderProfile(object):
+    '''Pixel format and quality settings for rendering.'''
+
+    def __init__(
+        self,
+        format : int = FORMAT,
+        antialias : int = cairo.ANTIALIAS_DEFAULT,
+        tolerance : float = .1,
+        instancing : bool = False
+    ) -> None:
+        '''
+        Initialize a render profile.
+
+        :param format: ``cairo.FORMAT_ARGB32`` or ``cairo.FORMAT_A8``.
+        :param antialias: A ``cairo.ANTIALIAS_*`` value.
+        :param tolerance: Maximum error, in px, when approximating curves 
+            with line segments. Larger values render faster.
+        :param instancing: Whether routines drawing several copies of a 
+            figure may trace it once and replay it for each copy. Output is 
+            the same either way. Off by default, since the figure is traced 
+            anew on every draw.
+        '''
+
+        if format not in (cairo.FORMAT_ARGB32, cairo.FORMAT_A8):
+            raise ValueError('Unsupported format {}'.format(format))
+
+        self.format = format
+        self.antialias = antialias
+        self.tolerance = tolerance
+        self.instancing = instancing
+
+    def __repr__(self):
+
+        return (
+            'RenderProfile(format={}, antialias={}, tolerance={}, '
+            'instancing={})'.format(
+                self.format, self.antialias, self.tolerance, self.instancing
+            )
+        )
+
+    @property
+    def dtype(self) -> np.dtype:
+        '''NumPy dtype of pixels rendered with ``self``.'''
+
+        if self.format == cairo.FORMAT_A8:
+            return np.dtype(np.uint8)
+        else:
+            return np.dtype(np.uint32)
+
+    def stride(self, width : int) -> int:
+        '''Return the row stride, in bytes, of surfaces of ``width`` px.'''
+
+        return cairo.ImageSurface.format_stride_for_width(self.format, width)
+
+    def create_surface(
+        self, cell_structure : CellStructure
+    ) -> cairo.ImageSurface:
+        '''Return a new image surface matching the dimensions of a cell.'''
+
+        return cairo.ImageSurface(
+            self.format, cell_structure.width, cell_structure.height
+        )
+
+    def context(self, surface : cairo.Surface) -> 'RenderContext':
+        '''Return a new context drawing to ``surface`` with ``self``.
+
+        For A8 profiles, the context translates colors to ink coverage.
+        '''
+
+        if self.format == cairo.FORMAT_A8:
+            ctx = _CoverageContext(surface)
+            ctx.set_operator(cairo.OPERATOR_SOURCE)
+        else:
+            ctx = RenderContext(surface)
+        ctx.profile = self
+        ctx.set_antialias(self.antialias)
+        ctx.set_tolerance(self.tolerance)
+        return ctx
+
+
+DEFAULT_PROFILE = RenderProfile()
+# Aliased single-channel output with coarse curves, for fast bulk jobs.
+PREVIEW_PROFILE = RenderProfile(cairo.FORMAT_A8, cairo.ANTIALIAS_NONE, 1.)
+# Antialiased single-channel output.
+GRAYSCALE_PROFILE = RenderProfile(cairo.FORMAT_A8)
+# Full color output with the best antialiasing and fine curves.
+EXPORT_PROFILE = RenderProfile(FORMAT, cairo.ANTIALIAS_BEST, .01)
+
+
+class RenderContext(cairo.Context):
+    '''A context built by a render profile, available as ``profile``.'''
+
+    profile : RenderProfile
+
+
+class _CoverageContext(RenderContext):
+    '''A context on an A8 surface, drawing colors as coverage.
+
+    Sources are set as black with alpha ``1 - luma``. Contexts are meant to 
+    draw with ``OPERATOR_SOURCE``, so that, as with opaque colors on ARGB32 
+    surfaces, whatever is drawn last replaces what lies beneath it. Only 
+    color setters are overridden; all other calls go straight to cairo.
+    '''
+
+    def set_source_rgb(self, red : float, green : float, blue : float):
+
+        super().set_source_rgba(0., 0., 0., 1. - _luma(red, green, blue))
+
+    def set_source_rgba(
+        self, red : float, green : float, blue : float, alpha : float = 1.
+    ):
+
+        super().set_source_rgba(
+            0., 0., 0., alpha * (1. - _luma(red, green, blue))
+        )
+
+
+def _luma(red, green, blue):
+
+    return .2126 * red + .7152 * green + .0722 * blue
+
+
+def draw_cell(
+    ctx : cairo.Context,
+    element : Element,
+    cell_structure : CellStructure,
+    line_width : float = LINE_WIDTH
+) -> None:
+    '''Paint a blank cell in ``ctx`` and draw ``element`` over it.
+
+    The context state is saved and restored, so the same context may be
+    reused to draw any number of cells.
+
+    :param ctx: The context in which the cell will be drawn.
+    :param element: The element to draw.
+    :param cell_structure: Structure of the cell being drawn.
+    :param line_width: Width of figure outlines, in px.
+    '''
+
+    ctx.save()
+    ctx.set_source_rgb(1., 1., 1.)
+    ctx.paint()
+    ctx.set_source_rgb(0., 0., 0.)
+    ctx.set_line_width(line_width)
+    element.draw_in_context(ctx, cell_structure)
+    ctx.stroke()
+    ctx.restore()
+
+
+def create_surface(
+    cell_structure : CellStructure, profile : RenderProfile = None
+) -> cairo.ImageSurface:
+    '''Return a new image surface matching the dimensions of a cell.'''
+
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    return profile.create_surface(cell_structure)
+
+
+def render_element(
+    element : Element,
+    cell_structure : CellStructure,
+    surface : cairo.ImageSurface = None,
+    line_width : float = LINE_WIDTH,
+    profile : RenderProfile = None
+) -> cairo.ImageSurface:
+    '''Render ``element`` to an image surface and return the surface.
+
+    :param element: The element to render.
+    :param cell_structure: Structure of the cell being rendered.
+    :param surface: Surface to render into. A new one is created if ``None``.
+    :param line_width: Width of figure outlines, in px.
+    :param profile: Render profile, defaults to ``DEFAULT_PROFILE``. Must 
+        match the format of ``surface``, if given.
+    '''
+
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    if surface is None:
+        surface = profile.create_surface(cell_structure)
+    draw_cell(profile.context(surface), element, cell_structure, line_width)
+    surface.flush()
+
+    return surface
+
+
+def surface_bytes(surface : cairo.ImageSurface) -> bytes:
+    '''Return a copy of the pixel data of ``surface``.
+
+    Rows are ``surface.get_stride()`` bytes long.
+    '''
+
+    surface.flush()
+
+    return bytes(surface.get_data())
+
+
+class MatrixRenderer(object):
+    '''Renders whole matrix problems into a single surface.
+
+    Context cells are laid out in a ``size`` by ``size`` grid, with answer 
+    alternatives in rows below it. Every cell is drawn directly into the 
+    shared surface, translated to its position and clipped to its bounds, so 
+    no per-cell surfaces are allocated and no stitching is needed.
+
+    The surface is reused across calls to ``render``; copy its data before 
+    rendering the next problem if it must be kept.
+    '''
+
+    def __init__(
+        self,
+        matrix_structure : MatrixStructure,
+        horizontal_margin : int = 0,
+        vertical_margin : int = 0,
+        alternatives_per_row : int = None,
+        line_width : float = LINE_WIDTH,
+        profile : RenderProfile = None,
+        cache : 'RasterCache' = None
+    ) -> None:
+        '''
+        Initialize a matrix renderer.
+
+        :param matrix_structure: Structure of the matrices to render.
+        :param horizontal_margin: Horizontal margin of each cell.
+        :param vertical_margin: Vertical margin of each cell.
+        :param alternatives_per_row: Number of answer alternatives per row, 
+            defaults to half the number of alternatives, rounded up.
+        :param line_width: Width of figure outlines, in px.
+        :param profile: Render profile, defaults to ``DEFAULT_PROFILE``.
+        :param cache: Optional ``cache.RasterCache``. Cells found in it are 
+            copied into the surface instead of drawn.
+        '''
+
+        if profile is None:
+            profile = DEFAULT_PROFILE
+        size = matrix_structure.size
+        num_alternatives = matrix_structure.num_alternatives
+        if alternatives_per_row is None:
+            alternatives_per_row = max(1, math.ceil(num_alternatives / 2))
+        alternative_rows = math.ceil(num_alternatives / alternatives_per_row)
+        cell_width = matrix_structure.cell_width
+        cell_height = matrix_structure.cell_height
+        columns = max(size, alternatives_per_row)
+
+        self.matrix_structure = matrix_structure
+        self.line_width = line_width
+        self.width = columns * cell_width
+        self.height = (size + alternative_rows) * cell_height
+        self.profile = profile
+        self.cache = cache
+        self.surface = cairo.ImageSurface(
+            profile.format, self.width, self.height
+        )
+        self._ctx = profile.context(self.surface)
+        self._image = surface_array(self.surface)
+
+        def cell(cell_id, x, y):
+            return (
+                CellStructure(
+                    cell_id, 
+                    cell_width, 
+                    cell_height, 
+                    horizontal_margin, 
+                    vertical_margin
+                ),
+                x,
+                y
+            )
+
+        # Context grid and alternative rows are each centered horizontally.
+        grid_x = (columns - size) * cell_width // 2
+        self.context_cells = [
+            [
+                cell(
+                    '{}/context/{}/{}'.format(matrix_structure.name, row, col),
+                    grid_x + col * cell_width,
+                    row * cell_height
+                )
+                for col in range(size)
+            ]
+            for row in range(size)
+        ]
+        self.alternative_cells = []
+        for k in range(num_alternatives):
+            row, col = divmod(k, alternatives_per_row)
+            in_row = min(
+                alternatives_per_row,
+                num_alternatives - row * alternatives_per_row
+            )
+            row_x = (columns - in_row) * cell_width // 2
+            self.alternative_cells.append(
+                cell(
+                    '{}/alternative/{}'.format(matrix_structure.name, k),
+                    row_x + col * cell_width,
+                    (size + row) * cell_height
+                )
+            )
+
+    @property
+    def cells(self) -> List[Tuple[CellStructure, int, int]]:
+        '''All cells as ``(cell_structure, x, y)`` triples.
+
+        Context cells come first, in row-major order, followed by answer 
+        alternatives.
+        '''
+
+        return [
+            cell for row in self.context_cells for cell in row
+        ] + self.alternative_cells
+
+    def render(
+        self,
+        cells : Sequence[Sequence[Optional[Element]]],
+        alternatives : Sequence[Element]
+    ) -> cairo.ImageSurface:
+        '''Render a matrix problem and return the shared surface.
+
+        :param cells: Context cells, as a ``size`` by ``size`` nested 
+            sequence. Cells given as ``None`` (typically the missing cell) 
+            are left blank.
+        :param alternatives: Answer alternatives.
+        '''
+
+        ctx = self._ctx
+        ctx.save()
+        ctx.set_source_rgb(1., 1., 1.)
+        ctx.paint()
+        ctx.restore()
+
+        for row_elements, row_cells in zip(cells, self.context_cells):
+            for element, cell in zip(row_elements, row_cells):
+                if element is not None:
+                    self._draw(element, cell)
+        for element, cell in zip(alternatives, self.alternative_cells):
+            self._draw(element, cell)
+        self.surface.flush()
+
+        return self.surface
+
+    def views(self) -> Dict[str, np.ndarray]:
+        '''Return per-cell views into the shared surface, keyed by cell id.
+
+        Views are ``(cell_height, cell_width)`` pixel arrays (see 
+        ``surface_array``) sharing memory with the surface; they reflect 
+        whatever was rendered last.
+        '''
+
+        image = surface_array(self.surface)
+        return {
+            cell_structure.id: image[
+                y:y + cell_structure.height, x:x + cell_structure.width
+            ]
+            for cell_structure, x, y in self.cells
+        }
+
+    def _draw(self, element, cell):
+
+        cell_structure, x, y = cell
+        if self.cache is not None:
+            width, height = cell_structure.width, cell_structure.height
+            self.surface.flush()
+            self._image[y:y + height, x:x + width] = self.cache.render(
+                element, cell_structure, self.profile, self.line_width
+            )
+            self.surface.mark_dirty_rectangle(x, y, width, height)
+            return
+        ctx = self._ctx
+        ctx.save()
+        ctx.translate(x, y)
+        ctx.rectangle(0, 0, cell_structure.width, cell_structure.height)
+        ctx.clip()
+        draw_cell(ctx, element, cell_structure, self.line_width)
+        ctx.restore()
+
+
+def surface_array(surface : cairo.ImageSurface) -> np.ndarray:
+    '''Return a ``(height, width)`` array view of an image surface.
+
+    Pixels of ARGB32 surfaces are native-endian ``uint32`` values, those of A8 
+    surfaces ``uint8`` values. The array shares memory with the surface, so 
+    no pixel data is copied.
+    '''
+
+    if surface.get_format() == cairo.FORMAT_A8:
+        dtype = np.dtype(np.uint8)
+    else:
+        dtype = np.dtype(np.uint32)
+    surface.flush()
+    stride = surface.get_stride()
+    rows = np.ndarray(
+        (surface.get_height(), stride // dtype.itemsize), 
+        dtype=dtype, 
+        buffer=surface.get_data()
+    )
+    return rows[:, :surface.get_width()]
+
+
+def render_array(
+    element : Element,
+    cell_structure : CellStructure,
+    line_width : float = LINE_WIDTH,
+    profile : RenderProfile = None
+) -> np.ndarray:
+    '''Render ``element`` and return its pixels as a ``(height, width)`` array.
+
+    The array is a view of the buffer of a new image surface, which it keeps 
+    alive; no pixel data is copied (see ``surface_array``). Rows may be 
+    padded to the surface stride, in which case the array is not 
+    C-contiguous.
+
+    :param element: The element to render.
+    :param cell_structure: Structure of the cell being rendered.
+    :param line_width: Width of figure outlines, in px.
+    :param profile: Render profile, defaults to ``DEFAULT_PROFILE``.
+    '''
+
+    surface = render_element(
+        element, cell_structure, line_width=line_width, profile=profile
+    )
+
+    return surface_array(surface)
+
+
+def check_output(
+    out : np.ndarray, cell_structure : CellStructure, profile : RenderProfile
+) -> None:
+    '''Raise ``ValueError`` if ``out`` cannot hold cells rendered with 
+    ``profile``.
+
+    Output arrays must be C-contiguous, of ``profile.dtype`` and of shape 
+    ``(N, height, width)``.
+    '''
+
+    width, height = cell_structure.width, cell_structure.height
+    dtype = profile.dtype
+    if out.dtype != dtype or out.shape[1:] != (height, width):
+        raise ValueError(
+            'Expected {} array of shape (N, {}, {}), got {} {}'.format(
+                dtype, height, width, out.dtype, out.shape
+            )
+        )
+    if not out.flags.c_contiguous:
+        raise ValueError('Output array must be C-contiguous')
+
+
+def render_batch(
+    elements : Iterable[Element],
+    cell_structure : CellStructure,
+    out : np.ndarray = None,
+    line_width : float = LINE_WIDTH,
+    profile : RenderProfile = None,
+    cache : 'RasterCache' = None
+) -> np.ndarray:
+    '''Render ``elements`` into a ``(N, height, width)`` array and return it.
+
+    Each element is drawn directly into its slice of ``out`` through a 
+    surface created over that memory, so ``out`` may be reused across 
+    batches without further allocation. If rows of the surface format must 
+    be padded (A8 cells whose width is not a multiple of 4), elements are 
+    instead drawn in a scratch surface and copied.
+
+    :param elements: Elements to render.
+    :param cell_structure: Structure of the cells being rendered.
+    :param out: A C-contiguous array of ``profile.dtype`` with room for all 
+        elements. A new one is allocated if ``None``. Slots beyond the last 
+        element are left untouched.
+    :param line_width: Width of figure outlines, in px.
+    :param profile: Render profile, defaults to ``DEFAULT_PROFILE``.
+    :param cache: Optional ``cache.RasterCache``. Elements found in it are 
+        copied into ``out`` instead of drawn; others are added to it.
+    '''
+
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    width, height = cell_structure.width, cell_structure.height
+    dtype = profile.dtype
+    if out is None:
+        elements = list(elements)
+        out = np.empty((len(elements), height, width), dtype=dtype)
+    check_output(out, cell_structure, profile)
+
+    remaining = iter(elements)
+    stride = profile.stride(width)
+    if cache is not None:
+        for image, element in zip(out, remaining):
+            image[...] = cache.render(
+                element, cell_structure, profile, line_width
+            )
+    elif stride == width * dtype.itemsize:
+        for image, element in zip(out, remaining):
+            surface = cairo.ImageSurface.create_for_data(
+                memoryview(image), profile.format, width, height, stride
+            )
+            draw_cell(
+                profile.context(surface), element, cell_structure, line_width
+            )
+            surface.finish()
+    else:
+        surface = profile.create_surface(cell_structure)
+        ctx = profile.context(surface)
+        pixels = surface_array(surface)
+        for image, element in zip(out, remaining):
+            draw_cell(ctx, element, cell_structure, line_width)
+            surface.flush()
+            image[...] = pixels
+    if next(remaining, _END) is not _END:
+        raise ValueError('Output array too small for all elements')
+
+    return out
+
+
+class RecordedFigure(object):
+    '''A cell drawn once and replayable at any size.
+
+    Usage::
+
+        figure = RecordedFigure(element, horizontal_margin=.1)
+        thumbnail = figure.render_array(64, 64)
+        full = figure.render_array(512, 512)
+    '''
+
+    def __init__(
+        self,
+        element : Element,
+        horizontal_margin : float = 0.,
+        vertical_margin : float = 0.,
+        line_width : float = LINE_WIDTH,
+        width : int = REFERENCE_SIZE,
+        height : int = REFERENCE_SIZE,
+        profile : RenderProfile = None
+    ) -> None:
+        '''
+        Record a cell holding ``element``.
+
+        :param element: The element to record.
+        :param horizontal_margin: Horizontal margin, as a fraction of cell 
+            width.
+        :param vertical_margin: Vertical margin, as a fraction of cell height.
+        :param line_width: Width of figure outlines, in px at the reference 
+            size.
+        :param width: Reference cell width, in px.
+        :param height: Reference cell height, in px.
+        :param profile: Render profile, defaults to ``DEFAULT_PROFILE``. 
+            Replays must target surfaces of the same format.
+        '''
+
+        if profile is None:
+            profile = DEFAULT_PROFILE
+        if profile.format == cairo.FORMAT_A8:
+            content = cairo.CONTENT_ALPHA
+        else:
+            content = cairo.CONTENT_COLOR_ALPHA
+
+        self.width = width
+        self.height = height
+        self.profile = profile
+        self.surface = cairo.RecordingSurface(
+            content, cairo.Rectangle(0, 0, width, height)
+        )
+        cell_structure = CellStructure(
+            None,
+            width,
+            height,
+            horizontal_margin * width,
+            vertical_margin * height
+        )
+        draw_cell(
+            profile.context(self.surface), element, cell_structure, line_width
+        )
+
+    def replay(self, ctx : cairo.Context, width : int, height : int) -> None:
+        '''Draw the recorded cell in ``ctx``, scaled to ``width, height``.
+
+        The cell replaces whatever lies beneath it in ``ctx``.
+        '''
+
+        ctx.save()
+        ctx.scale(width / self.width, height / self.height)
+        ctx.set_source_surface(self.surface, 0, 0)
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        ctx.rectangle(0, 0, self.width, self.height)
+        ctx.fill()
+        ctx.restore()
+
+    def render(
+        self, width : int, height : int, surface : cairo.ImageSurface = None
+    ) -> cairo.ImageSurface:
+        '''Replay the recorded cell into an image surface and return it.
+
+        :param width: Cell width, in px.
+        :param height: Cell height, in px.
+        :param surface: Surface to render into. A new one is created if 
+            ``None``. It is drawn in with a context set up by ``self.profile``.
+        '''
+
+        if surface is None:
+            surface = cairo.ImageSurface(self.profile.format, width, height)
+        self.replay(self.profile.context(surface), width, height)
+        surface.flush()
+
+        return surface
+
+    def render_array(self, width : int, height : int) -> np.ndarray:
+        '''Replay the recorded cell and return its pixels as an array.
+
+        See ``surface_array`` for the array layout.
+        '''
+
+        return surface_array(self.render(width, height))
@@ -0,0 +1,195 @@
+'''This module provides a compact binary format for elements.
+
+Routines and decorators are written as codes from a ``Registry`` rather than
+as function references, so serialized elements do not depend on pickling and
+stay valid as long as the registry codes are stable.
+
+Format
+------
+
+Nodes are written in pre-order. All values are little-endian.
+
+- Each node starts with one byte holding its kind (see ``columnar``).
+- Basic elements and element modifiers continue with a ``uint16`` registry
+  code and a ``uint8`` param count. Each param is written as a ``uint8`` name
+  length, the UTF-8 encoded name, a ``uint8`` type tag and an eight byte
+  value (``float64`` for floats, ``int64`` for ints and bools).
+- Modified and composite elements continue with a ``uint8`` child count,
+  followed by their children. Children of a modified element are its base
+  element followed by its modifiers.
+- Empty elements have no further data.
+
+Counts and name lengths must thus fit in a ``uint8``; ``dumps`` raises 
+``ValueError`` for elements exceeding these limits.
+'''
+
+
+import struct
+from typing import Any, Dict, Tuple, Union
+from pyRavenMatrices.element import (
+    Element, BasicElement, ElementModifier, ModifiedElement, CompositeElement,
+    EmptyElement
+)
+from pyRavenMatrices.registry import Registry
+from pyRavenMatrices.columnar import (
+    BASIC, MODIFIED, COMPOSITE, EMPTY, MODIFIER, FLOAT, BOOL, param_type
+)
+
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+_LEAF = struct.Struct('<BHB')
+_BRANCH = struct.Struct('<BB')
+_TAG = struct.Struct('<B')
+_FLOAT = struct.Struct('<Bd')
+_INT = struct.Struct('<Bq')
+_MAX_CODE = 2 ** 16 - 1
+_MAX_COUNT = 2 ** 8 - 1
+
+
+def dumps(element : Element, registry : Registry) -> bytes:
+    '''Return binary encoding of ``element``.
+
+    :param element: The element to serialize.
+    :param registry: Registry holding codes for all routines and decorators
+        used in ``element``.
+    '''
+
+    buffer = bytearray()
+    _dump(element, registry, buffer)
+    return bytes(buffer)
+
+
+def loads(data : Buffer, registry : Registry) -> Element:
+    '''Return element encoded in ``data``.
+
+    :param data: Binary encoding produced by ``dumps``.
+    :param registry: Registry used to encode the element.
+    '''
+
+    element, offset = _load(data, 0, registry)
+    if offset != len(data):
+        raise ValueError('Unexpected trailing data')
+    return element
+
+
+def _dump(node, registry, buffer):
+
+    if isinstance(node, BasicElement):
+        _dump_leaf(
+            BASIC, node.routine, registry.code(node.routine), node.params, 
+            buffer
+        )
+    elif isinstance(node, ElementModifier):
+        _dump_leaf(
+            MODIFIER, node.decorator, registry.code(node.decorator), 
+            node.params, buffer
+        )
+    elif isinstance(node, ModifiedElement):
+        buffer += _BRANCH.pack(
+            MODIFIED, _check_children(node, 1 + len(node.modifiers))
+        )
+        _dump(node.element, registry, buffer)
+        for modifier in node.modifiers:
+            _dump(modifier, registry, buffer)
+    elif isinstance(node, CompositeElement):
+        buffer += _BRANCH.pack(
+            COMPOSITE, _check_children(node, len(node.elements))
+        )
+        for sub in node.elements:
+            _dump(sub, registry, buffer)
+    elif isinstance(node, EmptyElement):
+        buffer += _TAG.pack(EMPTY)
+    else:
+        raise TypeError('Unexpected type {}'.format(str(type(node))))
+
+
+def _dump_leaf(kind, function, code, params, buffer):
+
+    if code > _MAX_CODE:
+        raise ValueError(
+            'Cannot serialize {}: registry code {} exceeds {}'.format(
+                function.__name__, code, _MAX_CODE
+            )
+        )
+    if len(params) > _MAX_COUNT:
+        raise ValueError(
+            'Cannot serialize {}: {} params, at most {} allowed'.format(
+                function.__name__, len(params), _MAX_COUNT
+            )
+        )
+    buffer += _LEAF.pack(kind, code, len(params))
+    for name, value in params.items():
+        encoded = name.encode()
+        if len(encoded) > _MAX_COUNT:
+            raise ValueError(
+                'Cannot serialize {}: param name {!r} is {} bytes long, at '
+                'most {} allowed'.format(
+                    function.__name__, name, len(encoded), _MAX_COUNT
+                )
+            )
+        buffer += _TAG.pack(len(encoded))
+        buffer += encoded
+        tag = param_type(value)
+        if tag == FLOAT:
+            buffer += _FLOAT.pack(tag, float(value))
+        else:
+            buffer += _INT.pack(tag, int(value))
+
+
+def _check_children(node, count):
+
+    if count > _MAX_COUNT:
+        raise ValueError(
+            'Cannot serialize {}: {} children, at most {} allowed'.format(
+                type(node).__name__, count, _MAX_COUNT
+            )
+        )
+    return count
+
+
+def _load(data, offset, registry) -> Tuple[Element, int]:
+
+    kind = data[offset]
+    if kind == BASIC or kind == MODIFIER:
+        _, code, num_params = _LEAF.unpack_from(data, offset)
+        offset += _LEAF.size
+        params : Dict[str, Any] = {}
+        for _ in range(num_params):
+            length = data[offset]
+            offset += 1
+            name = bytes(data[offset:offset + length]).decode()
+            offset += length
+            tag = data[offset]
+            if tag == FLOAT:
+                _, value = _FLOAT.unpack_from(data, offset)
+            else:
+                _, value = _INT.unpack_from(data, offset)
+                if tag == BOOL:
+                    value = bool(value)
+            offset += _FLOAT.size
+            params[name] = value
+        node : Any
+        if kind == BASIC:
+            node = BasicElement()
+            node.routine = registry.function(code)
+        else:
+            node = ElementModifier()
+            node.decorator = registry.function(code)
+        node.params = params
+        return node, offset
+    elif kind == MODIFIED or kind == COMPOSITE:
+        _, num_children = _BRANCH.unpack_from(data, offset)
+        offset += _BRANCH.size
+        children = []
+        for _ in range(num_children):
+            child, offset = _load(data, offset, registry)
+            children.append(child)
+        if kind == MODIFIED:
+            return ModifiedElement(*children), offset
+        else:
+            return CompositeElement(*children), offset
+    elif kind == EMPTY:
+        return EmptyElement(), offset + 1
+    else:
+        raise ValueError('Unexpected node kind {}'.format(kind))
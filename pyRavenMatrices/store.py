@@ -0,0 +1,225 @@
+'''This module provides a file-backed store for large collections of elements.
+
+A figure store consists of two files:
+
+- a data file, ``path``, holding a short header followed by serialized
+  figures (see ``serialization``), one after another; and
+- an index file, ``path + '.idx'``, holding the byte offsets of the figures in
+  the data file as little-endian ``uint64`` values, plus the offset of the end
+  of the last figure.
+
+Both files are memory-mapped when a store is opened, so opening a store takes
+constant time and reading a figure only touches the pages it occupies.
+'''
+
+
+import mmap
+import os
+import struct
+from typing import BinaryIO, Iterable, Iterator
+import numpy as np
+from pyRavenMatrices.element import Element
+from pyRavenMatrices.registry import Registry
+from pyRavenMatrices.serialization import dumps, loads
+
+
+MAGIC = b'PRMFIG\x00\x01'
+INDEX_SUFFIX = '.idx'
+
+_OFFSET = struct.Struct('<Q')
+
+
+class FigureStore(object):
+    '''Read-only, memory-mapped access to a figure store.
+
+    Usage::
+
+        with FigureStore(path, registry) as store:
+            figure = store[7340112]
+    '''
+
+    def __init__(self, path : str, registry : Registry) -> None:
+        '''
+        Open a figure store.
+
+        :param path: Path of the data file.
+        :param registry: Registry used to write the store.
+        '''
+
+        self.path = path
+        self.registry = registry
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(MAGIC)] != MAGIC:
+            self._data.close()
+            raise ValueError('{} is not a figure store'.format(path))
+        self._view = memoryview(self._data)
+        index_path = path + INDEX_SUFFIX
+        index = np.memmap(
+            index_path, 
+            dtype='<u8', 
+            mode='r', 
+            shape=(os.path.getsize(index_path) // _OFFSET.size,)
+        )
+        # Ignore offsets of figures whose data was not fully written.
+        self._index = index[:np.searchsorted(index, len(self._data), 'right')]
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+    def __len__(self):
+
+        return max(len(self._index) - 1, 0)
+
+    def __getitem__(self, index : int) -> Element:
+
+        return loads(self.raw(index), self.registry)
+
+    def __iter__(self) -> Iterator[Element]:
+
+        for index in range(len(self)):
+            yield self[index]
+
+    def raw(self, index : int) -> memoryview:
+        '''Return serialized data of figure ``index`` without copying.
+
+        The returned view points into the mapped data file and keeps it 
+        mapped: it must be released (``view.release()``) or dropped before 
+        the store is closed. Copy it with ``bytes(view)`` if it must outlive 
+        the store.
+        '''
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Figure index out of range')
+        start, stop = self._index[index], self._index[index + 1]
+        return self._view[start:stop]
+
+    def close(self) -> None:
+        '''Unmap the store files.
+
+        Raises ``BufferError``, leaving the store open, if views returned by 
+        ``raw`` are still alive.
+        '''
+
+        self._view.release()
+        try:
+            self._data.close()
+        except BufferError:
+            self._view = memoryview(self._data)
+            raise BufferError(
+                'Cannot close figure store {} while views returned by raw() '
+                'are alive; release them first'.format(self.path)
+            ) from None
+        del self._index
+
+
+class FigureStoreWriter(object):
+    '''Appends figures to a figure store.
+
+    Usage::
+
+        with FigureStoreWriter(path, registry) as writer:
+            writer.extend(figures)
+    '''
+
+    def __init__(
+        self, path : str, registry : Registry, append : bool = False
+    ) -> None:
+        '''
+        Open a figure store for writing.
+
+        :param path: Path of the data file.
+        :param registry: Registry holding codes for all routines and
+            decorators to be written.
+        :param append: If ``True`` and the store exists, new figures are
+            added after existing ones. Otherwise the store is overwritten.
+        '''
+
+        self.path = path
+        self.registry = registry
+        if append and os.path.exists(path):
+            self._data : BinaryIO = open(path, 'r+b')
+            self._index : BinaryIO = open(path + INDEX_SUFFIX, 'r+b')
+            self._recover()
+        else:
+            self._data = open(path, 'wb')
+            self._index = open(path + INDEX_SUFFIX, 'wb')
+            self._data.write(MAGIC)
+            self._index.write(_OFFSET.pack(len(MAGIC)))
+            self._count = 0
+            self._offset = len(MAGIC)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+    def __len__(self):
+
+        return self._count
+
+    def append(self, element : Element) -> int:
+        '''Write ``element`` to the store and return its index.'''
+
+        data = dumps(element, self.registry)
+        self._data.write(data)
+        self._offset += len(data)
+        self._index.write(_OFFSET.pack(self._offset))
+        self._count += 1
+        return self._count - 1
+
+    def extend(self, elements : Iterable[Element]) -> None:
+        '''Write all ``elements`` to the store.'''
+
+        for element in elements:
+            self.append(element)
+
+    def flush(self) -> None:
+        '''Flush written figures to disk.
+
+        The data file is flushed before the index, so the index never points
+        past the end of the data.
+        '''
+
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        self._index.flush()
+        os.fsync(self._index.fileno())
+
+    def close(self) -> None:
+        '''Flush and close the store files.'''
+
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+    def _recover(self):
+        '''Truncate both files to the last completely written figure.'''
+
+        if self._data.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a figure store'.format(self.path))
+        size = os.fstat(self._data.fileno()).st_size
+        data = self._index.read()
+        offsets = np.frombuffer(
+            data[:len(data) - len(data) % _OFFSET.size], dtype='<u8'
+        )
+        offsets = offsets[:np.searchsorted(offsets, size, 'right')]
+        if len(offsets) == 0:
+            offsets = np.array([len(MAGIC)], dtype='<u8')
+        self._count = len(offsets) - 1
+        self._offset = int(offsets[-1])
+        self._data.truncate(self._offset)
+        self._data.seek(self._offset)
+        self._index.truncate(len(offsets) * _OFFSET.size)
+        self._index.seek(0)
+        self._index.write(offsets.tobytes())
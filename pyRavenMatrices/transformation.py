@@ -18,14 +18,38 @@ the way an element is drawn**. Thus, transformations are a higher level concept
 in this scheme than modifiers: transformations may add modifiers to or remove 
 modifiers from figures in addition to having other effects such as addition of 
 elements to or removal of elements from figures.
+
+Structural Sharing
+------------------
+
+Applying a transformation does not copy its input. The output shares every 
+subtree left untouched by the transformation with the input; only the nodes 
+on the paths from the root to rewritten leaves are copied. Elements should 
+therefore be treated as immutable once they have been transformed.
 '''
 
 
-import copy
-from typing import Callable, Any, List, cast
+import functools
+import operator
+from typing import (
+    Callable, Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple, cast
+)
+import pyRavenMatrices.element as elt
+
+
+Step = Tuple[str, Optional[int]]
+
+TARGET_CACHE_SIZE = 1024
 
 
 class Target(object):
+    '''Locates a node within elements of a given shape.
+
+    Targets are immutable: ``get_targets`` hands out shared, cached targets, 
+    and each target memoizes the getters it compiles on first use.
+    '''
+
+    __slots__ = ('_attribute', '_index', '_parent', '_type', '_getters')
     
     def __init__(
         self, 
@@ -35,10 +59,34 @@ class Target(object):
         type: type = None
     ) -> None:
         
-        self.attribute = attribute
-        self.index = index
-        self.parent = parent
-        self.type = type
+        self._attribute = attribute
+        self._index = index
+        self._parent = parent
+        self._type = type
+
+    @property
+    def attribute(self) -> Optional[str]:
+        '''Attribute of the parent node holding the target.'''
+
+        return self._attribute
+
+    @property
+    def index(self) -> Optional[int]:
+        '''Index of the target in ``attribute``, if it is a sequence.'''
+
+        return self._index
+
+    @property
+    def parent(self) -> Optional['Target']:
+        '''Target of the parent node, ``None`` for children of the root.'''
+
+        return self._parent
+
+    @property
+    def type(self) -> Optional[type]:
+        '''Type of the targeted node.'''
+
+        return self._type
         
     def __repr__(self):
         
@@ -51,23 +99,69 @@ class Target(object):
     
     def __eq__(self, other):
         
-        return (
-            self.attribute == other.attribute,
-            self.index == other.index,
-            self.parent == other.parent,
-            self.type == other.type
-        )
+        if not isinstance(other, Target):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __hash__(self):
+
+        return hash(self.key())
 
     def __call__(self, element):
         
-        target = element
+        try:
+            getters = self._getters
+        except AttributeError:
+            getters = self._getters = self._compile()
+        for getter in getters:
+            element = getter(element)
+        return element
+
+    def key(self) -> Hashable:
+        '''Return a hashable key identifying path and type of ``self``.'''
+
+        return (self.path(), self.type)
+
+    def replace(
+        self, element : elt.Element, node : elt.ElementNode, 
+        copied : Set[int] = None
+    ) -> elt.Element:
+        '''Return a copy of ``element`` with the target replaced by ``node``.
+
+        Only nodes on the path to the target are copied (see module 
+        documentation).
+
+        :param element: Element in which to replace the target.
+        :param node: Replacement node.
+        :param copied: Ids of nodes in ``element`` that are private copies 
+            and may be updated in place. Ids of new copies are added to it.
+        '''
+
+        if copied is None:
+            copied = set()
+        return _replace(element, self.path(), node, copied)
+
+    def _compile(self):
+        '''Return a tuple of getters resolving the target from the root.'''
+
+        getters : List[Callable[[Any], Any]] = []
+        for attribute, index in self.path():
+            getters.append(operator.attrgetter(attribute))
+            if index is not None:
+                getters.append(operator.itemgetter(index))
+        return tuple(getters)
+
+    def path(self) -> Tuple[Step, ...]:
+        '''Return the ``(attribute, index)`` steps leading from root to target.
+        '''
+
         if self.parent is not None:
-            target = parent(element)
+            steps = self.parent.path()
+        else:
+            steps = ()
         if self.attribute is not None:
-            target = getattr(target, self.attribute)
-        if self.index is not None:
-            target = target[self.index]
-        return target
+            steps += ((self.attribute, self.index),)
+        return steps
     
     def _repr(self):
         
@@ -97,46 +191,257 @@ class Transformation(object):
         
     def __call__(self, element):
         
-        output = copy.deepcopy(element)
+        output = element
+        copied : Set[int] = set()
         for target, pattern, value in self.triples:
             if target(element) == pattern:
-                if issubclass(target.type, elt.BasicElement):
-                    target(output).routine = value['routine']
-                else:
-                    target(output).decorator = value['decorator']
-                target(output).params = value['params']
+                output = target.replace(
+                    output, _make_leaf(target, value), copied
+                )
         return output
 
+    def apply_many(
+        self, elements : Iterable[elt.Element]
+    ) -> List[elt.Element]:
+        '''Apply ``self`` to each of ``elements`` and return the results.
+
+        Results are equal to ``[self(e) for e in elements]``, but work is 
+        shared across inputs: targets are checked once per tree shape, 
+        patterns are matched by key lookup instead of pairwise comparison and 
+        each distinct input is transformed only once. Equal inputs yield the 
+        same output object, and outputs may share new leaves.
+
+        :param elements: Elements to transform.
+        '''
+
+        # Triples indexed by target path, then by pattern key. Later triples 
+        # override earlier ones, as they would in ``__call__``.
+        index : Dict[Tuple[Step, ...], Tuple[Target, Dict[Hashable, list]]]
+        index = {}
+        for target, pattern, value in self.triples:
+            _, patterns = index.setdefault(target.path(), (target, {}))
+            if isinstance(pattern, elt.ElementNode):
+                patterns[pattern.key()] = [target, value, None]
+
+        plans : Dict[Hashable, list] = {}
+        results : Dict[Hashable, elt.Element] = {}
+        outputs = []
+        for element in elements:
+            key = element.key()
+            output = results.get(key)
+            if output is None:
+                shape = get_shape(element)
+                plan = plans.get(shape)
+                if plan is None:
+                    plan = plans[shape] = _plan(index, shape, element)
+                output = results[key] = _apply_plan(plan, element)
+            outputs.append(output)
+        return outputs
+
+
+def _plan(index, shape, element):
+    '''Return ``(path, target, patterns)`` to check for elements of ``shape``.
+
+    Paths absent from ``shape`` are resolved in ``element`` so as to raise the 
+    same error as ``Transformation.__call__`` would.
+    '''
+
+    paths = _shape_paths(shape)
+    plan = []
+    for path, (target, patterns) in index.items():
+        if path not in paths:
+            target(element)
+        if patterns:
+            plan.append((path, target, patterns))
+    return plan
+
+
+def _apply_plan(plan, element):
+
+    output = element
+    copied : Set[int] = set()
+    for path, target, patterns in plan:
+        match = patterns.get(target(element).key())
+        if match is not None:
+            if match[2] is None:
+                match[2] = _make_leaf(match[0], match[1])
+            output = _replace(output, path, match[2], copied)
+    return output
+
+
+def _make_leaf(target, value):
+    '''Return a new leaf node of type ``target.type`` as given by ``value``.'''
+
+    if issubclass(target.type, elt.BasicElement):
+        leaf = elt.BasicElement()
+        leaf.routine = value['routine']
+    else:
+        leaf = elt.ElementModifier()
+        leaf.decorator = value['decorator']
+    leaf.params = dict(value['params'])
+    return leaf
+
+
+def _replace(node, steps, new, copied):
+    '''Return ``node`` with the subtree at ``steps`` replaced by ``new``.
+
+    Nodes along the path are copied, unless their ids are in ``copied`` (i.e., 
+    they are copies made by an earlier call), in which case they are updated 
+    in place. All other subtrees are shared with ``node``.
+    '''
+
+    if not steps:
+        return new
+    (attribute, index), rest = steps[0], steps[1:]
+    if id(node) not in copied:
+        node = _copy_branch(node)
+        copied.add(id(node))
+    if index is None:
+        setattr(
+            node, attribute, 
+            _replace(getattr(node, attribute), rest, new, copied)
+        )
+    else:
+        children = getattr(node, attribute)
+        children[index] = _replace(children[index], rest, new, copied)
+    return node
+
+
+def _copy_branch(node):
+    '''Return a shallow copy of a modified or composite element.'''
+
+    if isinstance(node, elt.ModifiedElement):
+        return elt.ModifiedElement(node.element, *node.modifiers)
+    elif isinstance(node, elt.CompositeElement):
+        return elt.CompositeElement(*node.elements)
+    else:
+        raise TypeError('Unexpected type {}'.format(str(type(node))))
+
 
 def get_targets(element_structure, parent=None):
-    
-    if isinstance(element_structure, (elt.BasicElement, elt.ElementModifier)):
-        if parent:
+    '''Return targets for all leaves of ``element_structure``.
+
+    Targets only depend on the shape of an element (see ``get_shape``), so 
+    targets of root elements are computed once per shape and cached.
+
+    :param element_structure: Element for which to find targets.
+    :param parent: Target of ``element_structure`` within a larger element.
+    '''
+
+    if parent is None:
+        return list(_shape_targets(get_shape(element_structure)))
+    return _get_targets(get_shape(element_structure), parent)
+
+
+def get_shape(element : elt.ElementNode) -> Hashable:
+    '''Return the structural shape of ``element``.
+
+    The shape records node types and arities, but not routines, decorators or 
+    params. Leaves and empty elements are represented by their types; 
+    modified and composite elements by tuples holding their type and the 
+    shapes of their children.
+    '''
+
+    if isinstance(element, elt.ModifiedElement):
+        return (
+            type(element),
+            get_shape(element.element), 
+            tuple(type(modifier) for modifier in element.modifiers)
+        )
+    elif isinstance(element, elt.CompositeElement):
+        return (
+            type(element), 
+            tuple(get_shape(sub) for sub in element.elements)
+        )
+    elif isinstance(
+        element, (elt.BasicElement, elt.ElementModifier, elt.EmptyElement)
+    ):
+        return type(element)
+    else:
+        raise TypeError('Unexpected type {}'.format(str(type(element))))
+
+
+def target_cache_info() -> Any:
+    '''Return hit and miss statistics of the target cache.'''
+
+    return _shape_targets.cache_info()
+
+
+def clear_target_cache() -> None:
+    '''Discard all cached targets.'''
+
+    _shape_targets.cache_clear()
+
+
+@functools.lru_cache(maxsize=TARGET_CACHE_SIZE)
+def _shape_targets(shape):
+
+    return tuple(_get_targets(shape, None))
+
+
+def _get_targets(shape, parent):
+
+    if not isinstance(shape, tuple):
+        if issubclass(shape, elt.EmptyElement):
+            return []
+        elif parent:
             return [parent]
         else:
-            return [Target(type=type(element_structure))]
-    elif isinstance(element_structure, elt.ModifiedElement):
-        sub_element = element_structure.element
-        ret = get_targets(
-            sub_element, 
+            return [Target(type=shape)]
+    elif issubclass(shape[0], elt.ModifiedElement):
+        _, sub_shape, modifier_types = shape
+        ret = _get_targets(
+            sub_shape, 
             parent = Target(
                 'element', 
                 parent = parent, 
-                type = type(sub_element)
+                type = _shape_type(sub_shape)
             )
         )
-        for i, modifier in enumerate(element_structure.modifiers):
-            ret += get_targets(
-                modifier, 
-                Target('modifiers', index=i, parent=parent, type=type(modifier))
+        for i, modifier_type in enumerate(modifier_types):
+            ret += _get_targets(
+                modifier_type, 
+                Target('modifiers', index=i, parent=parent, type=modifier_type)
             )
-    elif isinstance(element_structure, elt.CompositeElement):
+    else:
         ret = []
-        for i, sub_element in enumerate(element_structure.elements):
-            ret += get_targets(
-                sub_element, 
+        for i, sub_shape in enumerate(shape[1]):
+            ret += _get_targets(
+                sub_shape, 
                 Target(
-                    'elements', index=i, parent=parent, type=type(sub_element)
+                    'elements', 
+                    index=i, 
+                    parent=parent, 
+                    type=_shape_type(sub_shape)
                 )
             )
     return ret
+
+
+@functools.lru_cache(maxsize=TARGET_CACHE_SIZE)
+def _shape_paths(shape):
+    '''Return the set of paths of all nodes in elements of ``shape``.'''
+
+    paths : Set[Tuple[Step, ...]] = {()}
+    if isinstance(shape, tuple):
+        if issubclass(shape[0], elt.ModifiedElement):
+            _, sub_shape, modifier_types = shape
+            paths.update(
+                (('element', None),) + path 
+                for path in _shape_paths(sub_shape)
+            )
+            paths.update(
+                (('modifiers', i),) for i in range(len(modifier_types))
+            )
+        else:
+            for i, sub_shape in enumerate(shape[1]):
+                paths.update(
+                    (('elements', i),) + path 
+                    for path in _shape_paths(sub_shape)
+                )
+    return frozenset(paths)
+
+
+def _shape_type(shape):
+
+    return shape[0] if isinstance(shape, tuple) else shape
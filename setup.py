@@ -18,8 +18,9 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ),
-    python_requires='>=3.7',
+    python_requires='>=3.8',
     install_requires=[
             'pycairo',
+            'numpy',
         ]
 )
\ No newline at end of file
@@ -0,0 +1,48 @@
+'''Builders for element trees shared by tests and benchmarks.
+
+Only element classes present in every version of the package are used, so
+that benchmarks can import these builders when run against older versions.
+'''
+
+
+from pyRavenMatrices.element import (
+    BasicElement, ElementModifier, ModifiedElement
+)
+
+
+def basic(routine, **params):
+    '''Return a basic element drawing ``routine`` with ``params``.'''
+
+    element = BasicElement()
+    element.routine = routine
+    element.params = params
+    return element
+
+
+def modifiers(*pairs):
+    '''Return element modifiers built from ``(decorator, params)`` pairs.'''
+
+    mods = []
+    for decorator, params in pairs:
+        modifier = ElementModifier()
+        modifier.decorator = decorator
+        modifier.params = params
+        mods.append(modifier)
+    return mods
+
+
+def modified(element, *pairs):
+    '''Return ``element`` modified by ``(decorator, params)`` pairs.'''
+
+    return ModifiedElement(element, *modifiers(*pairs))
+
+
+def figures(n, seed=0):
+    '''Return the first ``n`` sandia figures of the dataset ``seed``.'''
+
+    import pyRavenMatrices.lib.sandia.generators as gen
+
+    sg = gen.StructureGenerator()
+    rg = gen.RoutineGenerator()
+    dg = gen.DecoratorGenerator()
+    return [gen.figure_at(seed, i, sg, rg, dg) for i in range(n)]
@@ -0,0 +1,50 @@
+import math
+import numpy as np
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.columnar import FigureTable
+from pyRavenMatrices.element import CompositeElement
+from helpers import basic, modified
+
+
+def sample():
+
+    return [
+        basic(defs.ellipse, r=4),
+        modified(basic(defs.tee), (defs.shading, {'lightness': .25})),
+        CompositeElement(
+            basic(defs.diamond, r=2),
+            modified(
+                basic(defs.triangle),
+                (defs.rotation, {'angle': math.pi / 4}),
+                (defs.numerosity, {'number': 3})
+            )
+        )
+    ]
+
+
+def test_select_negative_indices():
+
+    elements = sample()
+    table = FigureTable.from_elements(elements, defs.registry)
+
+    selected = table.select([-1, 0, -3])
+    assert selected.to_elements() == [elements[2], elements[0], elements[0]]
+    assert table.select(np.array([-2])).to_elements() == [elements[1]]
+    with pytest.raises(IndexError):
+        table.select([-4])
+    with pytest.raises(IndexError):
+        table.select([3])
+
+
+def test_select_masks_and_empty_selections():
+
+    elements = sample()
+    table = FigureTable.from_elements(elements, defs.registry)
+
+    mask = np.array([True, False, True])
+    assert table.select(mask).to_elements() == [elements[0], elements[2]]
+    assert len(table.select([])) == 0
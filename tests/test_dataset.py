@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.render as render
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.dataset import (
+    ShardedDatasetWriter, FIGURES, IMAGES, read_manifest
+)
+from pyRavenMatrices.matrix import CellStructure
+from pyRavenMatrices.store import FigureStore
+from helpers import figures
+
+
+CELL = CellStructure('test', 32, 32, 4, 4)
+
+
+def writer_for(directory, **options):
+
+    options.setdefault('shard_size', 10)
+    return ShardedDatasetWriter(directory, defs.registry, CELL, **options)
+
+
+def interrupted(elements, after):
+    """Yield ``elements``, failing once ``after`` of them were yielded."""
+
+    for i, element in enumerate(elements):
+        if i == after:
+            raise RuntimeError('interrupted')
+        yield element
+
+
+def test_resume_after_interruption(tmp_path):
+
+    directory = str(tmp_path / 'dataset')
+    elements = figures(25)
+    writer = writer_for(directory)
+    with pytest.raises(RuntimeError, match='interrupted'):
+        writer.write(interrupted(elements, 15))
+    assert writer.committed == 10
+    # A shard being written when the process died.
+    stray = os.path.join(directory, 'shard-000001.tmp')
+    os.makedirs(stray, exist_ok=True)
+    open(os.path.join(stray, FIGURES), 'wb').close()
+
+    writer = writer_for(directory)
+    assert writer.committed == 10
+    assert not os.path.exists(stray)
+    assert writer.write(elements[writer.committed:]) == len(elements)
+
+    manifest = read_manifest(directory)
+    assert [shard['count'] for shard in manifest['shards']] == [10, 10, 5]
+    written, images = [], []
+    for shard in manifest['shards']:
+        path = os.path.join(directory, shard['name'])
+        with FigureStore(os.path.join(path, FIGURES), defs.registry) as store:
+            written.extend(store)
+        images.append(np.load(os.path.join(path, IMAGES)))
+    assert written == elements
+    assert np.array_equal(
+        np.concatenate(images), render.render_batch(elements, CELL)
+    )
+
+
+@pytest.mark.parametrize(
+    'settings',
+    [{'shard_size': 5}, {'profile': render.GRAYSCALE_PROFILE}]
+)
+def test_resume_with_other_settings(tmp_path, settings):
+
+    directory = str(tmp_path / 'dataset')
+    writer = writer_for(directory)
+    writer.write(figures(10))
+
+    with pytest.raises(ValueError, match='do not match'):
+        writer_for(directory, **settings)
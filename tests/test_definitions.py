@@ -0,0 +1,108 @@
+import math
+import numpy as np
+import pytest
+
+cairo = pytest.importorskip('cairo')
+
+import pyRavenMatrices.display as dsp
+import pyRavenMatrices.render as render
+import pyRavenMatrices.lib.sandia.definitions as defs
+import pyRavenMatrices.lib.sandia.generators as gen
+from pyRavenMatrices.element import ModifiedElement
+from pyRavenMatrices.instrument import instrument
+from pyRavenMatrices.matrix import CellStructure
+from helpers import basic, modifiers
+
+
+CELL = CellStructure('test', 64, 64, 8, 8)
+
+
+def numerosity_figures():
+    """Return seeded figures using numerosity, plus deep modifier chains."""
+
+    sg = gen.StructureGenerator()
+    rg = gen.RoutineGenerator()
+    dg = gen.DecoratorGenerator()
+    sample = [
+        figure for figure in (gen.figure_at(3, i, sg, rg, dg)
+        for i in range(300)) if 'numerosity' in repr(figure)
+    ]
+
+    base = basic(defs.trapezoid)
+    inner = modifiers(
+        (defs.rotation, {'angle': math.pi / 4}),
+        (defs.scale, {'factor': .75}),
+        (defs.shading, {'lightness': .25})
+    )
+    number, = modifiers((defs.numerosity, {'number': 8}))
+    sample.append(ModifiedElement(base, *inner, number))
+    sample.append(ModifiedElement(ModifiedElement(base, *inner), number))
+    return sample
+
+
+INSTANCED = render.RenderProfile(instancing=True)
+DIRECT = render.RenderProfile()
+
+
+def draw(element, profile):
+    """Return path and pixels of ``element`` drawn with ``profile``."""
+
+    surface = profile.create_surface(CELL)
+    ctx = profile.context(surface)
+    element.draw_in_context(ctx, CELL)
+    path = [
+        (kind, tuple(points)) for kind, points in ctx.copy_path()
+    ]
+    pixels = render.render_array(element, CELL, profile=profile)
+    return path, pixels
+
+
+@pytest.mark.parametrize('element', numerosity_figures())
+def test_instanced_numerosity_matches_direct(element):
+
+    direct_path, direct_pixels = draw(element, DIRECT)
+    path, pixels = draw(element, INSTANCED)
+
+    assert [kind for kind, _ in path] == [kind for kind, _ in direct_path]
+    for (_, points), (_, expected) in zip(path, direct_path):
+        assert points == pytest.approx(expected, abs=1e-6)
+    # Paths may differ in the last bits, and thus antialiased pixels by one
+    # level.
+    difference = np.abs(
+        pixels.view(np.uint8).astype(int) - direct_pixels.view(np.uint8)
+    )
+    assert difference.max() <= 1
+
+
+def test_numerosity_instances_only_with_instancing_profiles(monkeypatch):
+
+    compiled = []
+    compile_routine = dsp.compile_routine
+
+    def counted(routine, cell_structure):
+        compiled.append(cell_structure)
+        return compile_routine(routine, cell_structure)
+
+    monkeypatch.setattr(dsp, 'compile_routine', counted)
+
+    element = numerosity_figures()[-1]
+    render.render_array(element, CELL)
+    render.render_array(element, CELL, profile=DIRECT)
+    surface = INSTANCED.create_surface(CELL)
+    element.draw_in_context(cairo.Context(surface), CELL)
+    assert compiled == []
+    render.render_array(element, CELL, profile=INSTANCED)
+    assert compiled == [CELL]
+
+
+@pytest.mark.parametrize('element', numerosity_figures()[-2:])
+def test_instrumented_counts_do_not_depend_on_instancing(element):
+
+    def counts(profile):
+        with instrument() as stats:
+            render.render_array(element, CELL, profile=profile)
+        return {
+            record.name: (record.calls, dict(record.ops)) for record in stats
+        }
+
+    assert counts(INSTANCED) == counts(DIRECT)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+cairo = pytest.importorskip('cairo')
+
+import pyRavenMatrices.display as dsp
+import pyRavenMatrices.render as render
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.matrix import CellStructure
+from helpers import basic, modified
+
+
+CELL = CellStructure('test', 64, 64, 8, 8)
+SHAPES = [
+    defs.ellipse, defs.triangle, defs.rectangle, defs.trapezoid,
+    defs.diamond, defs.tee
+]
+MODIFIERS = [
+    (defs.scale, {'factor': .75}),
+    (defs.rotation, {'angle': 1.}),
+    (defs.shading, {'lightness': .25}),
+    (defs.numerosity, {'number': 4})
+]
+
+
+def stroked(ctx, cell_structure):
+    """Stroke an ellipse drawn under a transformation."""
+
+    ctx.save()
+    ctx.translate(cell_structure.width / 2, cell_structure.height / 2)
+    ctx.scale(3, 1)
+    ctx.arc(0, 0, cell_structure.width / 8, 0, 2 * np.pi)
+    ctx.restore()
+    ctx.move_to(0, 0)
+    ctx.scale(4, 2)
+    ctx.line_to(8, 8)
+    ctx.stroke()
+
+
+def draw(routine, replay):
+    """Return pixels of ``routine`` drawn directly or replayed."""
+
+    profile = render.DEFAULT_PROFILE
+    surface = profile.create_surface(CELL)
+    ctx = profile.context(surface)
+    ctx.set_source_rgb(1., 1., 1.)
+    ctx.paint()
+    ctx.set_source_rgb(0., 0., 0.)
+    ctx.translate(2, 3)
+    if replay:
+        dsp.compile_routine(routine, CELL).replay(ctx)
+    else:
+        routine(ctx, CELL)
+    ctx.stroke()
+    return render.surface_array(surface).copy()
+
+
+@pytest.mark.parametrize(
+    'routine',
+    [basic(shape).draw_in_context for shape in SHAPES] + [
+        modified(basic(defs.trapezoid, r=2), pair).draw_in_context
+        for pair in MODIFIERS
+    ] + [
+        modified(basic(defs.tee), *MODIFIERS).draw_in_context,
+        stroked
+    ]
+)
+def test_replay_matches_direct(routine):
+
+    direct = draw(routine, False)
+    replayed = draw(routine, True)
+    # Paths may differ in the last bits, and thus antialiased pixels by one
+    # level.
+    difference = np.abs(
+        replayed.view(np.uint8).astype(int) - direct.view(np.uint8)
+    )
+    assert difference.max() <= 1
+
+
+def test_untraceable_calls_raise():
+
+    def masked(ctx, cell_structure):
+        ctx.mask_surface(cairo.ImageSurface(cairo.FORMAT_A8, 1, 1))
+
+    with pytest.raises(ValueError, match='mask_surface'):
+        dsp.compile_routine(masked, CELL)
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.element import CompositeElement, get_subtrees
+from helpers import basic, figures, modified
+
+
+def subtrees(element):
+    """Return unique subtrees of ``element``, deduplicated by equality."""
+
+    output = [element]
+    for sub in output:
+        children = []
+        if hasattr(sub, 'elements'):
+            children = sub.elements
+        elif hasattr(sub, 'modifiers'):
+            children = [sub.element] + sub.modifiers
+        for child in children:
+            if all(child != other for other in output):
+                output.append(child)
+    return output
+
+
+def test_get_subtrees():
+
+    tee = modified(basic(defs.tee), (defs.shading, {}))
+    nested = CompositeElement(
+        tee, modified(tee, (defs.numerosity, {'number': 3})), tee
+    )
+    for element in figures(100) + [nested]:
+        assert get_subtrees(element) == subtrees(element)
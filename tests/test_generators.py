@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.lib.sandia.definitions as defs
+import pyRavenMatrices.lib.sandia.generators as gen
+
+
+def test_tables_follow_distributions_changed_in_place():
+
+    rg = gen.RoutineGenerator()
+    assert set(rg.sample(size=50)) == set(rg.routines)
+
+    for routine in rg.routines:
+        rg.routines[routine] = 0.
+    rg.routines[defs.tee] = 1.
+    assert rg.sample(size=50) == [defs.tee] * 50
+
+    dg = gen.DecoratorGenerator()
+    angles = dg.params[defs.rotation]['angle']
+    assert len(dg.restricted_rotation_params()['angle']) == 3
+    angles.clear()
+    angles.update({1.: .5, 4.: .5})
+    assert dg.restricted_rotation_params() == {'angle': {1.: 1.}}
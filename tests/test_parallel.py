@@ -0,0 +1,76 @@
+from multiprocessing import shared_memory
+import numpy as np
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.render as render
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.matrix import CellStructure
+from pyRavenMatrices.parallel import (
+    ParallelRenderer, SharedBatch, encode_element, decode_element, _functions
+)
+from pyRavenMatrices.registry import Registry
+from helpers import figures
+
+
+CELL = CellStructure('test', 32, 32, 4, 4)
+
+
+def test_encoding_round_trip():
+
+    registry = Registry()
+    for figure in figures(100):
+        encoded = encode_element(figure, registry)
+        assert decode_element(encoded, _functions(registry)) == figure
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+@pytest.mark.parametrize('max_pending', [1, None])
+def test_render_matches_render_batch(ordered, max_pending):
+
+    elements = figures(20)
+    expected = render.render_batch(elements, CELL)
+    # Functions outside the initial registry are shipped with chunks.
+    with ParallelRenderer(
+        CELL,
+        processes=2,
+        chunksize=3,
+        ordered=ordered,
+        max_pending=max_pending,
+        functions=[defs.ellipse]
+    ) as renderer:
+        results = list(renderer.render(elements))
+
+    indices = [index for index, _ in results]
+    if ordered:
+        assert indices == list(range(len(elements)))
+    else:
+        assert sorted(indices) == list(range(len(elements)))
+    for index, pixels in results:
+        assert np.array_equal(pixels, expected[index])
+
+
+@pytest.mark.parametrize(
+    'profile', [render.DEFAULT_PROFILE, render.GRAYSCALE_PROFILE]
+)
+def test_render_shared(profile):
+
+    elements = figures(20)
+    expected = render.render_batch(elements, CELL, profile=profile)
+    with ParallelRenderer(
+        CELL, processes=2, chunksize=3, profile=profile
+    ) as renderer:
+        batch = renderer.render_shared(elements)
+        name = batch.name
+        assert np.array_equal(batch.array, expected)
+        # Batches may be reused, and workers switch between batches.
+        with SharedBatch(expected.shape, profile) as other:
+            renderer.render_shared(elements[::-1], other)
+            assert np.array_equal(other.array, expected[::-1])
+        renderer.render_shared(elements, batch)
+        assert np.array_equal(batch.array, expected)
+    batch.close()
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
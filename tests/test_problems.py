@@ -0,0 +1,64 @@
+import math
+import numpy as np
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.element import CompositeElement
+from pyRavenMatrices.matrix import MatrixStructure
+from pyRavenMatrices.lib.sandia.problems import ProblemGenerator, visual_key
+from helpers import basic, modified
+
+
+def test_visual_key_symmetric_rotations():
+
+    def rotated(routine, angle):
+        return modified(
+            basic(routine, r=8),
+            (defs.rotation, {'angle': angle}),
+            (defs.numerosity, {'number': 5})
+        )
+
+    angle = 3 * math.pi / 4
+    assert (
+        visual_key(rotated(defs.ellipse, angle + math.pi)) ==
+        visual_key(rotated(defs.ellipse, angle))
+    )
+    assert (
+        visual_key(rotated(defs.triangle, angle + math.pi)) !=
+        visual_key(rotated(defs.triangle, angle))
+    )
+
+
+def test_visual_key_unshaded_composites():
+
+    tee, triangle = basic(defs.tee, r=.25), basic(defs.triangle, r=2)
+    shaded = modified(basic(defs.diamond, r=2), (defs.shading, {}))
+    assert (
+        visual_key(CompositeElement(tee, triangle, tee)) ==
+        visual_key(CompositeElement(triangle, triangle, tee))
+    )
+    assert (
+        visual_key(CompositeElement(shaded, tee)) !=
+        visual_key(CompositeElement(tee, shaded))
+    )
+
+
+def test_alternatives_are_distinct():
+
+    generator = ProblemGenerator(MatrixStructure('test', 64, 64))
+    problems = generator.problems(2000, rng=np.random.default_rng(0))
+    for problem in problems:
+        keys = [visual_key(figure) for figure in problem.alternatives]
+        assert len(set(keys)) == len(keys), problem.alternatives
+
+
+def test_problems_gives_up():
+
+    generator = ProblemGenerator(
+        MatrixStructure('test', 64, 64, num_alternatives=400),
+        max_failures=64
+    )
+    with pytest.raises(ValueError):
+        next(generator.problems(rng=np.random.default_rng(0)))
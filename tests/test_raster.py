@@ -0,0 +1,147 @@
+import math
+import numpy as np
+import pytest
+
+cairo = pytest.importorskip('cairo')
+
+import pyRavenMatrices.render as render
+import pyRavenMatrices.lib.sandia.definitions as defs
+import pyRavenMatrices.lib.sandia.generators as gen
+import pyRavenMatrices.lib.sandia.raster as raster
+from pyRavenMatrices.element import ModifiedElement, CompositeElement
+from pyRavenMatrices.matrix import CellStructure
+from helpers import basic, modified
+
+
+CELL = CellStructure('test', 64, 64, 8, 8)
+
+
+def figures():
+    """Return seeded figures plus figures exercising every modifier."""
+
+    sg = gen.StructureGenerator()
+    rg = gen.RoutineGenerator()
+    dg = gen.DecoratorGenerator()
+    sample = [gen.figure_at(0, i, sg, rg, dg) for i in range(64)]
+    sample += [
+        modified(
+            basic(defs.triangle, r=2),
+            (defs.rotation, {'angle': math.pi / 4}),
+            (defs.shading, {'lightness': .25})
+        ),
+        modified(
+            basic(defs.ellipse, r=4),
+            (defs.shading, {'lightness': .75}),
+            (defs.numerosity, {'number': 7})
+        ),
+        modified(
+            basic(defs.tee),
+            (defs.scale, {'factor': .75}),
+            (defs.rotation, {'angle': math.pi / 2}),
+            (defs.numerosity, {'number': 4})
+        ),
+        CompositeElement(
+            modified(basic(defs.rectangle), (defs.shading, {})),
+            modified(
+                basic(defs.diamond, r=2),
+                (defs.rotation, {'angle': - math.pi / 4}),
+                (defs.shading, {'lightness': 0.})
+            )
+        )
+    ]
+    return sample
+
+
+def decorators(element):
+
+    if isinstance(element, ModifiedElement):
+        return (
+            {modifier.decorator for modifier in element.modifiers} |
+            decorators(element.element)
+        )
+    elif isinstance(element, CompositeElement):
+        return set().union(*map(decorators, element.elements))
+    return set()
+
+
+# Aliased pixels are either covered or not, so single pixels along edges may
+# differ entirely.
+@pytest.mark.parametrize(
+    'profile, pixel_tolerance',
+    [
+        (render.DEFAULT_PROFILE, .75),
+        (render.GRAYSCALE_PROFILE, .75),
+        (render.PREVIEW_PROFILE, 1.)
+    ]
+)
+def test_matches_cairo(profile, pixel_tolerance):
+
+    sample = figures()
+    used = set().union(*map(decorators, sample))
+    assert {defs.shading, defs.numerosity, defs.rotation} <= used
+
+    differences = raster.compare_with_cairo(sample, CELL, profile=profile)
+    matches = raster.matches_cairo(
+        sample, CELL, pixel_tolerance=pixel_tolerance, profile=profile
+    )
+    worst = int(np.argmin(matches))
+    assert matches.all(), (
+        'mean difference {:.4f}, max difference {:.4f} for {}'.format(
+            differences[worst].mean(),
+            differences[worst].max(),
+            sample[worst]
+        )
+    )
+
+
+def test_render_batch_defaults_to_cairo():
+
+    sample = figures()[:4]
+    assert np.array_equal(
+        raster.render_batch(sample, CELL),
+        render.render_batch(sample, CELL)
+    )
+
+
+def test_render_batch_checks_output():
+
+    sample = figures()[:4]
+    with pytest.raises(ValueError):
+        raster.render_batch(
+            sample,
+            CELL,
+            np.empty((4, 64, 64), dtype=np.uint32),
+            profile=render.GRAYSCALE_PROFILE,
+            backend='numpy'
+        )
+    with pytest.raises(ValueError):
+        raster.render_batch(
+            sample,
+            CELL,
+            np.empty((3, 64, 64), dtype=np.uint32),
+            backend='numpy'
+        )
+    out = np.zeros((5, 64, 64), dtype=np.uint8)
+    raster.render_batch(
+        sample, CELL, out, profile=render.GRAYSCALE_PROFILE, backend='numpy'
+    )
+    assert not out[4].any()
+
+
+def test_chunked_rasterization_matches_whole_batch(monkeypatch):
+
+    sample = figures()
+    whole = raster.rasterize(sample, CELL)
+    # Three figures per chunk.
+    samples = raster.SUPERSAMPLING
+    monkeypatch.setattr(
+        raster, 'CHUNK_SIZE', 3 * 64 * samples * (64 * samples + 1)
+    )
+    assert np.array_equal(raster.rasterize(sample, CELL), whole)
+    out = np.zeros((len(sample), 64, 64), dtype=np.uint8)
+    raster.render_batch(
+        sample, CELL, out, profile=render.GRAYSCALE_PROFILE, backend='numpy'
+    )
+    assert np.array_equal(
+        out, raster.to_pixels(whole, render.GRAYSCALE_PROFILE)
+    )
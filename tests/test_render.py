@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+cairo = pytest.importorskip('cairo')
+
+import pyRavenMatrices.render as render
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.cache import RasterCache
+from pyRavenMatrices.matrix import CellStructure, MatrixStructure
+from helpers import basic, modified
+
+
+CELL = CellStructure('test', 64, 64, 8, 8)
+
+
+def sample():
+
+    return [
+        basic(defs.ellipse, r=4),
+        modified(basic(defs.tee), (defs.shading, {'lightness': .25})),
+        modified(
+            basic(defs.triangle, r=2),
+            (defs.rotation, {}),
+            (defs.numerosity, {'number': 3})
+        )
+    ]
+
+
+@pytest.mark.parametrize(
+    'profile', [render.DEFAULT_PROFILE, render.GRAYSCALE_PROFILE]
+)
+def test_cached_render_batch_matches_direct(profile):
+
+    elements = sample() * 2
+    cache = RasterCache()
+    direct = render.render_batch(elements, CELL, profile=profile)
+    cached = render.render_batch(elements, CELL, profile=profile, cache=cache)
+
+    assert np.array_equal(cached, direct)
+    assert (cache.stats.hits, cache.stats.misses) == (3, 3)
+    pixels = cache.render(elements[0], CELL, profile)
+    assert pixels.shape == (CELL.height, CELL.width)
+    assert pixels.dtype == profile.dtype
+
+
+def test_cached_matrix_renderer_matches_direct():
+
+    structure = MatrixStructure('test', 64, 64, num_alternatives=3)
+    elements = sample()
+    cells = [elements, elements[::-1], [elements[0], elements[1], None]]
+    direct = render.MatrixRenderer(structure, 8, 8)
+    cached = render.MatrixRenderer(structure, 8, 8, cache=RasterCache())
+
+    expected = render.surface_array(direct.render(cells, elements)).copy()
+    for _ in range(2):
+        image = render.surface_array(cached.render(cells, elements))
+        assert np.array_equal(image, expected)
+    assert cached.cache.stats.hits > 0
+
+
+@pytest.mark.parametrize(
+    'profile', 
+    [
+        render.DEFAULT_PROFILE, 
+        render.PREVIEW_PROFILE, 
+        render.GRAYSCALE_PROFILE, 
+        render.EXPORT_PROFILE
+    ]
+)
+def test_recorded_figure_matches_render_array(profile):
+
+    for element in sample():
+        figure = render.RecordedFigure(
+            element,
+            horizontal_margin=CELL.horizontal_margin / CELL.width,
+            vertical_margin=CELL.vertical_margin / CELL.height,
+            width=CELL.width,
+            height=CELL.height,
+            profile=profile
+        )
+        replayed = figure.render_array(CELL.width, CELL.height)
+        direct = render.render_array(element, CELL, profile=profile)
+        assert replayed.dtype == direct.dtype
+        assert np.array_equal(replayed, direct)
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.element import CompositeElement
+from pyRavenMatrices.serialization import dumps, loads
+from helpers import basic, modified
+
+
+def test_children_at_limit():
+
+    leaf = basic(defs.ellipse, r=2)
+    element = CompositeElement(*[leaf] * 255)
+    assert loads(dumps(element, defs.registry), defs.registry) == element
+
+    with pytest.raises(ValueError, match='CompositeElement'):
+        dumps(CompositeElement(*[leaf] * 256), defs.registry)
+    pairs = [(defs.scale, {})] * 255
+    with pytest.raises(ValueError, match='ModifiedElement'):
+        dumps(modified(leaf, *pairs), defs.registry)
+
+
+def test_params_at_limit():
+
+    element = basic(defs.tee, **{'r' * 255: 1.})
+    assert loads(dumps(element, defs.registry), defs.registry) == element
+
+    with pytest.raises(ValueError, match='tee'):
+        dumps(basic(defs.tee, **{'r' * 256: 1.}), defs.registry)
+    params = {'p{}'.format(i): i for i in range(256)}
+    with pytest.raises(ValueError, match='shading'):
+        dumps(modified(basic(defs.tee), (defs.shading, params)), defs.registry)
@@ -0,0 +1,77 @@
+import os
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.serialization import dumps
+from pyRavenMatrices.store import FigureStore, FigureStoreWriter, INDEX_SUFFIX
+from helpers import basic, figures, modified
+
+
+def test_close_with_raw_view_alive(tmp_path):
+
+    path = str(tmp_path / 'figures.bin')
+    elements = [
+        basic(defs.ellipse, r=4),
+        modified(basic(defs.tee), (defs.shading, {'lightness': .25}))
+    ]
+    with FigureStoreWriter(path, defs.registry) as writer:
+        writer.extend(elements)
+
+    store = FigureStore(path, defs.registry)
+    view = store.raw(1)
+    with pytest.raises(BufferError, match='raw'):
+        store.close()
+    # The store stays usable until views are released.
+    assert bytes(view) == dumps(elements[1], defs.registry)
+    assert store[0] == elements[0]
+
+    view.release()
+    store.close()
+
+
+def test_round_trip(tmp_path):
+
+    path = str(tmp_path / 'figures.bin')
+    elements = figures(50)
+    with FigureStoreWriter(path, defs.registry) as writer:
+        writer.extend(elements)
+
+    with FigureStore(path, defs.registry) as store:
+        assert len(store) == len(elements)
+        assert list(store) == elements
+        assert store[-1] == elements[-1]
+        for index in [0, 17, -1, -len(elements)]:
+            view = store.raw(index)
+            assert bytes(view) == dumps(elements[index], defs.registry)
+            view.release()
+        for index in [len(elements), -len(elements) - 1]:
+            with pytest.raises(IndexError):
+                store[index]
+            with pytest.raises(IndexError):
+                store.raw(index)
+
+
+@pytest.mark.parametrize('index_cut', [0, 3])
+def test_append_recovers_partial_writes(tmp_path, index_cut):
+
+    path = str(tmp_path / 'figures.bin')
+    elements = figures(20)
+    with FigureStoreWriter(path, defs.registry) as writer:
+        writer.extend(elements[:10])
+
+    # Simulate a crash while writing the last figure: its data is cut short,
+    # and the index may end with a partial offset.
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1)
+    with open(path + INDEX_SUFFIX, 'r+b') as f:
+        f.truncate(os.path.getsize(path + INDEX_SUFFIX) - index_cut)
+    with FigureStore(path, defs.registry) as store:
+        assert list(store) == elements[:9]
+
+    with FigureStoreWriter(path, defs.registry, append=True) as writer:
+        assert len(writer) == 9
+        writer.extend(elements[9:])
+    with FigureStore(path, defs.registry) as store:
+        assert list(store) == elements
@@ -0,0 +1,220 @@
+import copy
+import numpy as np
+import pytest
+
+pytest.importorskip('cairo')
+
+import pyRavenMatrices.lib.sandia.definitions as defs
+from pyRavenMatrices.element import (
+    BasicElement, CompositeElement, ElementModifier, EmptyElement, 
+    ModifiedElement
+)
+from pyRavenMatrices.transformation import (
+    Target, Transformation, clear_target_cache, get_targets, target_cache_info
+)
+from helpers import basic, figures, modified, modifiers
+
+
+def transformation_for(figure, rng):
+    """Return a transformation rewriting a random subset of leaves."""
+
+    triples = []
+    for target in get_targets(figure):
+        node = target(figure)
+        if isinstance(node, BasicElement):
+            value = {'routine': defs.ellipse, 'params': {'r': 2}}
+        else:
+            value = {'decorator': node.decorator, 'params': {}}
+        if rng.random() < .5:
+            triples.append((target, copy.deepcopy(node), value))
+        else: # A pattern that does not match
+            pattern = copy.deepcopy(node)
+            pattern.params = {'unmatched': True}
+            triples.append((target, pattern, value))
+    return Transformation(*triples)
+
+
+def deepcopy_transform(transformation, element):
+    """Apply ``transformation`` to a deep copy of ``element``, in place."""
+
+    output = copy.deepcopy(element)
+    for target, pattern, value in transformation.triples:
+        if target(element) == pattern:
+            leaf = target(output)
+            if isinstance(leaf, BasicElement):
+                leaf.routine = value['routine']
+            else:
+                leaf.decorator = value['decorator']
+            leaf.params = dict(value['params'])
+    return output
+
+
+def nodes(element, path=()):
+    """Yield ``(path, node)`` pairs for all nodes of ``element``."""
+
+    yield path, element
+    if isinstance(element, ModifiedElement):
+        yield from nodes(element.element, path + (('element', None),))
+        for i, modifier in enumerate(element.modifiers):
+            yield path + (('modifiers', i),), modifier
+    elif hasattr(element, 'elements'):
+        for i, sub in enumerate(element.elements):
+            yield from nodes(sub, path + (('elements', i),))
+
+
+def test_transformation_shares_untouched_subtrees():
+
+    rng = np.random.default_rng(0)
+    for figure in figures(100):
+        transformation = transformation_for(figure, rng)
+        before = copy.deepcopy(figure)
+        output = transformation(figure)
+
+        assert output == deepcopy_transform(transformation, before)
+        assert figure == before
+        rewritten = [
+            target.path() for target, pattern, _ in transformation.triples
+            if target(figure) == pattern
+        ]
+        # Nodes on paths to rewritten leaves are copied, all others shared.
+        copied = {path[:i] for path in rewritten for i in range(len(path) + 1)}
+        outputs = dict(nodes(output))
+        for path, node in nodes(figure):
+            if path in copied:
+                assert outputs[path] is not node
+            else:
+                assert outputs[path] is node
+
+
+def fresh_targets(element, parent=None):
+    """Return targets of ``element`` as found by walking it, uncached."""
+
+    if isinstance(element, EmptyElement):
+        return []
+    elif isinstance(element, ModifiedElement):
+        ret = fresh_targets(
+            element.element, 
+            Target('element', parent=parent, type=type(element.element))
+        )
+        for i, modifier in enumerate(element.modifiers):
+            ret.append(Target(
+                'modifiers', index=i, parent=parent, type=type(modifier)
+            ))
+        return ret
+    elif isinstance(element, CompositeElement):
+        ret = []
+        for i, sub in enumerate(element.elements):
+            ret += fresh_targets(
+                sub, Target('elements', index=i, parent=parent, type=type(sub))
+            )
+        return ret
+    else:
+        return [parent] if parent else [Target(type=type(element))]
+
+
+def test_cached_targets_match_fresh_targets():
+
+    tee = basic(defs.tee, r=.5)
+    same_shape = [
+        modified(basic(defs.tee, r=.5), (defs.shading, {'lightness': .25})),
+        modified(basic(defs.ellipse, r=4), (defs.rotation, {}))
+    ]
+    with_empty = [
+        EmptyElement(),
+        CompositeElement(EmptyElement(), tee),
+        modified(CompositeElement(tee, EmptyElement()), (defs.scale, {}))
+    ]
+    clear_target_cache()
+    for element in figures(100) + same_shape + with_empty:
+        for _ in range(2): # Cache miss, then hit.
+            targets = get_targets(element)
+            assert targets == fresh_targets(element)
+            assert [target(element) for target in targets] == [
+                target(element) for target in fresh_targets(element)
+            ]
+            targets.clear() # Returned lists are not shared with the cache.
+    assert target_cache_info().hits >= 100
+    assert get_targets(EmptyElement()) == []
+
+
+def test_target_equality():
+
+    element = Target('element', type=BasicElement)
+    assert (element == Target('element', type=BasicElement)) is True
+    assert (element == Target('modifiers', index=0)) is False
+    assert (element == Target('element', type=EmptyElement)) is False
+    assert (
+        Target('elements', index=1, parent=element) != 
+        Target('elements', index=0, parent=element)
+    )
+    assert len({element, Target('element', type=BasicElement)}) == 1
+
+
+def test_target_path_and_replace():
+
+    inner = modified(basic(defs.tee), (defs.shading, {}))
+    figure = CompositeElement(basic(defs.ellipse), inner)
+    before = copy.deepcopy(figure)
+    target = Target(
+        'modifiers', 
+        index=0, 
+        parent=Target('elements', index=1, type=ModifiedElement), 
+        type=type(inner.modifiers[0])
+    )
+    assert target.path() == (('elements', 1), ('modifiers', 0))
+    assert target(figure) is inner.modifiers[0]
+
+    node = copy.deepcopy(inner.modifiers[0])
+    node.params = {'lightness': .75}
+    output = target.replace(figure, node)
+    assert target(output) is node
+    assert output.elements[0] is figure.elements[0]
+    assert output.elements[1].element is inner.element
+    assert figure == before
+
+    root = Target(type=BasicElement)
+    assert root.path() == ()
+    assert root.replace(figure, node) is node
+
+
+def test_apply_many_matches_call():
+
+    shading, = modifiers((defs.shading, {'lightness': .25}))
+    transformation = Transformation(
+        (
+            Target('element', type=BasicElement), 
+            basic(defs.tee, r=.5), 
+            {'routine': defs.ellipse, 'params': {'r': 2}}
+        ),
+        (
+            Target('modifiers', index=0, type=ElementModifier), 
+            shading, 
+            {'decorator': defs.shading, 'params': {'lightness': .75}}
+        )
+    )
+    both = modified(basic(defs.tee, r=.5), (defs.shading, {'lightness': .25}))
+    elements = [
+        both,
+        modified(basic(defs.tee, r=.5), (defs.rotation, {})),
+        modified(
+            basic(defs.tee, r=1), 
+            (defs.shading, {'lightness': .25}), 
+            (defs.scale, {})
+        ),
+        modified(basic(defs.ellipse), (defs.rotation, {}), (defs.scale, {})),
+        both,
+        copy.deepcopy(both)
+    ]
+    unmatched = elements[3]
+
+    outputs = transformation.apply_many(elements)
+    assert outputs == [transformation(element) for element in elements]
+    assert outputs[0] is outputs[4] is outputs[5]
+    assert outputs[3] is unmatched is transformation(unmatched)
+    assert both == elements[5]
+
+    composite = CompositeElement(both, both)
+    with pytest.raises(AttributeError):
+        transformation(composite)
+    with pytest.raises(AttributeError):
+        transformation.apply_many([both, composite])